@@ -0,0 +1,377 @@
+"""
+Benchmarks every stage of the processing pipeline on synthetic data of
+growing size and records wall time and peak memory per stage, so scaling
+regressions show up as a change in these numbers:
+
+    python benchmarks/bench_pipeline.py --rows 1e5 1e6 1e7 --output bench.json
+
+Each size is the number of rows in the aging file; the CV and EIS files
+scale with it (see --cv-fraction and --eis-fraction). Data sets are written
+once to --data-dir and reused. Timings are the best of --repeat runs without
+tracing; peak memory comes from one extra run under tracemalloc and counts
+only what each stage allocates itself. The parse and thumbnail caches are
+off unless --cache is given, so read times are real parses and thumbnails
+are really drawn. The DataWindow stage renders
+off-screen and is skipped when PyQt5 or matplotlib is missing.
+
+For every size the aging file is also loaded in each of MEMORY_LAYOUTS, and
+the peak and steady-state memory per million rows kept are reported (see
+AgingData.measure_memory); --no-memory skips this.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+sys.path.insert(0, SRC)
+
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+import parse_cache
+import thumbnail_cache
+
+from aging_methods import AgingData
+from cvs import CVs
+from eis import Eis
+from data_export import export_data
+from eis_fitting import fit_eis, spectra_neighbours
+from kramers_kronig import validate_eis
+from data_processing_funcs import STREAMING_THRESHOLD, CHUNKSIZE
+
+MASS = synthetic_data.MASS
+AREA = synthetic_data.AREA
+
+# AgingData options of the in-memory layouts compared by aging_memory
+MEMORY_LAYOUTS = [
+    ("full", {}),
+    ("compact", {"compact": True}),
+    ("compact float32", {"compact": True, "float32": True}),
+]
+
+
+def read_data(state):
+    # same settings as calc_aging_data
+    file_name = state["files"]["aging_data_display"]
+    aging = AgingData(mass=MASS, area=AREA, compact=True)
+    if os.path.getsize(file_name) > STREAMING_THRESHOLD:
+        aging.read_data(file_name, chunksize=CHUNKSIZE)
+    else:
+        aging.read_data(file_name)
+    state["aging"] = aging
+    return len(aging.df)
+
+
+def calc_cap_IR_drop(state):
+    state["aging"].calc_cap_IR_drop()
+    return len(state["aging"].df)
+
+
+def calc_Qirr(state):
+    state["aging"].calc_Qirr()
+    return len(state["aging"].df)
+
+
+def get_leakage_current(state):
+    state["aging"].get_leakage_current()
+    return len(state["aging"].df)
+
+
+def cv_read_prep_data(state):
+    for stage in ["before", "after"]:
+        state[f"cvs_{stage}"] = {}
+        for label, rate in [("five", 5), ("p_5", 0.5)]:
+            cv = CVs(rate=rate, mass=MASS)
+            cv.read_prep_data(state["files"][f"cvs_{label}_{stage}_display"])
+            state[f"cvs_{stage}"][rate] = cv
+    return sum(len(cv.df) for cv in all_cvs(state))
+
+
+def cv_calc_capacitance(state):
+    for cv in all_cvs(state):
+        cv.calc_capacitance()
+    return sum(len(cv.df) for cv in all_cvs(state))
+
+
+def eis_read_data(state):
+    for stage in ["before", "after"]:
+        state[f"eis_{stage}"] = {}
+        for label, key in [("ocv", "OCV"), ("p_5V", "0.5 V"), ("one_V", "1.0 V")]:
+            eis = Eis(area=AREA)
+            eis.read_data(state["files"][f"eis_{label}_{stage}_display"])
+            state[f"eis_{stage}"][key] = eis
+    return sum(len(eis.df) for eis in all_eis(state))
+
+
+def eis_calc_eis_cap(state):
+    for eis in all_eis(state):
+        eis.calc_eis_cap()
+    return sum(len(eis.df) for eis in all_eis(state))
+
+
+def eis_fit(state):
+    eis_data, neighbours = spectra_neighbours(state["eis_before"], state["eis_after"])
+    fit_eis(eis_data, neighbours=neighbours)
+    return sum(len(eis.df) for eis in all_eis(state))
+
+
+def eis_validate(state):
+    validate_eis(all_eis(state))
+    return sum(len(eis.df) for eis in all_eis(state))
+
+
+def prep_export(state):
+    aging = state["aging"]
+    aging.get_cap_decrease()
+    aging.get_resist_increase()
+    aging.prep_data()
+    aging.prep_first_and_last_cycle()
+    aging.prep_export()
+    for item in all_cvs(state) + all_eis(state):
+        item.prep_export()
+    return len(aging.data_dict)
+
+
+def data_window(state):
+    from PyQt5.QtWidgets import QApplication
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+    from data_window_ui import DataWindow
+
+    app = QApplication.instance() or QApplication(["bench"])
+    if not thumbnail_cache.PERSIST:
+        # render the thumbnails again in every repeat
+        thumbnail_cache.forget()
+    window = DataWindow(*results(state))
+    window.show()
+    # the first page and the thumbnails are drawn from the event loop
+    while window.pending_thumbnails or not window.built:
+        app.processEvents()
+    canvases = window.findChildren(FigureCanvasQTAgg)
+    for canvas in canvases:
+        canvas.draw()
+    window.close()
+    app.processEvents()
+    return len(canvases)
+
+
+def export(state):
+    file_name = os.path.join(state["data_dir"], "bench_export.xlsx")
+    export_data(file_name, *results(state))
+    os.remove(file_name)
+    aging = state["aging"]
+    frames = [aging.ccd_curves, aging.aging_df]
+    frames += [cv.cvs_df for cv in all_cvs(state)]
+    frames += [eis.eis_df for eis in all_eis(state)]
+    return sum(len(frame) for frame in frames)
+
+
+def all_cvs(state):
+    return list(state["cvs_before"].values()) + list(state["cvs_after"].values())
+
+
+def all_eis(state):
+    return list(state["eis_before"].values()) + list(state["eis_after"].values())
+
+
+def results(state):
+    return (
+        state["aging"],
+        state["cvs_before"],
+        state["cvs_after"],
+        state["eis_before"],
+        state["eis_after"],
+    )
+
+
+STAGES = [
+    ("AgingData.read_data", read_data),
+    ("AgingData.calc_cap_IR_drop", calc_cap_IR_drop),
+    ("AgingData.calc_Qirr", calc_Qirr),
+    ("AgingData.get_leakage_current", get_leakage_current),
+    ("CVs.read_prep_data", cv_read_prep_data),
+    ("CVs.calc_capacitance", cv_calc_capacitance),
+    ("Eis.read_data", eis_read_data),
+    ("Eis.calc_eis_cap", eis_calc_eis_cap),
+    ("fit_eis", eis_fit),
+    ("validate_eis", eis_validate),
+    ("prep_export", prep_export),
+    ("DataWindow", data_window),
+    ("export_data", export),
+]
+
+
+def gui_available():
+    try:
+        import PyQt5.QtWidgets
+        import matplotlib
+    except ImportError:
+        return False
+    return True
+
+
+def run_stages(stages, files, data_dir, memory=False):
+    """
+    Runs the stages in order on one data set and returns (rows, seconds,
+    peak bytes or None) per stage.
+    """
+    state = {"files": files, "data_dir": data_dir}
+    measured = []
+    for _, func in stages:
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        rows = func(state)
+        seconds = time.perf_counter() - start
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        measured.append((rows, seconds, peak))
+    return measured
+
+
+def aging_memory(files):
+    """
+    Rows kept and peak and steady-state MB per million rows of the aging
+    data in every layout, read as calc_aging_data would.
+    """
+    file_name = files["aging_data_display"]
+    chunksize = None
+    if os.path.getsize(file_name) > STREAMING_THRESHOLD:
+        chunksize = CHUNKSIZE
+    results = []
+    for layout, options in MEMORY_LAYOUTS:
+        aging = AgingData(mass=MASS, area=AREA, **options)
+        results.append({"layout": layout, **aging.measure_memory(file_name, chunksize)})
+    return results
+
+
+def benchmark(size, args, stages):
+    points, float_points = args.points, args.float_points
+    cycles = max(
+        6, round(size / synthetic_data.aging_rows_per_cycle(points, float_points))
+    )
+    cv_points = max(1000, round(size * args.cv_fraction / args.cv_cycles))
+    eis_points = max(43, round(size * args.eis_fraction))
+    files = synthetic_data.write_dataset(
+        args.data_dir,
+        cycles,
+        points,
+        float_points,
+        cv_cycles=args.cv_cycles,
+        cv_points=cv_points,
+        eis_points=eis_points,
+    )
+
+    best = None
+    for _ in range(args.repeat):
+        timed = run_stages(stages, files, args.data_dir)
+        seconds = [item[1] for item in timed]
+        best = seconds if best is None else np.minimum(best, seconds)
+    traced = run_stages(stages, files, args.data_dir, memory=True)
+
+    records = []
+    for (name, _), (rows, _, peak), seconds in zip(stages, traced, best):
+        records.append(
+            {
+                "size": size,
+                "aging_cycles": cycles,
+                "stage": name,
+                "rows": rows,
+                "wall_s": float(seconds),
+                "peak_MB": peak / 1024**2,
+            }
+        )
+    memory = [] if args.no_memory else aging_memory(files)
+    return records, [{"size": size, **result} for result in memory]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows", type=float, nargs="+", default=[1e5, 1e6], help="aging file rows"
+    )
+    parser.add_argument("--points", type=int, default=80, help="rows per branch")
+    parser.add_argument("--float-points", type=int, default=300)
+    parser.add_argument("--cv-cycles", type=int, default=3)
+    parser.add_argument("--cv-fraction", type=float, default=0.1)
+    parser.add_argument("--eis-fraction", type=float, default=1e-3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", help="only run stages containing these")
+    parser.add_argument("--no-gui", action="store_true", help="skip DataWindow")
+    parser.add_argument("--cache", action="store_true", help="use the parse cache")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the aging memory layouts"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "supercap_bench"),
+        help="where synthetic files are kept",
+    )
+    parser.add_argument("--output", help="JSON file the results are written to")
+    args = parser.parse_args(argv)
+
+    parse_cache.CACHE_ENABLED = args.cache
+    thumbnail_cache.PERSIST = args.cache
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    stages = STAGES
+    if args.no_gui or not gui_available():
+        stages = [stage for stage in stages if stage[0] != "DataWindow"]
+    if args.stages:
+        # later stages need the state built by the earlier ones
+        last = max(
+            idx
+            for idx, (name, _) in enumerate(stages)
+            if any(part in name for part in args.stages)
+        )
+        stages = stages[: last + 1]
+
+    records, memory = [], []
+    for size in args.rows:
+        size_records, size_memory = benchmark(int(size), args, stages)
+        records += size_records
+        memory += size_memory
+        print(f"\n{int(size):,} aging rows")
+        for record in size_records:
+            print(
+                f"  {record['stage']:<32}{record['rows']:>12,}"
+                f"{record['wall_s']:>11.3f} s{record['peak_MB']:>10.1f} MB"
+            )
+        if size_memory:
+            print(
+                f"  {'aging memory per 1M rows':<32}{'rows':>12}"
+                f"{'peak':>13}{'steady':>13}"
+            )
+        for result in size_memory:
+            print(
+                f"  {result['layout']:<32}{result['rows']:>12,}"
+                f"{result['peak_MB_per_million_rows']:>10.1f} MB"
+                f"{result['steady_MB_per_million_rows']:>10.1f} MB"
+            )
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "pandas": pd.__version__,
+                    "machine": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "results": records,
+                    "aging_memory": memory,
+                },
+                handle,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
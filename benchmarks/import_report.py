@@ -0,0 +1,73 @@
+"""
+Reports how long importing a module of the application takes, broken down by
+top-level package, using python -X importtime. Run it against main to see
+what loads before the import window appears:
+
+    python benchmarks/import_report.py            # main
+    python benchmarks/import_report.py data_window_ui
+
+Each module is imported in a fresh interpreter with the parse cache switched
+off. The heavy packages the GUI defers (numpy, pandas, scipy, matplotlib)
+are flagged if they show up.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+from collections import defaultdict
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+HEAVY = ["numpy", "pandas", "scipy", "matplotlib"]
+
+
+def import_times(module, repeat=3):
+    """
+    Self time per top-level package and the total time of importing module,
+    both in ms, taking the fastest of repeat runs.
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=SRC,
+            env={**os.environ, "SUPERCAP_CACHE": "0"},
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            error = result.stderr.strip().splitlines()[-1]
+            raise SystemExit(f"import {module} failed: {error}")
+        packages = defaultdict(float)
+        total = 0.0
+        for line in result.stderr.splitlines():
+            fields = line.removeprefix("import time:").split("|")
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue
+            name = fields[2].strip()
+            packages[name.split(".")[0]] += int(fields[0]) / 1000
+            if name == module:
+                total = int(fields[1]) / 1000
+        if best is None or total < best[1]:
+            best = (dict(packages), total)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("modules", nargs="*", default=["main"])
+    parser.add_argument("--top", type=int, default=15, help="packages listed")
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        packages, total = import_times(module)
+        print(f"import {module}: {total:.1f} ms")
+        for name, ms in sorted(packages.items(), key=lambda x: -x[1])[: args.top]:
+            print(f"  {name:<30}{ms:>10.1f} ms")
+        heavy = [name for name in HEAVY if name in packages]
+        print(f"  heavy packages loaded: {', '.join(heavy) if heavy else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
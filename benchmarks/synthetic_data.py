@@ -0,0 +1,291 @@
+"""
+Writes synthetic data files in the formats the application reads, at any
+scale: Landt aging CSVs, EC-Lab CV text files and EC-Lab EIS text files. The
+curves are simple physical models (a capacitor that fades and grows in
+resistance while aging, a de Levie pore for the impedance) with a little
+noise, so every calculation gives sensible numbers.
+
+    python benchmarks/synthetic_data.py out_dir --cycles 6000 --points 80
+
+Large aging files are written a block of cycles at a time, so memory use does
+not grow with the file.
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+MASS = 0.0029
+AREA = 0.502
+
+AGING_COLUMNS = [
+    "Record",
+    "Cycle",
+    "StepStatus",
+    "TestTime/Sec",
+    "Voltage/V",
+    "Current/uA",
+    "Capacity/uAh",
+]
+CV_COLUMNS = ["time/s", "Ewe/V", "<I>/mA", "cycle number"]
+EIS_COLUMNS = [
+    "freq/Hz",
+    "Re(Z)/Ohm",
+    "-Im(Z)/Ohm",
+    "|Z|/Ohm",
+    "Phase(Z)/deg",
+    "time/s",
+    "<Ewe>/V",
+    "<I>/mA",
+]
+
+
+def aging_rows_per_cycle(points, float_points, cycle_interval=6):
+    """
+    Average number of rows per cycle of write_aging_csv.
+    """
+    return 2 * points + float_points / cycle_interval
+
+
+def write_aging_csv(
+    file_name,
+    cycles,
+    points=80,
+    float_points=300,
+    float_duration=36000,
+    cycle_interval=6,
+    current=500,
+    capacitance=100,
+    mass=MASS,
+    fade=0.2,
+    block_size=1000,
+    seed=0,
+):
+    """
+    Landt aging data: every cycle is a galvanostatic charge (CCC) and
+    discharge (CCD) between 0 and 1 V at current uA with points rows each,
+    and every cycle_interval-th cycle is followed by float_duration seconds
+    of floating at 1 V (CVC) in float_points rows. The capacitance (F/g)
+    fades and the IR drop grows linearly over the test. Returns the number
+    of rows written.
+    """
+    rng = np.random.default_rng(seed)
+    statuses = np.array(["CCC", "CCD", "CVC"])
+    amps = current / 1e6
+    time, record = 0.0, 0
+    with open(file_name, "w", newline="") as handle:
+        handle.write(",".join(AGING_COLUMNS) + "\n")
+        for first in range(1, cycles + 1, block_size):
+            cycle = np.arange(first, min(first + block_size, cycles + 1))
+            progress = cycle / cycles
+            cell_cap = capacitance * mass * (1 - fade * progress)
+            ir_drop = 0.05 * (1 + progress)
+            floats = np.where(cycle % cycle_interval == 0, float_points, 0)
+            counts = 2 * points + floats
+
+            # position of every row within its cycle and which step it is in
+            cycle_of_row = np.repeat(np.arange(len(cycle)), counts)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            position = np.arange(counts.sum()) - starts[cycle_of_row]
+            step = np.minimum(position // points, 2)
+            frac = np.where(step < 2, position % points, position - 2 * points)
+            frac = frac / np.where(
+                step < 2, points - 1, np.maximum(floats - 1, 1)[cycle_of_row]
+            )
+
+            branch_time = cell_cap / amps
+            dt = np.select(
+                [step == 0, step == 1],
+                [
+                    branch_time[cycle_of_row] / (points - 1),
+                    branch_time[cycle_of_row]
+                    * (1 - ir_drop[cycle_of_row])
+                    / (points - 1),
+                ],
+                float_duration / max(float_points, 1),
+            )
+            test_time = time + np.cumsum(dt) - dt[0]
+            time = test_time[-1] + dt[-1]
+
+            ir = ir_drop[cycle_of_row]
+            voltage = np.select(
+                [step == 0, step == 1], [frac, (1 - ir) * (1 - frac)], 1.0
+            ) + rng.normal(0, 0.001, len(step))
+            float_current = (0.5 + 2 * progress[cycle_of_row]) + 50 * np.exp(-frac * 10)
+            current_ua = np.select(
+                [step == 0, step == 1], [current, -current], float_current
+            ) + rng.normal(0, 0.01, len(step))
+
+            block = pd.DataFrame(
+                {
+                    "Record": np.arange(record, record + len(step)),
+                    "Cycle": cycle[cycle_of_row],
+                    "StepStatus": statuses[step],
+                    "TestTime/Sec": np.floor(test_time),
+                    "Voltage/V": voltage.round(5),
+                    "Current/uA": current_ua.round(3),
+                    "Capacity/uAh": 0.0,
+                }
+            )
+            record += len(step)
+            block.to_csv(handle, header=False, index=False)
+    return record
+
+
+def write_cv_txt(
+    file_name,
+    rate,
+    cycles=3,
+    points=8000,
+    capacitance=100,
+    mass=MASS,
+    window=1.0,
+    seed=0,
+):
+    """
+    EC-Lab cyclic voltammograms at rate mV/s: cycles triangular sweeps of
+    points rows each between 0 V and window V, with the current of a
+    capacitor of capacitance F/g behind a small time constant.
+    """
+    rng = np.random.default_rng(seed)
+    half = points // 2
+    sweep = np.concatenate(
+        [np.linspace(0, window, half), np.linspace(window, 0, points - half)]
+    )
+    direction = np.concatenate([np.ones(half), -np.ones(points - half)])
+    dt = 2 * window / (rate / 1000) / points
+    since_turn = np.concatenate([np.arange(half), np.arange(points - half)]) * dt
+    tau = 0.02 * window / (rate / 1000)
+    current = (
+        capacitance * mass * rate * direction * (1 - np.exp(-since_turn / tau))
+        + rng.normal(0, 0.005, points) * capacitance * mass * rate
+    )
+
+    df = pd.DataFrame(
+        {
+            "time/s": np.arange(cycles * points) * dt,
+            "Ewe/V": np.tile(sweep, cycles),
+            "<I>/mA": np.tile(current, cycles),
+            "cycle number": np.repeat(np.arange(1, cycles + 1), points).astype(float),
+        }
+    )
+    with open(file_name, "w", newline="") as handle:
+        # EC-Lab ends the header line with a tab
+        handle.write("\t".join(CV_COLUMNS) + "\t\n")
+        df.to_csv(handle, sep="\t", header=False, index=False, float_format="%.9E")
+    return len(df)
+
+
+def write_eis_txt(
+    file_name,
+    points=43,
+    f_max=2e5,
+    f_min=1e-2,
+    r_s=0.75,
+    r_ion=1.5,
+    capacitance=0.25,
+    seed=0,
+):
+    """
+    EC-Lab impedance spectrum of points log-spaced frequencies from f_max
+    down to f_min: a series resistance and a de Levie pore with ionic
+    resistance r_ion and capacitance F.
+    """
+    rng = np.random.default_rng(seed)
+    freq = np.logspace(np.log10(f_max), np.log10(f_min), points)
+    omega = 2 * np.pi * freq
+    root = np.sqrt(1j * omega * r_ion * capacitance)
+    z = r_s + r_ion / (root * np.tanh(root))
+    z *= 1 + rng.normal(0, 0.002, points)
+
+    df = pd.DataFrame(
+        {
+            "freq/Hz": freq,
+            "Re(Z)/Ohm": z.real,
+            "-Im(Z)/Ohm": -z.imag,
+            "|Z|/Ohm": np.abs(z),
+            "Phase(Z)/deg": np.degrees(np.angle(z)),
+            "time/s": np.cumsum(5 / freq + 1),
+            "<Ewe>/V": 1e-3,
+            "<I>/mA": 0.2,
+        }
+    )
+    with open(file_name, "w", newline="") as handle:
+        handle.write("\t".join(EIS_COLUMNS) + "\t\n")
+        df.to_csv(handle, sep="\t", header=False, index=False, float_format="%.7E")
+    return len(df)
+
+
+def write_dataset(
+    directory,
+    cycles,
+    points=80,
+    float_points=300,
+    float_duration=36000,
+    cv_cycles=3,
+    cv_points=8000,
+    eis_points=43,
+    reuse=True,
+):
+    """
+    A full set of files for one cell: the aging data, CVs at 5 and 0.5 mV/s
+    and EIS at OCV, 0.5 V and 1 V, before and after aging. Returns the file
+    names keyed like the file arguments of process_data. With reuse, files
+    written earlier with the same parameters are kept.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+
+    def path(name, *params):
+        return os.path.join(directory, f"{name}_{'_'.join(map(str, params))}")
+
+    aging = path("aging", cycles, points, float_points, float_duration) + ".csv"
+    if not (reuse and os.path.exists(aging)):
+        write_aging_csv(aging + ".tmp", cycles, points, float_points, float_duration)
+        os.replace(aging + ".tmp", aging)
+    files["aging_data_display"] = aging
+
+    for stage, fade in [("before", 1.0), ("after", 0.8)]:
+        for label, rate in [("five", 5), ("p_5", 0.5)]:
+            cv = path(f"cv_{rate}_{stage}", cv_cycles, cv_points) + ".txt"
+            if not (reuse and os.path.exists(cv)):
+                write_cv_txt(cv, rate, cv_cycles, cv_points, capacitance=100 * fade)
+            files[f"cvs_{label}_{stage}_display"] = cv
+        for label, r_s in [("ocv", 0.75), ("p_5V", 0.8), ("one_V", 0.85)]:
+            eis = path(f"eis_{label}_{stage}", eis_points) + ".txt"
+            if not (reuse and os.path.exists(eis)):
+                write_eis_txt(eis, eis_points, r_s=r_s / fade, capacitance=0.25 * fade)
+            files[f"eis_{label}_{stage}_display"] = eis
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory")
+    parser.add_argument("--cycles", type=int, default=600, help="aging cycles")
+    parser.add_argument("--points", type=int, default=80, help="rows per branch")
+    parser.add_argument("--float-points", type=int, default=300)
+    parser.add_argument("--float-duration", type=float, default=36000, help="s")
+    parser.add_argument("--cv-cycles", type=int, default=3)
+    parser.add_argument("--cv-points", type=int, default=8000, help="per cycle")
+    parser.add_argument("--eis-points", type=int, default=43)
+    args = parser.parse_args(argv)
+
+    files = write_dataset(
+        args.directory,
+        args.cycles,
+        args.points,
+        args.float_points,
+        args.float_duration,
+        args.cv_cycles,
+        args.cv_points,
+        args.eis_points,
+        reuse=False,
+    )
+    for name in files.values():
+        print(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,166 +1,704 @@
+import io
+import os
 import re
+import pickle
+import hashlib
+import tracemalloc
 import numpy as np
 import pandas as pd
 
 from scipy import integrate
-from collections import Counter
+from cycle_index import CycleIndex, concat_ranges
+from line_fit import fit_segments
+from pandas.api.types import union_categoricals
+
+import parse_cache
+import progress
+import decimation
+import instrumentation
 
 cycle_match = "(?i)Cycle"
 status_match = "(?i)StepStatus|Step-State"
 
-
+# the only columns the calculations use besides cycle number and status
+data_columns = ["TestTime/Sec", "Voltage/V", "Current/uA"]
+
+# bump whenever the contents of the update_data state file change
+STATE_VERSION = 3
+
+# where update_data keeps the state of every file it has processed
+STATE_DIR = os.environ.get(
+    "SUPERCAP_STATE_DIR",
+    os.path.join(os.path.expanduser("~"), ".supercap_aging", "aging_state"),
+)
+
+# rows parsed between progress reports when a whole file is read
+READ_CHUNK_ROWS = 100000
+
+
+def _stream_rows(
+    chunks,
+    cycle_col,
+    status_col,
+    carry=(0.0, None, None),
+    compact=None,
+    cycle_interval=6,
+    position=None,
+):
+    """
+    Integrates the cumulative charge over every row of the chunks, continuing
+    from carry (Q, time and current of the row before the first chunk), and
+    keeps only the rows of every 6th (cycle_interval) cycle and the floating
+    ("CVC") rows, passing them through compact if given. After every chunk,
+    position() (if given) is reported as the fraction of the input read so
+    far. Returns the kept rows, the carry for the next call and the cycle
+    number of the last row.
+    """
+    kept = []
+    total_q, last_time, last_current = carry
+    last_cycle = None
+    for chunk in chunks:
+        # rows without a cycle number, e.g. a blank last row, hold no data
+        missing = chunk[cycle_col].isna()
+        if missing.any():
+            chunk = chunk[~missing].copy()
+            if chunk.empty:
+                continue
+        chunk[cycle_col] = chunk[cycle_col].astype("int64")
+        time = chunk["TestTime/Sec"].to_numpy()
+        current = chunk["Current/uA"].to_numpy()
+        if last_time is not None:
+            total_q += (current[0] + last_current) * (time[0] - last_time) / 2
+        q = integrate.cumtrapz(current, time, initial=0) + total_q
+        chunk["(Q-Qo)/mA.h"] = q / 3.6e6
+        total_q, last_time, last_current = q[-1], time[-1], current[-1]
+        last_cycle = chunk[cycle_col].iloc[-1]
+
+        keep = (chunk[cycle_col] % cycle_interval == 0) | (chunk[status_col] == "CVC")
+        kept.append(compact(chunk[keep]) if compact else chunk[keep])
+        if position is not None:
+            progress.report(position())
+    return kept, (total_q, last_time, last_current), last_cycle
+
+
+def _read_csv(file_name, **kwargs):
+    """
+    pd.read_csv of the whole file. While progress is reported or the run can
+    be cancelled it is parsed in chunks, reporting the fraction read after
+    each one.
+    """
+    if not progress.installed():
+        return pd.read_csv(file_name, **kwargs)
+    size = max(os.path.getsize(file_name), 1)
+    chunks = []
+    with open(file_name, "rb") as handle:
+        for chunk in pd.read_csv(handle, chunksize=READ_CHUNK_ROWS, **kwargs):
+            chunks.append(chunk)
+            progress.report(handle.tell() / size)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _state_file(file_name):
+    """
+    The update_data state file of a data file in STATE_DIR, keyed by its full
+    path, so data folders are never written to.
+    """
+    path = os.path.abspath(file_name)
+    key = hashlib.sha1(path.encode()).hexdigest()[:16]
+    return os.path.join(STATE_DIR, f"{os.path.basename(path)}-{key}.aging_state")
+
+
+def _save_state(state, state_file):
+    """
+    Writes the state to state_file, replacing the old one in a single step.
+    """
+    os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+    with open(state_file + ".tmp", "wb") as handle:
+        pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def _concat_rows(frames, status_col):
+    """
+    Concatenates chunks of rows, keeping the status column categorical when the
+    chunks were compacted with different categories.
+    """
+    statuses = [frame[status_col] for frame in frames]
+    if all(isinstance(status.dtype, pd.CategoricalDtype) for status in statuses):
+        categories = union_categoricals(statuses).categories
+        frames = [
+            frame.assign(**{status_col: status.cat.set_categories(categories)})
+            for frame, status in zip(frames, statuses)
+        ]
+    return pd.concat(frames, ignore_index=True)
+
+
+class _BoundedReader(io.RawIOBase):
+    """
+    Read-only view of an open binary file between two byte offsets.
+    """
+
+    def __init__(self, handle, start, end):
+        handle.seek(start)
+        self.handle = handle
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.handle.read(min(len(buffer), self.remaining))
+        buffer[: len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def _last_line_end(handle, block_size=65536):
+    """
+    Byte offset just past the last newline of the file, so a row that is still
+    being written by the instrument is left for the next run.
+    """
+    end = handle.seek(0, io.SEEK_END)
+    while end > 0:
+        start = max(0, end - block_size)
+        handle.seek(start)
+        newline = handle.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+@instrumentation.instrument
 class AgingData:
-    def __init__(self, mass, area) -> None:
+    def __init__(
+        self,
+        mass,
+        area,
+        time_resolution=1,
+        compact=False,
+        float32=False,
+        cycle_interval=6,
+    ) -> None:
         self.mass = mass
         self.area = area
-
-    def read_data(self, file_name):
+        self.time_resolution = time_resolution
+        self.compact = compact
+        self.float32 = float32
+        self.cycle_interval = cycle_interval
+        # set when df only keeps the rows of every cycle_interval-th cycle
+        # and the floating rows, see stream_data
+        self.filtered = False
+        # set when the "(Q-Qo)/mA.h" column of df was integrated over the whole
+        # file while streaming, so calc_Qirr must not integrate df again
+        self._q_integrated = False
+
+    def read_data(self, file_name, chunksize=None):
         """
         Initially loads data and identifies the column name for the cycle number
         and cycle status columns using the regular expressions defined above.
+        If a chunksize (rows per chunk) is given, the file is streamed instead,
+        see stream_data. With compact set, only the columns the calculations
+        use are loaded, see compact_frame. Whole files are read in chunks
+        while progress is reported, so the read can be followed and cancelled.
+        """
+        if chunksize:
+            self.stream_data(file_name, chunksize)
+            return
+        self.filtered = False
+        self._q_integrated = False
+        if self.compact:
+            dtypes = self.stream_dtypes(pd.read_csv(file_name, nrows=0).columns)
+            dtypes[self.status_col] = "category"
+
+            def read_compact(file_name):
+                return self.compact_frame(
+                    _read_csv(file_name, usecols=list(dtypes), dtype=dtypes)
+                )
+
+            self.df = parse_cache.cached_read(file_name, read_compact, self.variant())
+        else:
+            self.df = parse_cache.cached_read(file_name, _read_csv, "read_csv")
+            self.cycle_col = [col for col in self.df if re.search(cycle_match, col)][0]
+            self.status_col = [col for col in self.df if re.search(status_match, col)][
+                0
+            ]
+        self.build_index()
+
+    def build_index(self):
+        """
+        Indexes the rows of every (cycle, status) pair once so the calculations
+        below slice them instead of filtering the whole table.
+        """
+        self.index = CycleIndex(self.df[self.cycle_col], self.df[self.status_col])
+
+    def variant(self):
+        """
+        Name of the kind of parse used, so cached copies of the same file parsed
+        in different ways are kept apart.
+        """
+        if not self.compact:
+            return "read_csv"
+        return "compact-float32" if self.float32 else "compact"
+
+    def compact_frame(self, df):
+        """
+        Drops the columns the calculations never use and the rows without a
+        cycle number, and stores the status column as a categorical, the cycle
+        column in the narrowest integer type that fits and, if float32 is set,
+        voltage and current as float32.
+        """
+        used = [self.cycle_col, self.status_col, *data_columns, "(Q-Qo)/mA.h"]
+        df = df[[col for col in df if col in used]]
+        missing = df[self.cycle_col].isna()
+        if missing.any():
+            df = df[~missing].reset_index(drop=True)
+        df = df.copy()
+        df[self.status_col] = df[self.status_col].astype("category")
+        df[self.cycle_col] = pd.to_numeric(df[self.cycle_col], downcast="integer")
+        if self.float32:
+            df["Voltage/V"] = df["Voltage/V"].astype("float32")
+            df["Current/uA"] = df["Current/uA"].astype("float32")
+        return df
+
+    def measure_memory(self, file_name, chunksize=None):
+        """
+        Loads the file with read_data while tracing allocations and returns the
+        number of rows kept along with the peak and steady-state memory per
+        million rows (in MB). Memory-mapped columns from the parse cache are not
+        counted.
         """
-        self.df = pd.read_csv(file_name)
-        self.cycle_col = [col for col in self.df if re.search(cycle_match, col)][0]
-        self.status_col = [col for col in self.df if re.search(status_match, col)][0]
+        tracemalloc.start()
+        try:
+            self.read_data(file_name, chunksize)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        rows = len(self.df)
+        scale = 1e6 / max(rows, 1) / 1024**2
+        return {
+            "rows": rows,
+            "peak_MB_per_million_rows": peak * scale,
+            "steady_MB_per_million_rows": self.df.memory_usage(deep=True).sum() * scale,
+        }
+
+    def stream_dtypes(self, header):
+        """
+        Identifies the cycle number and status columns from the header alone and
+        returns the dtypes of the only columns the calculations need.
+        """
+        self.cycle_col = [col for col in header if re.search(cycle_match, col)][0]
+        self.status_col = [col for col in header if re.search(status_match, col)][0]
+
+        # cycle numbers are parsed as floats, as some exports write them as
+        # "1.0" or end with a blank row; _stream_rows makes them integers
+        dtypes = {self.cycle_col: "float64", self.status_col: "object"}
+        dtypes.update({col: "float64" for col in data_columns})
+        for col in dtypes:
+            if col not in header:
+                raise KeyError(col)
+        return dtypes
+
+    def stream_data(self, file_name, chunksize=500000):
+        """
+        Reads the file in chunks of at most chunksize rows, loading only the
+        columns the calculations use and keeping only the rows they need
+        (every 6th cycle plus the floating, "CVC", rows). The cumulative charge
+        used by calc_Qirr is integrated over every row while streaming, carrying
+        the last point of each chunk over to the next one.
+        """
+        dtypes = self.stream_dtypes(pd.read_csv(file_name, nrows=0).columns)
+
+        def read_chunks(file_name):
+            size = max(os.path.getsize(file_name), 1)
+            with open(file_name, "rb") as handle:
+                chunks, _, _ = _stream_rows(
+                    pd.read_csv(
+                        handle, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize
+                    ),
+                    self.cycle_col,
+                    self.status_col,
+                    compact=self.compact_frame if self.compact else None,
+                    cycle_interval=self.cycle_interval,
+                    position=lambda: handle.tell() / size,
+                )
+            return _concat_rows(chunks, self.status_col)
+
+        self.df = parse_cache.cached_read(
+            file_name, read_chunks, f"stream{self.cycle_interval}-{self.variant()}"
+        )
+        self.filtered = True
+        self._q_integrated = True
+        self.build_index()
+
+    def state_params(self):
+        return (
+            self.mass,
+            self.area,
+            self.time_resolution,
+            self.cycle_interval,
+            self.variant(),
+        )
 
-    def resample_time(self, time_series):
+    def load_state(self, state_file, header_line):
+        """
+        Loads the state saved by update_data, returning None if there is none or
+        if it no longer matches the file (rewritten file, different header) or
+        the mass/area/time resolution used for this run.
+        """
+        try:
+            with open(state_file, "rb") as handle:
+                state = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if (
+            state.get("version") != STATE_VERSION
+            or state["header"] != header_line
+            or state["params"] != self.state_params()
+        ):
+            return None
+        return state
+
+    def update_data(self, file_name, state_file=None, chunksize=500000):
+        """
+        Incrementally processes a growing aging file. The state saved by the
+        previous run (byte offset, last cycle, cumulative Q, time and current
+        of the last row and the results of every finished cycle) is loaded from
+        state_file, only the rows appended since then are parsed and the new
+        results are merged into data_dict, total_qirr, q_diff and
+        leakage_current. Rows of the last cycle may still be growing, so they
+        are saved with the state and recomputed on the next run. Afterwards df
+        only holds the rows processed by this run. Without a state_file the
+        state is kept in STATE_DIR; a state file left next to the data file by
+        earlier versions is still read, but no longer written.
+        """
+        if state_file is None:
+            state_file = _state_file(file_name)
+            sibling = os.path.abspath(file_name) + ".aging_state"
+            state_files = [state_file]
+            if os.path.exists(sibling):
+                state_files.append(sibling)
+        else:
+            state_files = [state_file]
+        header = pd.read_csv(file_name, nrows=0).columns
+        dtypes = self.stream_dtypes(header)
+
+        with open(file_name, "rb") as handle:
+            header_line = handle.readline()
+            end = max(len(header_line), _last_line_end(handle))
+
+            for candidate in state_files:
+                state = self.load_state(candidate, header_line)
+                if state is not None:
+                    handle.seek(state["offset"] - len(state["tail"]))
+                    if handle.read(len(state["tail"])) == state["tail"]:
+                        break
+                    state = None
+            if state is None:
+                state = {
+                    "offset": len(header_line),
+                    "carry": (0.0, None, None),
+                    "last_cycle": None,
+                    "pending": None,
+                    "data_dict": {},
+                    "qirr": {},
+                    "leakage": {},
+                }
+
+            chunks, carry, last_cycle = [], state["carry"], state["last_cycle"]
+            start = state["offset"]
+            if end > start:
+                with progress.span(0, 0.7):
+                    chunks, carry, last_cycle = _stream_rows(
+                        pd.read_csv(
+                            _BoundedReader(handle, start, end),
+                            header=None,
+                            names=list(header),
+                            usecols=list(dtypes),
+                            dtype=dtypes,
+                            chunksize=chunksize,
+                        ),
+                        self.cycle_col,
+                        self.status_col,
+                        state["carry"],
+                        compact=self.compact_frame if self.compact else None,
+                        cycle_interval=self.cycle_interval,
+                        position=lambda: (handle.tell() - start) / (end - start),
+                    )
+            handle.seek(max(len(header_line), end - 256))
+            tail = handle.read(end - handle.tell())
+
+        frames = chunks if state["pending"] is None else [state["pending"]] + chunks
+        if frames:
+            rows = _concat_rows(frames, self.status_col)
+        else:
+            rows = pd.DataFrame({col: pd.Series(dtype=dtypes[col]) for col in dtypes})
+            rows[self.cycle_col] = rows[self.cycle_col].astype("int64")
+            rows["(Q-Qo)/mA.h"] = pd.Series(dtype="float64")
+
+        # a characterization cycle still missing its charge or discharge branch
+        # is still running and gets reported on the next run
+        last_rows = rows[self.cycle_col] == last_cycle
+        running = last_cycle is not None and last_cycle % self.cycle_interval == 0
+        if running and not {"CCC", "CCD"} <= set(rows.loc[last_rows, self.status_col]):
+            self.df = rows[~last_rows].reset_index(drop=True)
+        else:
+            self.df = rows
+        self.filtered = True
+        self._q_integrated = True
+        self.build_index()
+
+        with progress.span(0.7, 0.9):
+            self.calc_cap_IR_drop()
+        self.calc_Qirr()
+        self.get_leakage_current()
+
+        qirr = {**state["qirr"], **dict(zip(self.data_dict, self.total_qirr))}
+        leakage = {
+            **state["leakage"],
+            **dict(zip(self.leakage_cycles, self.leakage_current)),
+        }
+        self.data_dict = {**state["data_dict"], **self.data_dict}
+        self.total_qirr = list(qirr.values())
+        self.q_diff = list(np.diff(self.total_qirr, prepend=0.0))
+        self.leakage_cycles = list(leakage)
+        self.leakage_current = list(leakage.values())
+
+        new_state = {
+            "version": STATE_VERSION,
+            "header": header_line,
+            "params": self.state_params(),
+            "offset": end,
+            "tail": tail,
+            "carry": carry,
+            "last_cycle": last_cycle,
+            "pending": rows[last_rows].reset_index(drop=True),
+            "data_dict": {k: v for k, v in self.data_dict.items() if k != last_cycle},
+            "qirr": {k: v for k, v in qirr.items() if k != last_cycle},
+            "leakage": {k: v for k, v in leakage.items() if k != last_cycle},
+        }
+        _save_state(new_state, state_file)
+
+    def resample_time(self, time_series, resolution=None):
         """
         Counts all duplicate time measurements for a series, then evenly
         re-distributes the dublicate elements based on their total counts.
+        Duplicates are spread over one logging interval, 1 s by default; pass a
+        smaller resolution (e.g. 0.1) for instruments that log fractional
+        timestamps. Returns a numpy array.
         """
-        resampled_series = []
-        counter = dict(sorted(Counter(time_series).items()))
-        for num in counter:
-            resampled_series.extend(
-                np.linspace(start=num, stop=num + 1, num=counter[num], endpoint=False)
-            )
-        return resampled_series
+        if resolution is None:
+            resolution = self.time_resolution
+        times, counts = np.unique(np.asarray(time_series), return_counts=True)
+        starts = np.repeat(times, counts)
+        # (stop - start) / counts, not resolution / counts: matches np.linspace
+        # (endpoint=False) bit for bit
+        step = np.repeat(((times + resolution) - times) / counts, counts)
+        rank = np.arange(len(starts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return rank * step + starts
 
     def calc_cap_IR_drop(self):
         """
         Gets the IR drop and charge/discharge capacitance for every 6th cycle.
         Separates charge and discharge branches by their status label, i.e.,
-        "CCC" and "CCD".
+        "CCC" and "CCD". Every branch is a contiguous segment of the cycle
+        index, so all branches are fit in a single batched least-squares pass,
+        which also gives the R^2 and residual standard error of every fit.
         """
-        cycles_to_process = self.df.query(
-            "`{0}` % 6 == 0".format(self.cycle_col)
-        ).reset_index(drop=True)
-        cycles_to_process["Fixed_time"] = self.resample_time(
-            cycles_to_process["TestTime/Sec"]
+        index = self.index
+        codes = np.flatnonzero(index.cycles % self.cycle_interval == 0)
+        cycle_num = index.cycles[codes]
+
+        # rows of the selected cycles grouped by (cycle, status), and where each
+        # of them sits among the selected rows in file order
+        sorted_rows = index.sorted_rows(codes)
+        rows = np.sort(sorted_rows)
+        local = np.searchsorted(rows, sorted_rows)
+        fixed_time = self.resample_time(self.df["TestTime/Sec"].to_numpy()[rows])
+        fixed_time = fixed_time[local]
+        voltage = self.df["Voltage/V"].to_numpy()[sorted_rows]
+
+        charge, discharge = index.status_code("CCC"), index.status_code("CCD")
+        if charge is None or discharge is None:
+            if len(codes):
+                raise IndexError("Every processed cycle needs both CCC and CCD data")
+            charge = discharge = 0
+        offsets = index.sub_offsets(codes)
+        first = np.arange(len(codes)) * index.n_statuses
+        charge_start = offsets[first + charge]
+        charge_end = offsets[first + charge + 1]
+        dis_start = offsets[first + discharge]
+        dis_end = offsets[first + discharge + 1]
+        if np.any(charge_end == charge_start) or np.any(dis_end == dis_start):
+            raise IndexError("Every processed cycle needs both CCC and CCD data")
+
+        current_zero_val = (
+            self.df["Current/uA"].to_numpy()[index.first_rows[codes]] / 1000000
         )
 
-        cycle_num = cycles_to_process[self.cycle_col].unique()
-        self.data_dict = {cycle: {} for cycle in cycle_num}
-
-        for cycle in cycle_num:
-            current_zero_val = (
-                cycles_to_process.query("`{0}` == @cycle".format(self.cycle_col))[
-                    "Current/uA"
-                ].iloc[0]
-                / 1000000
-            )
+        fit = fit_segments(fixed_time, voltage, offsets)
+        charge_seg, dis_seg = first + charge, first + discharge
+        charge_m, charge_b = fit.slope[charge_seg], fit.intercept[charge_seg]
+        dis_m, dis_b = fit.slope[dis_seg], fit.intercept[dis_seg]
 
-            self.data_dict[cycle]["Charge_time"] = cycles_to_process.query(
-                "`{0}` == @cycle & `{1}` == 'CCC'".format(
-                    self.cycle_col, self.status_col
-                )
-            )["Fixed_time"]
-            self.data_dict[cycle]["Charge_voltage"] = cycles_to_process.query(
-                "`{0}` == @cycle & `{1}` == 'CCC'".format(
-                    self.cycle_col, self.status_col
-                )
-            )["Voltage/V"]
+        ir_drop = (
+            self.area
+            * (voltage[charge_end - 1] - voltage[dis_start])
+            / current_zero_val
+        )
+        charge_cap = 2 * (1 / charge_m) * current_zero_val
+        discharge_cap = (2 * (-1 / dis_m) * current_zero_val) / self.mass
 
-            self.data_dict[cycle]["Discharge_time"] = cycles_to_process.query(
-                "`{0}` == @cycle & `{1}` == 'CCD'".format(
-                    self.cycle_col, self.status_col
-                )
-            )["Fixed_time"]
-            self.data_dict[cycle]["Discharge_voltage"] = cycles_to_process.query(
-                "`{0}` == @cycle & `{1}` == 'CCD'".format(
-                    self.cycle_col, self.status_col
-                )
-            )["Voltage/V"]
+        def branch(values, start, end, name):
+            return pd.Series(values[start:end], index=local[start:end], name=name)
 
-            self.data_dict[cycle]["IR drop"] = (
-                self.area
-                * (
-                    self.data_dict[cycle]["Charge_voltage"].iloc[-1]
-                    - self.data_dict[cycle]["Discharge_voltage"].iloc[0]
-                )
-                / (current_zero_val)
+        self.data_dict = {cycle: {} for cycle in cycle_num}
+        for idx, cycle in enumerate(cycle_num):
+            if idx % 256 == 0:
+                progress.report(idx / len(cycle_num))
+            c_start, c_end = charge_start[idx], charge_end[idx]
+            d_start, d_end = dis_start[idx], dis_end[idx]
+
+            self.data_dict[cycle]["Charge_time"] = branch(
+                fixed_time, c_start, c_end, "Fixed_time"
             )
-
-            charge_m, charge_b = np.polyfit(
-                x=self.data_dict[cycle]["Charge_time"],
-                y=self.data_dict[cycle]["Charge_voltage"],
-                deg=1,
+            self.data_dict[cycle]["Charge_voltage"] = branch(
+                voltage, c_start, c_end, "Voltage/V"
+            )
+            self.data_dict[cycle]["Discharge_time"] = branch(
+                fixed_time, d_start, d_end, "Fixed_time"
+            )
+            self.data_dict[cycle]["Discharge_voltage"] = branch(
+                voltage, d_start, d_end, "Voltage/V"
+            )
+            self.data_dict[cycle]["IR drop"] = ir_drop[idx]
+            self.data_dict[cycle]["Charge_slope/intercept"] = (
+                charge_m[idx],
+                charge_b[idx],
             )
-            dis_m, dis_b = np.polyfit(
-                x=self.data_dict[cycle]["Discharge_time"],
-                y=self.data_dict[cycle]["Discharge_voltage"],
-                deg=1,
+            self.data_dict[cycle]["Discharge_slope/intercept"] = (
+                dis_m[idx],
+                dis_b[idx],
             )
+            self.data_dict[cycle]["Charge_cap"] = charge_cap[idx]
+            self.data_dict[cycle]["Discharge_cap"] = discharge_cap[idx]
+            self.data_dict[cycle]["Charge_fit_R2"] = fit.r_squared[charge_seg[idx]]
+            self.data_dict[cycle]["Charge_fit_std_error"] = fit.std_error[
+                charge_seg[idx]
+            ]
+            self.data_dict[cycle]["Discharge_fit_R2"] = fit.r_squared[dis_seg[idx]]
+            self.data_dict[cycle]["Discharge_fit_std_error"] = fit.std_error[
+                dis_seg[idx]
+            ]
 
-            self.data_dict[cycle]["Charge_slope/intercept"] = (charge_m, charge_b)
-            self.data_dict[cycle]["Discharge_slope/intercept"] = (dis_m, dis_b)
-            self.data_dict[cycle]["Charge_cap"] = 2 * (1 / charge_m) * current_zero_val
-            self.data_dict[cycle]["Discharge_cap"] = (
-                2 * (-1 / dis_m) * current_zero_val
-            ) / self.mass
+    def poor_fit_cycles(self, min_r_squared=0.99):
+        """
+        Cycles where the linear fit of either branch explains less than
+        min_r_squared of the voltage variance, e.g. cycles with a rest or a
+        glitch inside a galvanostatic branch.
+        """
+        return [
+            cycle
+            for cycle, data in self.data_dict.items()
+            if not (
+                data["Charge_fit_R2"] >= min_r_squared
+                and data["Discharge_fit_R2"] >= min_r_squared
+            )
+        ]
 
-    def calc_Qirr(self):
+    def calc_Qirr(self, all_cycles=False):
         """
         Performs cumulative integration of the total time and current to get the
         total accumulation of Q. The values for Q for each aging cycle are taken by
         averaging the Q from every 6th cycle (same as IR drop/cap above, prior to
-        floating).
+        floating). The mean of every cycle comes from one segmented sum over the
+        cycle index; with all_cycles set they are also kept for every cycle in
+        qirr_by_cycle. Streamed or incrementally updated data only keeps the
+        rows of every 6th cycle and the floating rows, so the means of the
+        other cycles are not known: all_cycles then raises ValueError, and the
+        file has to be read whole.
         """
-        self.df["(Q-Qo)/mA.h"] = (
-            integrate.cumtrapz(
-                self.df["Current/uA"], self.df["TestTime/Sec"], initial=0
+        if all_cycles and self.filtered:
+            raise ValueError(
+                "Qirr of every cycle needs every row; read the file without chunksize"
+            )
+        # already integrated over the full file if the data was streamed; a
+        # column of that name from the instrument is recalculated
+        if not self._q_integrated:
+            self.df["(Q-Qo)/mA.h"] = (
+                integrate.cumtrapz(
+                    self.df["Current/uA"].to_numpy(dtype="float64"),
+                    self.df["TestTime/Sec"].to_numpy(dtype="float64"),
+                    initial=0,
+                )
+                / 3.6e6
             )
-            / 3.6e6
-        )
-
-        cycles_to_process = self.df.query(
-            "`{0}` % 6 == 0".format(self.cycle_col)
-        ).reset_index(drop=True)
 
-        cycle_num = cycles_to_process[self.cycle_col].unique()
+        index = self.index
+        starts, ends = index.cycle_bounds(np.arange(len(index.cycles)))
+        q = index.sorted(self.df["(Q-Qo)/mA.h"])
+        if len(q):
+            means = np.add.reduceat(q, starts) / (ends - starts)
+        else:
+            means = np.zeros(0)
 
-        self.total_qirr = [
-            np.mean(self.df[self.df[self.cycle_col] == cycle]["(Q-Qo)/mA.h"])
-            for cycle in cycle_num
-        ]
+        selected = index.cycles % self.cycle_interval == 0
+        self.total_qirr = list(means[selected])
 
         # since the cumulative Q is calculated first, we have to take the
         # difference between each cycle to see the cycle-to-cycle values
-        self.q_diff = [self.total_qirr[0]]
-        self.q_diff.extend(
-            [
-                self.total_qirr[i + 1] - self.total_qirr[i]
-                for i in range(len(self.total_qirr) - 1)
-            ]
-        )
+        self.q_diff = list(np.diff(self.total_qirr, prepend=0.0))
+
+        if all_cycles:
+            self.qirr_by_cycle = pd.DataFrame(
+                {
+                    "Cycle": index.cycles,
+                    "Qirr (mAh)": np.diff(means, prepend=0.0),
+                    "Qirr cumulative (mAh)": means,
+                }
+            )
 
-    def get_leakage_current(self):
+    def get_leakage_current(self, window=100, window_unit="points"):
         """
         Gets the average current of the last 100 points recorded during floating.
+        The window can be changed, and given in seconds instead of points with
+        window_unit="seconds". The current decay of every float is also kept as
+        a ragged array: the points of the i-th float in leakage_cycles are
+        float_current[float_offsets[i] : float_offsets[i + 1]], logged at the
+        matching float_time values. The window must be positive; one in seconds
+        always takes at least the last point of every float.
         """
-        floating_data = self.df.query("`{0}` == 'CVC'".format(self.status_col))
-        cycles = floating_data[self.cycle_col].unique()
-        self.leakage_current = [
-            round(
-                np.mean(
-                    floating_data.query("`{0}` == @cycle".format(self.cycle_col))[
-                        "Current/uA"
-                    ][-100:]
-                ),
-                2,
-            )
-            for cycle in cycles
-        ]
+        if not window > 0:
+            raise ValueError(f"Leakage window must be positive, got {window}")
+        index = self.index
+        starts, ends = index.segment_bounds(np.arange(len(index.cycles)), "CVC")
+        floating = ends > starts
+        rows = concat_ranges(starts[floating], ends[floating])
+        lengths = (ends - starts)[floating]
+
+        self.leakage_cycles = list(index.cycles[floating])
+        self.float_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.float_current = index.sorted(self.df["Current/uA"])[rows]
+        self.float_time = index.sorted(self.df["TestTime/Sec"])[rows]
+
+        tail_end = self.float_offsets[1:]
+        if window_unit == "points":
+            tail_start = np.maximum(self.float_offsets[:-1], tail_end - window)
+        elif window_unit == "seconds":
+            float_ids = np.repeat(np.arange(len(lengths)), lengths)
+            end_time = self.float_time[tail_end - 1]
+            in_window = self.float_time > (end_time - window)[float_ids]
+            tail_start = tail_end - np.bincount(
+                float_ids, weights=in_window, minlength=len(lengths)
+            ).astype(np.intp)
+            tail_start = np.minimum(tail_start, tail_end - 1)
+        else:
+            raise ValueError(f"Unknown leakage window unit: {window_unit}")
+
+        # sums over [tail_start, tail_end) are every other entry of reduceat
+        bounds = np.column_stack([tail_start, tail_end]).ravel()
+        sums = np.add.reduceat(np.append(self.float_current, 0), bounds)[::2]
+        self.leakage_current = list(np.round(sums / (tail_end - tail_start), 2))
 
     def get_cap_decrease(self):
         first = self.data_dict[next(iter(self.data_dict))]["Discharge_cap"]
@@ -181,7 +719,7 @@ class AgingData:
         Grabbing certain values from the data dictionary that will be needed
         in the exported excel sheet.
         """
-        self.aging_cycles = [cycle / 6 for cycle in self.data_dict]
+        self.aging_cycles = [cycle / self.cycle_interval for cycle in self.data_dict]
         self.IR_drop = [self.data_dict[cycle]["IR drop"] for cycle in self.data_dict]
         self.discharge_cap = [
             self.data_dict[cycle]["Discharge_cap"] for cycle in self.data_dict
@@ -229,7 +767,11 @@ class AgingData:
         if axis_labels:
             ax2.get_yaxis().set_visible(False)
 
-    def plot_first_and_last_cycle(self, axis, legend=None):
+    def prep_first_and_last_cycle(self):
+        """
+        Times of the first and last processed cycles, measured from the start
+        of their charge, used by the plot below and by prep_export.
+        """
         keys = list(self.data_dict.keys())
         self.first, self.last = keys[0], keys[-1]
 
@@ -250,7 +792,13 @@ class AgingData:
             - self.data_dict[self.last]["Charge_time"].iloc[0]
         )
 
-        axis.plot(
+    def plot_first_and_last_cycle(self, axis, legend=None):
+        self.prep_first_and_last_cycle()
+
+        # the curves can be long; only what the axis resolves is drawn and
+        # the export keeps every point
+        decimation.plot(
+            axis,
             self.charge_time_first,
             self.data_dict[self.first]["Charge_voltage"],
             "-o",
@@ -258,14 +806,16 @@ class AgingData:
             markevery=0.01,
             label="Before first aging cycle",
         )
-        axis.plot(
+        decimation.plot(
+            axis,
             self.discharge_time_first,
             self.data_dict[self.first]["Discharge_voltage"],
             "-o",
             color="k",
             markevery=0.01,
         )
-        axis.plot(
+        decimation.plot(
+            axis,
             self.charge_time_last,
             self.data_dict[self.last]["Charge_voltage"],
             "-o",
@@ -274,7 +824,8 @@ class AgingData:
             markerfacecolor="white",
             label="After aging",
         )
-        axis.plot(
+        decimation.plot(
+            axis,
             self.discharge_time_last,
             self.data_dict[self.last]["Discharge_voltage"],
             "-o",
@@ -0,0 +1,339 @@
+"""
+Processes many cells without the GUI. Every cell in a manifest goes through
+the same process_data pipeline as the import window, and gets the same excel
+workbook plus a small summary table. Cells are spread over a process pool.
+
+Usage:
+    python batch_process.py manifest.toml --output results --workers 4
+
+A manifest lists one cell per CSV row, JSON object or TOML [[cell]] table,
+with the fields in MANIFEST_FIELDS; only name, mass and area are required.
+Relative file paths are taken relative to the manifest. For example:
+
+    [[cell]]
+    name = "cell 1"
+    mass = 0.0021
+    area = 1.13
+    aging_file = "cell1/aging.csv"
+    cv_5_before = "cell1/cv_5mVs_before.txt"
+    eis_ocv_before = "cell1/eis_ocv_before.txt"
+    cv_rates_before = { "1" = "cell1/cv_1mVs.txt", "20" = "cell1/cv_20mVs.txt" }
+
+CVs at scan rates other than 5 and 0.5 mV/s go in cv_rates_before and
+cv_rates_after, as a table of scan rate (mV/s) to file, or in a CSV manifest
+as "1=cell1/cv_1mVs_before.txt; 20=cell1/cv_20mVs_before.txt".
+
+This module must not import PyQt5 or matplotlib so it can run on machines
+without a display.
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+import traceback
+import pandas as pd
+
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+
+from data_processing_funcs import process_data
+from data_export import export_data
+from rate_capability import rate_capability
+
+# same order as the file arguments of process_data
+FILE_FIELDS = [
+    "aging_file",
+    "cv_5_before",
+    "cv_0p5_before",
+    "cv_5_after",
+    "cv_0p5_after",
+    "eis_ocv_before",
+    "eis_0p5V_before",
+    "eis_1V_before",
+    "eis_ocv_after",
+    "eis_0p5V_after",
+    "eis_1V_after",
+]
+# CVs at any other scan rates, passed as the extra_cvs_* of process_data
+RATE_FIELDS = ["cv_rates_before", "cv_rates_after"]
+MANIFEST_FIELDS = ["name", "mass", "area"] + FILE_FIELDS + RATE_FIELDS
+# names Windows will not create a file under, whatever the extension
+RESERVED_NAMES = {"CON", "PRN", "AUX", "NUL"} | {
+    f"{device}{number}" for device in ["COM", "LPT"] for number in range(1, 10)
+}
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def file_stem(name):
+    """
+    The cell name made safe to use as a file name in the output folder on any
+    system: path separators and other special characters become _.
+    """
+    stem = re.sub(r"[^\w .()+-]+", "_", name).strip(" .")
+    if stem.split(".")[0].upper() in RESERVED_NAMES:
+        stem = f"_{stem}"
+    return stem or "_"
+
+
+def read_rates(value):
+    """
+    (file, scan rate) pairs from a table of scan rate to file, or from
+    "rate=file; rate=file" text.
+    """
+    if isinstance(value, str):
+        items = [item.split("=", 1) for item in value.split(";") if item.strip()]
+        if any(len(item) != 2 for item in items):
+            raise ValueError(f"expected rate=file pairs, got {value!r}")
+    else:
+        items = dict(value or {}).items()
+    pairs = [(str(file).strip(), float(rate)) for rate, file in items]
+    for _, rate in pairs:
+        if not rate > 0:
+            raise ValueError(f"scan rates must be positive, got {rate:g}")
+    return pairs
+
+
+def read_manifest(manifest_file):
+    """
+    Reads a CSV, JSON or TOML manifest into a list of cell dicts with every
+    field of MANIFEST_FIELDS present and file paths made absolute.
+    """
+    extension = os.path.splitext(manifest_file)[1].lower()
+    if extension == ".csv":
+        with open(manifest_file, newline="") as handle:
+            cells = list(csv.DictReader(handle))
+    elif extension == ".json":
+        with open(manifest_file) as handle:
+            cells = json.load(handle)
+        if isinstance(cells, dict):
+            cells = cells.get("cell", cells.get("cells", []))
+    elif extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(manifest_file, "rb") as handle:
+            cells = tomllib.load(handle).get("cell", [])
+    else:
+        raise ManifestError(f"Unsupported manifest type: {manifest_file}")
+
+    base = os.path.dirname(os.path.abspath(manifest_file))
+    names, stems = set(), {"batch": "the batch summary"}
+    for number, cell in enumerate(cells, start=1):
+        unknown = set(cell) - set(MANIFEST_FIELDS)
+        if unknown:
+            raise ManifestError(
+                f"Cell {number}: unknown field(s) {', '.join(sorted(unknown))}"
+            )
+        for field in ["name", "mass", "area"]:
+            if str(cell.get(field, "")).strip() == "":
+                raise ManifestError(f"Cell {number}: missing {field}")
+        cell["name"] = str(cell["name"]).strip()
+        if cell["name"] in names:
+            raise ManifestError(f"Cell {number}: duplicate name {cell['name']}")
+        names.add(cell["name"])
+        # output files of names that only differ in case or special
+        # characters would overwrite each other
+        stem = file_stem(cell["name"]).lower()
+        if stem in stems:
+            raise ManifestError(
+                f"Cell {number}: {cell['name']} and {stems[stem]} would share "
+                "output file names"
+            )
+        stems[stem] = cell["name"]
+        for field in FILE_FIELDS:
+            path = str(cell.get(field) or "").strip()
+            cell[field] = os.path.join(base, path) if path else ""
+        for field in RATE_FIELDS:
+            try:
+                rates = read_rates(cell.get(field))
+            except (TypeError, ValueError) as exc:
+                raise ManifestError(f"Cell {number}: {field}: {exc}") from exc
+            cell[field] = [
+                (os.path.join(base, path) if path else "", rate) for path, rate in rates
+            ]
+    return cells
+
+
+def summarize(name, aging_data, cvs_before, cvs_after, eis_before, eis_after):
+    """
+    A one-column table of the headline numbers of one cell.
+    """
+    summary = {"Cell": name}
+    if aging_data:
+        summary.update(
+            {
+                "Aging cycles": len(aging_data.aging_cycles),
+                "Initial discharge capacitance (F/g)": aging_data.discharge_cap[0],
+                "Final discharge capacitance (F/g)": aging_data.discharge_cap[-1],
+                "Final discharge cap decrease (%)": aging_data.cap_decrease[-1],
+                "Initial IR drop (Ohm * cm2)": aging_data.IR_drop[0],
+                "Final IR drop (Ohm * cm2)": aging_data.IR_drop[-1],
+                "Final IR drop increase (%)": aging_data.resist_increase[-1],
+            }
+        )
+        if aging_data.total_qirr:
+            summary["Qirr cumulative (mAh)"] = aging_data.total_qirr[-1]
+        if aging_data.leakage_current:
+            summary["Final leakage current uA"] = aging_data.leakage_current[-1]
+    for label, cv_data in [("before", cvs_before), ("after", cvs_after)]:
+        for rate, cv in (cv_data or {}).items():
+            summary[
+                f"CV discharge capacitance {label} aging {rate:g} mV_s (F/g)"
+            ] = cv.specific_discharge
+            summary[f"CV coulombic efficiency {label} aging {rate:g} mV_s (%)"] = (
+                cv.discharge_capacitance / cv.charge_capacitance * 100
+            )
+            if cv.all_cycles:
+                summary[
+                    f"CV capacitance retention {label} aging {rate:g} mV_s (%)"
+                ] = cv.cycle_retention[-1]
+        rates = rate_capability(cv_data)
+        if rates:
+            fastest, slowest = rates.rates.max(), rates.rates.min()
+            summary[
+                f"CV rate retention {label} aging {fastest:g} vs {slowest:g} mV_s (%)"
+            ] = rates.retention[rates.rates.argmax()]
+    for label, eis_data in [("before", eis_before), ("after", eis_after)]:
+        for key, eis in (eis_data or {}).items():
+            lowest = eis.df["freq/Hz"].idxmin()
+            summary[f"EIS C' at lowest frequency {label} aging {key} (F/cm^2)"] = (
+                eis.df["C'"][lowest] / eis.area
+            )
+            line = eis.fits.get("Transmission line")
+            if line:
+                summary[f"EIS Rs {label} aging {key} (Ohm)"] = line["Rs (Ohm)"]
+                summary[f"EIS Rion {label} aging {key} (Ohm)"] = line["Rion (Ohm)"]
+            if eis.kk is not None:
+                summary[f"EIS Lin-KK residual {label} aging {key} (%)"] = (
+                    eis.kk.max_residual * 100
+                )
+                summary[f"EIS Lin-KK valid {label} aging {key}"] = eis.kk.passed
+    return summary
+
+
+def process_cell(cell, output_dir, cv_all_cycles=False):
+    """
+    Runs one cell through process_data in the calling process and writes its
+    workbook and summary table. Returns the summary with a Status entry;
+    errors are reported there instead of raised so one bad cell does not stop
+    the batch.
+    """
+    try:
+        aging_data, cvs_before, cvs_after, eis_before, eis_after = process_data(
+            cell["mass"],
+            cell["area"],
+            *[cell[field] for field in FILE_FIELDS],
+            extra_cvs_before=cell["cv_rates_before"],
+            extra_cvs_after=cell["cv_rates_after"],
+            cv_all_cycles=cv_all_cycles,
+            max_workers=1,
+        )
+        if aging_data:
+            aging_data.prep_data()
+            aging_data.prep_first_and_last_cycle()
+            aging_data.prep_export()
+
+        base = os.path.join(output_dir, file_stem(cell["name"]))
+        export_data(
+            f"{base}.xlsx", aging_data, cvs_before, cvs_after, eis_before, eis_after
+        )
+        summary = summarize(
+            cell["name"], aging_data, cvs_before, cvs_after, eis_before, eis_after
+        )
+        pd.Series(summary, name="Value").to_csv(
+            f"{base} summary.csv", index_label="Quantity"
+        )
+        summary["Status"] = "OK"
+    except Exception as exc:
+        summary = {
+            "Cell": cell["name"],
+            "Status": f"{type(exc).__name__}: {exc}",
+            "Traceback": traceback.format_exc(),
+        }
+    return summary
+
+
+def run_batch(cells, output_dir, workers=None, cv_all_cycles=False):
+    """
+    Processes every cell, workers at a time, and returns their summaries in
+    manifest order. With cv_all_cycles the capacitance of every CV cycle is
+    calculated and exported too.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(cells)))
+    summaries = []
+
+    def report(summary):
+        summaries.append(summary)
+        print(f"{summary['Cell']}: {summary['Status']}", flush=True)
+
+    if workers == 1:
+        for cell in cells:
+            report(process_cell(cell, output_dir, cv_all_cycles))
+        return summaries
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        collected = pool.map(
+            instrumentation.collect,
+            repeat(process_cell),
+            cells,
+            repeat(output_dir),
+            repeat(cv_all_cycles),
+        )
+        for summary in collected:
+            report(instrumentation.unpack(summary))
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Process supercapacitor aging data for many cells."
+    )
+    parser.add_argument("manifest", help="CSV, JSON or TOML list of cells")
+    parser.add_argument(
+        "-o", "--output", default="results", help="output folder (default: results)"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="cells processed at once (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--cv-all-cycles",
+        action="store_true",
+        help="also calculate the capacitance of every CV cycle",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        cells = read_manifest(args.manifest)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+    if not cells:
+        parser.error(f"No cells found in {args.manifest}")
+
+    summaries = run_batch(cells, args.output, args.workers, args.cv_all_cycles)
+    failed = [summary for summary in summaries if summary["Status"] != "OK"]
+    for summary in failed:
+        print(summary["Traceback"], file=sys.stderr)
+    pd.DataFrame(summaries).drop(columns="Traceback", errors="ignore").to_csv(
+        os.path.join(args.output, "batch summary.csv"), index=False
+    )
+    print(f"{len(summaries) - len(failed)} of {len(summaries)} cells processed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,136 @@
+import io
+import os
 import pandas as pd
 import numpy as np
 
+from cycle_index import CycleIndex
 
+import parse_cache
+import decimation
+import instrumentation
+
+CYCLE_COLUMN = "cycle number"
+
+
+def last_cycle_offset(handle, data_start, column, block_size=1024**2):
+    """
+    Byte offset of the first line of the last cycle. Cycle numbers never
+    decrease down an EC-Lab file, so blocks are read backwards from the end
+    until one starts in an earlier cycle, and only that block is searched,
+    by bisecting its lines.
+    """
+
+    def cycle(line):
+        return float(line.split(b"\t")[column])
+
+    end = handle.seek(0, os.SEEK_END)
+    pos, last, size = end, None, block_size
+    while pos > data_start:
+        start = max(pos - size, data_start)
+        handle.seek(start)
+        # the block ends at the start of a line: either the end of the file
+        # or the first whole line of the block read before it
+        block = handle.read(pos - start)
+        first = 0 if start == data_start else block.find(b"\n") + 1
+        if start > data_start and not 0 < first < len(block):
+            # no whole line in the block
+            size *= 2
+            continue
+        lines = block[first:].split(b"\n")
+        if last is None:
+            filled = next((line for line in reversed(lines) if line.strip()), None)
+            if filled is None:
+                # only the blank lines at the end of the file so far
+                pos = start + first
+                continue
+            last = cycle(filled)
+        if cycle(lines[0]) == last:
+            pos = start + first
+            continue
+        # binary search for the first line of the last cycle; blank lines
+        # only come at the end of the file, after it
+        low, high = 0, len(lines)
+        while low < high:
+            mid = (low + high) // 2
+            if lines[mid].strip() and cycle(lines[mid]) != last:
+                low = mid + 1
+            else:
+                high = mid
+        if low == len(lines):
+            # the last cycle starts with the block read before this one
+            return pos
+        return start + first + sum(map(len, lines[:low])) + low
+    return data_start
+
+
+def read_last_cycle(file_name):
+    """
+    Parses only the last cycle of an EC-Lab CV file, so the time taken
+    depends on the length of one cycle rather than of the experiment. Raises
+    ValueError or IndexError if the file does not look as expected.
+    """
+    with open(file_name, "rb") as handle:
+        header = handle.readline()
+        column = header.rstrip(b"\r\n").split(b"\t").index(CYCLE_COLUMN.encode())
+        handle.seek(last_cycle_offset(handle, handle.tell(), column))
+        # one parse of the header and the tail names the columns as a full
+        # read would
+        df = pd.read_table(io.BytesIO(header + handle.read()))
+    if df.empty or df[CYCLE_COLUMN].nunique() != 1:
+        raise ValueError(f"{file_name} is not ordered by {CYCLE_COLUMN}")
+    return df
+
+
+def sort_within_segments(values, segment):
+    """
+    values sorted in ascending order within each run of equal, non-decreasing
+    segment ids. One stable sort of segment + values scaled to [0, 1) does
+    this; lexsort gives the same result but is many times slower, and is only
+    used if two values are too close for the scaled key to order them.
+    """
+    if not len(values):
+        return values
+    low, span = values.min(), np.ptp(values)
+    key = segment + ((values - low) / (span * (1 + 1e-9)) if span else 0)
+    result = values[np.argsort(key, kind="stable")]
+    if np.any((np.diff(result) < 0) & (segment[1:] == segment[:-1])):
+        result = values[np.lexsort((values, segment))]
+    return result
+
+
+@instrumentation.instrument
 class CVs:
-    def __init__(self, rate, mass) -> None:
+    def __init__(self, rate, mass, all_cycles=False) -> None:
         self.rate = rate
         self.mass = mass
+        self.all_cycles = all_cycles
 
     def read_prep_data(self, file_name):
-        self.df = pd.read_table(file_name)
+        """
+        Unless the capacitance of every cycle is wanted only the last cycle is
+        used, so only the last cycle is read; any file the tail reader does
+        not understand is parsed in full instead.
+        """
+        try:
+            if self.all_cycles:
+                raise ValueError
+            self.df = read_last_cycle(file_name)
+        except (ValueError, IndexError):
+            self.df = parse_cache.cached_read(file_name, pd.read_table, "read_table")
         self.last_cycle = self.df["cycle number"].unique()[-1]
-        self.potential = self.df.query("`cycle number` == @self.last_cycle")["Ewe/V"]
-        self.current = self.df.query("`cycle number` == @self.last_cycle")["<I>/mA"]
+        last = self.df[self.df["cycle number"] == self.last_cycle]
+        self.potential = last["Ewe/V"]
+        self.current = last["<I>/mA"]
         self.capacitance = self.current / (self.mass * self.rate)
         self.current_density = self.current / (self.mass)
 
     def plot_cv_cap_current_density(self, axis, color, label=None):
-        axis.plot(
+        decimation.plot(
+            axis,
             self.potential,
             self.capacitance,
             color=color,
-            label=f"{self.rate} mV/s {label}",
+            label=f"{self.rate:g} mV/s {label}",
         )
         axis.set_xlabel("Potential (V)")
         axis.set_ylabel("Specific Capacitance (F/g)")
@@ -30,21 +140,10 @@ class CVs:
     def calc_capacitance(self):
         window = max(self.potential) - min(self.potential)
 
-        self.discharge_current = self.df.query(
-            "`cycle number` == @self.last_cycle & `<I>/mA` < 0"
-        )["<I>/mA"]
-
-        self.charge_current = self.df.query(
-            "`cycle number` == @self.last_cycle & `<I>/mA` > 0"
-        )["<I>/mA"]
-
-        self.discharge_potential = self.df.query(
-            "`cycle number` == @self.last_cycle & `<I>/mA` < 0"
-        )["Ewe/V"].sort_values()
-
-        self.charge_potential = self.df.query(
-            "`cycle number` == @self.last_cycle & `<I>/mA` > 0"
-        )["Ewe/V"].sort_values()
+        self.discharge_current = self.current[self.current < 0]
+        self.charge_current = self.current[self.current > 0]
+        self.discharge_potential = self.potential[self.current < 0].sort_values()
+        self.charge_potential = self.potential[self.current > 0].sort_values()
 
         self.discharge_capacitance = (
             2
@@ -60,6 +159,46 @@ class CVs:
         self.specific_discharge = self.discharge_capacitance / self.mass
         self.specific_charge = self.charge_capacitance / self.mass
 
+    def calc_cycle_capacitance(self):
+        """
+        Charge and discharge capacitance and coulombic efficiency of every
+        cycle, integrated as in calc_capacitance: each branch (split by the
+        sign of the current) pairs its currents with its potentials in
+        ascending order. The rows are grouped by cycle and branch once, and
+        the trapezoids of all branches are summed in one segmented pass.
+        """
+        current = self.df["<I>/mA"].to_numpy(dtype=float)
+        index = CycleIndex(self.df["cycle number"], np.sign(current))
+        potential = index.sorted(self.df["Ewe/V"].to_numpy(dtype=float))
+        current = index.sorted(current)
+
+        n_cycles, n_statuses = len(index.cycles), index.n_statuses
+        segment = np.repeat(np.arange(n_cycles * n_statuses), np.diff(index.offsets))
+        sorted_potential = sort_within_segments(potential, segment)
+        areas = np.diff(sorted_potential) * (current[1:] + current[:-1]) / 2.0
+        inside = segment[1:] == segment[:-1]
+        integrals = np.bincount(
+            segment[:-1][inside],
+            weights=areas[inside],
+            minlength=n_cycles * n_statuses,
+        ).reshape(n_cycles, n_statuses)
+
+        starts = index.offsets[:-1:n_statuses]
+        window = np.maximum.reduceat(potential, starts) - np.minimum.reduceat(
+            potential, starts
+        )
+
+        def branch(sign):
+            code = index.status_code(sign)
+            return np.zeros(n_cycles) if code is None else integrals[:, code]
+
+        self.cycles = np.asarray(index.cycles)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.cycle_charge = 2 * branch(1.0) / (self.rate * window)
+            self.cycle_discharge = 2 * np.abs(branch(-1.0)) / (self.rate * window)
+            self.cycle_efficiency = self.cycle_discharge / self.cycle_charge * 100
+            self.cycle_retention = self.cycle_discharge / self.cycle_discharge[0] * 100
+
     def prep_export(self):
         self.cvs_df = pd.DataFrame(
             {
@@ -76,3 +215,19 @@ class CVs:
                 ),
             }
         )
+        if self.all_cycles:
+            self.cycles_df = pd.DataFrame(
+                {
+                    "Cycle": self.cycles,
+                    "Discharge Capacitance (F)": np.round(self.cycle_discharge, 5),
+                    "Charge Capacitance (F)": np.round(self.cycle_charge, 5),
+                    "Discharge Capacitance (F/g)": np.round(
+                        self.cycle_discharge / self.mass, 5
+                    ),
+                    "Charge Capacitance (F/g)": np.round(
+                        self.cycle_charge / self.mass, 5
+                    ),
+                    "Coulombic Efficiency (%)": np.round(self.cycle_efficiency, 5),
+                    "Capacitance Retention (%)": np.round(self.cycle_retention, 5),
+                }
+            )
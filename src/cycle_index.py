@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+
+class CycleIndex:
+    """
+    Maps every (cycle, status) pair of the aging data to a contiguous range of
+    rows. Rows are stably sorted once by cycle (in order of first appearance)
+    and then status; order holds that permutation, or None when the rows are
+    already grouped that way, which is the usual layout of a Landt export.
+    offsets[k * n_statuses + s] is where the rows of the k-th cycle with the
+    s-th status start in that order.
+    """
+
+    def __init__(self, cycles, statuses) -> None:
+        cycle_codes, self.cycles = pd.factorize(np.asarray(cycles))
+        if isinstance(statuses.dtype, pd.CategoricalDtype):
+            status_codes = statuses.cat.codes.to_numpy().astype(np.intp)
+            self.statuses = list(statuses.cat.categories)
+        else:
+            status_codes, uniques = pd.factorize(np.asarray(statuses))
+            self.statuses = list(uniques)
+        # rows without a status get a segment of their own at the end
+        status_codes[status_codes < 0] = len(self.statuses)
+        self.statuses.append(None)
+        self.n_statuses = len(self.statuses)
+
+        segment_ids = cycle_codes * self.n_statuses + status_codes
+        if np.all(segment_ids[1:] >= segment_ids[:-1]):
+            self.order = None
+            sorted_ids = segment_ids
+        else:
+            self.order = np.argsort(segment_ids, kind="stable")
+            sorted_ids = segment_ids[self.order]
+        self.offsets = np.searchsorted(
+            sorted_ids, np.arange(len(self.cycles) * self.n_statuses + 1)
+        )
+        # rows without a cycle number (code -1) sort before every segment and
+        # have no first row
+        codes, first_rows = np.unique(cycle_codes, return_index=True)
+        self.first_rows = first_rows[codes >= 0]
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def sorted(self, values):
+        """
+        Puts a column in (cycle, status) order so each segment is a slice.
+        """
+        values = np.asarray(values)
+        return values if self.order is None else values[self.order]
+
+    def cycle_codes(self, cycles):
+        """
+        Positions of the given cycle numbers in cycles.
+        """
+        return pd.Index(self.cycles).get_indexer(cycles)
+
+    def status_code(self, status):
+        return self.statuses.index(status) if status in self.statuses else None
+
+    def cycle_bounds(self, codes):
+        """
+        Start and end (in sorted order) of every row of the given cycles.
+        """
+        codes = np.asarray(codes)
+        return (
+            self.offsets[codes * self.n_statuses],
+            self.offsets[(codes + 1) * self.n_statuses],
+        )
+
+    def segment_bounds(self, codes, status):
+        """
+        Start and end (in sorted order) of the rows of the given cycles with the
+        given status. Cycles without such rows get empty ranges.
+        """
+        codes = np.asarray(codes)
+        status_code = self.status_code(status)
+        if status_code is None:
+            empty = self.offsets[codes * self.n_statuses]
+            return empty, empty
+        segments = codes * self.n_statuses + status_code
+        return self.offsets[segments], self.offsets[segments + 1]
+
+    def sub_offsets(self, codes):
+        """
+        Segment offsets of the given cycles after their rows are gathered with
+        sorted_rows, i.e. offsets[k * n_statuses + s] for the k-th given cycle.
+        """
+        codes = np.asarray(codes)
+        bounds = self.offsets[
+            codes[:, None] * self.n_statuses + np.arange(self.n_statuses + 1)
+        ]
+        lengths = bounds[:, -1] - bounds[:, 0]
+        shift = np.concatenate([[0], np.cumsum(lengths)[:-1]]) - bounds[:, 0]
+        return np.append(
+            (bounds[:, :-1] + shift[:, None]).ravel(), lengths.sum()
+        ).astype(np.intp)
+
+    def sorted_rows(self, codes):
+        """
+        Original row positions of the given cycles, cycle by cycle in the given
+        order and, within a cycle, grouped by status.
+        """
+        starts, ends = self.cycle_bounds(codes)
+        rows = concat_ranges(starts, ends)
+        return rows if self.order is None else self.order[rows]
+
+
+def concat_ranges(starts, ends):
+    """
+    Concatenation of np.arange(start, end) for every pair, without a loop.
+    """
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.intp)
+    steps = np.ones(lengths.sum(), dtype=np.intp)
+    nonempty = lengths > 0
+    heads = np.concatenate([[0], np.cumsum(lengths[nonempty])[:-1]])
+    steps[heads] = starts[nonempty] - np.concatenate([[0], ends[nonempty][:-1] - 1])
+    return np.cumsum(steps)
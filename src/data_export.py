@@ -1,6 +1,100 @@
+import os
+import numpy as np
 import pandas as pd
+import xlsxwriter
 
+import instrumentation
 
+from progress import Cancelled
+from rate_capability import rate_capability
+from eis_fitting import fits_table
+from kramers_kronig import kk_table, residuals_table
+
+# rows converted from the column arrays at a time
+BLOCK_ROWS = 4096
+
+
+def export_sheets(aging_data, cvs_before, cvs_after, eis_before, eis_after):
+    """
+    The name and DataFrame of every sheet of the exported workbook, in order.
+    """
+    sheets = []
+    if aging_data:
+        sheets.append(("Aging Data CCD curves", aging_data.ccd_curves))
+        sheets.append(("Aging Data", aging_data.aging_df))
+    for key in cvs_before or {}:
+        sheets.append((f"CVs before aging {key:g} mV_s", cvs_before[key].cvs_df))
+    for key in cvs_after or {}:
+        sheets.append((f"CVs after aging {key:g} mV_s", cvs_after[key].cvs_df))
+    for stage, cvs in [("before", cvs_before), ("after", cvs_after)]:
+        for key in cvs or {}:
+            if cvs[key].all_cycles:
+                # sheet names are limited to 31 characters; keys have at most
+                # four significant digits, see scan_rate
+                sheets.append((f"CV cycles {stage} {key:g} mV_s", cvs[key].cycles_df))
+    for stage, cvs in [("before", cvs_before), ("after", cvs_after)]:
+        rates = rate_capability(cvs)
+        if rates:
+            sheets.append((f"CV rate capability {stage}", rates.rates_df))
+            sheets.append((f"CV Dunn analysis {stage}", rates.dunn_df))
+    for key in eis_before or {}:
+        sheets.append((f"EIS before aging {key}", eis_before[key].eis_df))
+    for key in eis_after or {}:
+        sheets.append((f"EIS after aging {key}", eis_after[key].eis_df))
+    fits = fits_table(eis_before, eis_after)
+    if len(fits):
+        sheets.append(("EIS equivalent circuits", fits))
+    kk = kk_table(eis_before, eis_after)
+    if len(kk):
+        sheets.append(("EIS Kramers-Kronig", kk))
+        sheets.append(
+            ("EIS Kramers-Kronig residuals", residuals_table(eis_before, eis_after))
+        )
+    return sheets
+
+
+def column_cells(values):
+    """
+    A block of one column as a list of cell values, with None for the blank
+    cells DataFrame.to_excel leaves for missing values and infinities
+    written as text as it does.
+    """
+    if values.dtype.kind == "f":
+        if np.isfinite(values).all():
+            return values.tolist()
+        cells = values.astype(object)
+        cells[np.isnan(values)] = None
+        cells[values == np.inf] = "inf"
+        cells[values == -np.inf] = "-inf"
+        return cells.tolist()
+    if values.dtype.kind == "O":
+        cells = values.copy()
+        cells[pd.isna(values)] = None
+        return cells.tolist()
+    return values.tolist()
+
+
+def write_sheet(worksheet, df, header_format, written):
+    """
+    Writes the header and then the rows of df in order, as constant_memory
+    mode requires, calling written(rows) after every block.
+    """
+    for col_num, value in enumerate(df.columns.values):
+        worksheet.write(0, col_num, value, header_format)
+
+    columns = [df.iloc[:, idx].to_numpy() for idx in range(df.shape[1])]
+    for start in range(0, len(df), BLOCK_ROWS):
+        block = [column_cells(values[start : start + BLOCK_ROWS]) for values in columns]
+        rows = 0
+        for row_num, row in enumerate(zip(*block), start=start + 1):
+            for col_num, value in enumerate(row):
+                if value is not None:
+                    worksheet.write(row_num, col_num, value)
+            rows += 1
+        written(rows)
+
+
+@instrumentation.instrument
 def export_data(
     file_name,
     aging_data,
@@ -8,10 +102,25 @@ def export_data(
     cvs_after,
     eis_before,
     eis_after,
+    on_progress=None,
+    cancel=None,
 ):
+    """
+    Writes every sheet straight from the column arrays with xlsxwriter's
+    constant_memory mode, which flushes each row to disk once the next one is
+    started, so memory use does not grow with the data.
+
+    on_progress(fraction, sheet name) is called as rows are written; if the
+    cancel event is set the export stops with Cancelled. The workbook is
+    written next to file_name and only moved into place once complete, so a
+    cancelled or failed export leaves any existing file untouched.
+    """
+    sheets = export_sheets(aging_data, cvs_before, cvs_after, eis_before, eis_after)
+    total = sum(len(df) for _, df in sheets) or 1
+    done = 0
 
-    writer = pd.ExcelWriter(f"{file_name}", engine="xlsxwriter")
-    workbook = writer.book
+    part_file = f"{file_name}.part"
+    workbook = xlsxwriter.Workbook(part_file, {"constant_memory": True})
     header_format = workbook.add_format(
         {
             "bold": True,
@@ -19,75 +128,27 @@ def export_data(
         }
     )
 
-    if aging_data:
-        aging_data.ccd_curves.to_excel(
-            writer,
-            sheet_name="Aging Data CCD curves",
-            startrow=1,
-            header=False,
-            index=False,
-        )
-        worksheet = writer.sheets["Aging Data CCD curves"]
-        for col_num, value in enumerate(aging_data.ccd_curves.columns.values):
-            worksheet.write(0, col_num, value, header_format)
+    try:
+        for sheet_name, df in sheets:
+            worksheet = workbook.add_worksheet(sheet_name)
 
-        aging_data.aging_df.to_excel(
-            writer, sheet_name="Aging Data", startrow=1, header=False, index=False
-        )
-        worksheet = writer.sheets["Aging Data"]
-        for col_num, value in enumerate(aging_data.aging_df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-
-    if cvs_before:
-        for key in cvs_before:
-            cvs_before[key].cvs_df.to_excel(
-                writer,
-                sheet_name=f"CVs before aging {key} mV_s",
-                startrow=1,
-                header=False,
-                index=False,
-            )
-            worksheet = writer.sheets[f"CVs before aging {key} mV_s"]
-            for col_num, value in enumerate(cvs_before[key].cvs_df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-
-    if cvs_after:
-        for key in cvs_after:
-            cvs_after[key].cvs_df.to_excel(
-                writer,
-                sheet_name=f"CVs after aging {key} mV_s",
-                startrow=1,
-                header=False,
-                index=False,
-            )
-            worksheet = writer.sheets[f"CVs after aging {key} mV_s"]
-            for col_num, value in enumerate(cvs_after[key].cvs_df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-
-    if eis_before:
-        for key in eis_before:
-            eis_before[key].eis_df.to_excel(
-                writer,
-                sheet_name=f"EIS before aging {key}",
-                startrow=1,
-                header=False,
-                index=False,
-            )
-            worksheet = writer.sheets[f"EIS before aging {key}"]
-            for col_num, value in enumerate(eis_before[key].eis_df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-
-    if eis_after:
-        for key in eis_after:
-            eis_after[key].eis_df.to_excel(
-                writer,
-                sheet_name=f"EIS after aging {key}",
-                startrow=1,
-                header=False,
-                index=False,
-            )
-            worksheet = writer.sheets[f"EIS after aging {key}"]
-            for col_num, value in enumerate(eis_after[key].eis_df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-
-    writer.save()
+            def written(rows):
+                nonlocal done
+                done += rows
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled
+                if on_progress is not None:
+                    on_progress(done / total, f"Writing {sheet_name}")
+
+            write_sheet(worksheet, df, header_format, written)
+        workbook.close()
+        os.replace(part_file, file_name)
+    except BaseException:
+        # closing also removes the temporary files of the written rows
+        try:
+            workbook.close()
+        except Exception:
+            pass
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
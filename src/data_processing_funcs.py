@@ -1,47 +1,203 @@
+import os
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import progress
+import instrumentation
+
 from aging_methods import AgingData
 from eis import Eis
 from cvs import CVs
+from eis_fitting import fit_eis, spectra_neighbours
+from kramers_kronig import validate_eis
+
+# aging files larger than this are streamed in chunks instead of loaded whole
+STREAMING_THRESHOLD = 256 * 1024**2
+CHUNKSIZE = 500000
+
+# below this total input size starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 20 * 1024**2
+
 
+class FileKeyError(KeyError):
+    """
+    A column missing from the files of one pipeline. Records the pipeline and
+    its files so the error can still be reported after crossing a process
+    boundary.
+    """
 
-def calc_aging_data(file, mass, area):
+    def __init__(self, key, pipeline, files):
+        super().__init__(key)
+        self.pipeline = pipeline
+        self.files = files
+
+    def __reduce__(self):
+        return (FileKeyError, (self.args[0], self.pipeline, self.files))
+
+
+@instrumentation.instrument
+def calc_aging_data(file, mass, area, incremental=False):
     if len(file) == 0:
         return None
-    aging = AgingData(mass=mass, area=area)
-    aging.read_data(file)
-    aging.calc_cap_IR_drop()
-    aging.calc_Qirr()
-    aging.get_leakage_current()
+    aging = AgingData(mass=mass, area=area, compact=True)
+    if incremental:
+        with progress.span(0, 0.95, "Aging data"):
+            aging.update_data(file, chunksize=CHUNKSIZE)
+    else:
+        with progress.span(0, 0.7, "Reading aging data"):
+            if os.path.getsize(file) > STREAMING_THRESHOLD:
+                aging.read_data(file, chunksize=CHUNKSIZE)
+            else:
+                aging.read_data(file)
+        with progress.span(0.7, 0.9, "Fitting aging cycles"):
+            aging.calc_cap_IR_drop()
+        aging.calc_Qirr()
+        progress.report(0.93, "Leakage current")
+        aging.get_leakage_current()
+    progress.report(0.97)
     aging.get_cap_decrease()
     aging.get_resist_increase()
     return aging
 
 
-def calc_cv_data(file_list, mass):
-    rates = [5, 0.5]
-    cv_data = {}
-    for idx, cv in enumerate(file_list):
-        if len(cv) == 0:
-            continue
-        cv_data[rates[idx]] = CVs(rate=rates[idx], mass=mass)
-        cv_data[rates[idx]].read_prep_data(cv)
-        cv_data[rates[idx]].calc_capacitance()
-        cv_data[rates[idx]].prep_export()
-    return cv_data
+@instrumentation.instrument
+def calc_cv_file(file, rate, mass, all_cycles=False):
+    """
+    One CV file at one scan rate. Each file is its own pipeline, so the CVs
+    of every scan rate are read and processed concurrently.
+    """
+    if len(file) == 0:
+        return None
+    with progress.span(0, 1, f"CV {rate:g} mV/s"):
+        cv = CVs(rate=rate, mass=mass, all_cycles=all_cycles)
+        cv.read_prep_data(file)
+        progress.report(0.7)
+        cv.calc_capacitance()
+        if all_cycles:
+            cv.calc_cycle_capacitance()
+        cv.prep_export()
+    return cv
 
 
+def scan_rate(rate):
+    """
+    The key of a scan rate: the rate to four significant digits, so sheet
+    names built from it stay within Excel's 31 characters, with whole rates
+    as int so 5 and 5.0 give the same key and sheet name.
+    """
+    rate = float(f"{float(rate):.4g}")
+    return int(rate) if rate.is_integer() else rate
+
+
+@instrumentation.instrument
 def calc_eis_data(file_list, area):
     labels = ["OCV", "0.5 V", "1.0 V"]
     eis_data = {}
     for idx, eis in enumerate(file_list):
         if len(eis) == 0:
             continue
-        eis_data[labels[idx]] = Eis(area=area)
-        eis_data[labels[idx]].read_data(eis)
-        eis_data[labels[idx]].calc_eis_cap()
-        eis_data[labels[idx]].prep_export()
+        with progress.span(
+            idx / len(file_list), (idx + 1) / len(file_list), f"EIS {labels[idx]}"
+        ):
+            eis_data[labels[idx]] = Eis(area=area)
+            eis_data[labels[idx]].read_data(eis)
+            progress.report(0.7)
+            eis_data[labels[idx]].calc_eis_cap()
+            eis_data[labels[idx]].prep_export()
     return eis_data
 
 
+def run_pipeline(func, kwargs, pipeline=0):
+    """
+    Runs one calc_* pipeline, re-raising a missing column as a FileKeyError
+    naming the pipeline and the files it was given (its first argument).
+    Progress is reported as that of the pipeline-th pipeline.
+    """
+    progress.start(pipeline)
+    try:
+        result = func(**kwargs)
+    except FileKeyError:
+        raise
+    except KeyError as exc:
+        key = exc.args[0] if exc.args else ""
+        raise FileKeyError(key, func.__name__, next(iter(kwargs.values()))) from exc
+    progress.report(1)
+    return result
+
+
+def pipeline_files(kwargs):
+    files = next(iter(kwargs.values()))
+    files = [files] if isinstance(files, str) else files
+    return [file for file in files if len(file) != 0]
+
+
+def run_pipelines(pipelines, max_workers=None, on_progress=None, cancel=None):
+    """
+    Runs independent (func, kwargs) pipelines and returns their results in the
+    same order. When more than one pipeline has files to process and the files
+    are large enough to be worth starting workers, each pipeline runs in its
+    own process; otherwise they run one after another. Either way the first
+    error, in pipeline order, is raised.
+
+    on_progress(fraction, detail) is called with the overall progress, each
+    pipeline weighted by the size of its files. Once cancel (a
+    threading.Event) is set, every pipeline stops at its next chunk or cycle
+    boundary and progress.Cancelled is raised.
+    """
+    files = [pipeline_files(kwargs) for _, kwargs in pipelines]
+    sizes = [sum(os.path.getsize(file) for file in group) for group in files]
+    busy = sum(1 for group in files if group)
+    tracker = progress.Tracker(sizes, on_progress) if on_progress else None
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers <= 1 or busy <= 1 or sum(sizes) < PARALLEL_THRESHOLD:
+        progress.install(tracker, cancel)
+        try:
+            return [
+                run_pipeline(func, kwargs, idx)
+                for idx, (func, kwargs) in enumerate(pipelines)
+            ]
+        finally:
+            progress.uninstall()
+
+    # workers report through a queue and watch their own copy of the cancel flag
+    reports, stop = multiprocessing.Queue(), multiprocessing.Event()
+    pool = ProcessPoolExecutor(
+        max_workers=min(max_workers, busy),
+        initializer=progress.init_worker,
+        initargs=(reports if tracker else None, stop),
+    )
+    try:
+        futures = [
+            pool.submit(instrumentation.collect, run_pipeline, func, kwargs, idx)
+            if group
+            else None
+            for idx, ((func, kwargs), group) in enumerate(zip(pipelines, files))
+        ]
+        running = [future for future in futures if future]
+        while running:
+            if tracker:
+                tracker.drain(reports, timeout=0.1)
+            else:
+                wait(running, timeout=0.1)
+            if cancel is not None and cancel.is_set():
+                stop.set()
+            running = [future for future in running if not future.done()]
+        if tracker:
+            tracker.drain(reports, timeout=0)
+        return [
+            instrumentation.unpack(future.result())
+            if future
+            else run_pipeline(func, kwargs)
+            for future, (func, kwargs) in zip(futures, pipelines)
+        ]
+    finally:
+        stop.set()
+        pool.shutdown(cancel_futures=True)
+
+
+@instrumentation.instrument
 def process_data(
     mass_entry,
     area_entry,
@@ -56,6 +212,13 @@ def process_data(
     eis_ocv_after_display,
     eis_p_5V_after_display,
     eis_one_V_after_display,
+    extra_cvs_before=(),
+    extra_cvs_after=(),
+    incremental_aging=False,
+    cv_all_cycles=False,
+    max_workers=None,
+    on_progress=None,
+    cancel=None,
 ):
 
     mass = float(mass_entry)
@@ -63,11 +226,26 @@ def process_data(
 
     aging_file = aging_data_display
 
-    cvs_before_files = [
-        cvs_five_before_display,
-        cvs_p_5_before_display,
+    # (file, scan rate) pairs; two files at the same rate (to four significant
+    # digits) keep the last one
+    cv_files = {
+        "before": [
+            (cvs_five_before_display, 5),
+            (cvs_p_5_before_display, 0.5),
+            *extra_cvs_before,
+        ],
+        "after": [
+            (cvs_five_after_display, 5),
+            (cvs_p_5_after_display, 0.5),
+            *extra_cvs_after,
+        ],
+    }
+    cv_pipelines = [
+        (stage, scan_rate(rate), float(rate), file)
+        for stage, pairs in cv_files.items()
+        for file, rate in pairs
+        if len(file) != 0
     ]
-    cvs_after_files = [cvs_five_after_display, cvs_p_5_after_display]
 
     eis_before_files = [
         eis_ocv_before_display,
@@ -80,10 +258,39 @@ def process_data(
         eis_one_V_after_display,
     ]
 
-    aging_data = calc_aging_data(file=aging_file, mass=mass, area=area)
-    cvs_before = calc_cv_data(file_list=cvs_before_files, mass=mass)
-    cvs_after = calc_cv_data(file_list=cvs_after_files, mass=mass)
-    eis_before = calc_eis_data(file_list=eis_before_files, area=area)
-    eis_after = calc_eis_data(file_list=eis_after_files, area=area)
+    aging_data, eis_before, eis_after, *cv_results = run_pipelines(
+        [
+            (
+                calc_aging_data,
+                dict(
+                    file=aging_file, mass=mass, area=area, incremental=incremental_aging
+                ),
+            ),
+            (calc_eis_data, dict(file_list=eis_before_files, area=area)),
+            (calc_eis_data, dict(file_list=eis_after_files, area=area)),
+            *[
+                (
+                    calc_cv_file,
+                    dict(file=file, rate=rate, mass=mass, all_cycles=cv_all_cycles),
+                )
+                for _, _, rate, file in cv_pipelines
+            ],
+        ],
+        max_workers=max_workers,
+        on_progress=on_progress,
+        cancel=cancel,
+    )
+
+    cvs = {"before": {}, "after": {}}
+    for (stage, key, _, _), cv in zip(cv_pipelines, cv_results):
+        cvs[stage][key] = cv
+    cvs_before, cvs_after = cvs["before"], cvs["after"]
+
+    # one batch over every spectrum, so the fits at the next bias and at the
+    # same bias on the other side of aging can warm-start each other
+    eis_data, neighbours = spectra_neighbours(eis_before, eis_after)
+    fit_eis(eis_data, neighbours=neighbours)
+    # spectra on the same frequencies share one factorization
+    validate_eis(eis_data)
 
     return aging_data, cvs_before, cvs_after, eis_before, eis_after
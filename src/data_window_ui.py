@@ -1,22 +1,39 @@
+import io
+import threading
+
 from collections import deque
 
+import instrumentation
+import thumbnail_cache
+
 from data_export import export_data
+from progress import Cancelled
+from rate_capability import rate_capability
 
 from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from PyQt5.QtCore import pyqtSignal, QEvent
+from PyQt5.QtCore import pyqtSignal, Qt, QObject, QRunnable, QThreadPool, QTimer
+from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import (
     QFileDialog,
+    QLabel,
     QMainWindow,
+    QMessageBox,
+    QProgressDialog,
     QPushButton,
     QVBoxLayout,
     QHBoxLayout,
     QStackedLayout,
     QGridLayout,
     QWidget,
+    QTableWidget,
+    QTableWidgetItem,
 )
 
+THUMBNAIL_SIZE = 150
+
 
 class MplCanvas(FigureCanvasQTAgg):
     def __init__(self, parent=None):
@@ -25,26 +42,88 @@ class MplCanvas(FigureCanvasQTAgg):
         super().__init__(self.fig)
 
 
-class ClickableWidget(MplCanvas):
-    clicked = pyqtSignal(int)
+class ThumbnailCanvas:
+    """
+    Off-screen figure a thumbnail is drawn into once and saved as a PNG.
+    """
 
-    def __init__(self, idx=None, parent=None):
-        self.fig = Figure(dpi=100)
+    def __init__(self, ratio=1) -> None:
+        self.fig = Figure(
+            figsize=(THUMBNAIL_SIZE / 100, THUMBNAIL_SIZE / 100),
+            dpi=100 * ratio,
+            constrained_layout=True,
+        )
+        FigureCanvasAgg(self.fig)
         self.axes = self.fig.add_subplot()
-        super().__init__(self.fig)
-        self.setMaximumSize(150, 150)
-        self.setMinimumSize(50, 50)
         self.axes.get_xaxis().set_visible(False)
         self.axes.get_yaxis().set_visible(False)
+
+    def png(self):
+        buffer = io.BytesIO()
+        self.fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+
+
+class ClickableWidget(QLabel):
+    """
+    Side panel button showing a pre-rendered thumbnail; Qt only scales the
+    image when the panel is resized or repainted.
+    """
+
+    clicked = pyqtSignal(int)
+
+    def __init__(self, idx=None, parent=None):
+        super().__init__(parent)
+        self.setMaximumSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.setMinimumSize(50, 50)
+        self.setScaledContents(True)
+        self.setCursor(Qt.PointingHandCursor)
         self.index = idx
-        self.installEventFilter(self)
 
-    def eventFilter(self, obj, event):
-        if isinstance(obj, MplCanvas) and event.type() == QEvent.MouseButtonPress:
-            self.clicked.emit(self.index)
-        return QWidget.eventFilter(self, obj, event)
+    def mousePressEvent(self, event):
+        self.clicked.emit(self.index)
+
+
+class ExportSignals(QObject):
+    finished = pyqtSignal()
+    error = pyqtSignal(str)
+    progress = pyqtSignal(float, str)
+    cancelled = pyqtSignal()
+
 
+class ExportWorker(QRunnable):
+    """
+    Runs export_data off the GUI thread, reporting progress until it is
+    done, fails or is cancelled.
+    """
 
+    def __init__(self, file_name, **data) -> None:
+        super().__init__()
+        self.signals = ExportSignals()
+        self.file_name = file_name
+        self.data = data
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            export_data(
+                file_name=self.file_name,
+                **self.data,
+                on_progress=self.signals.progress.emit,
+                cancel=self.cancel_event,
+            )
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as exc:
+            self.signals.error.emit(str(exc))
+        else:
+            self.signals.finished.emit()
+
+
+@instrumentation.instrument
 class DataWindow(QMainWindow):
     def __init__(self, aging_data, cvs_before, cvs_after, eis_before, eis_after):
         super().__init__()
@@ -55,6 +134,16 @@ class DataWindow(QMainWindow):
         self.cvs_after = cvs_after
         self.eis_before = eis_before
         self.eis_after = eis_after
+        self.rates_before = rate_capability(cvs_before)
+        self.rates_after = rate_capability(cvs_after)
+
+        if self.aging_data:
+            self.aging_data.prep_data()
+            self.aging_data.prep_first_and_last_cycle()
+            self.aging_data.prep_export()
+        self.plots = self.plot_list()
+        # two columns of thumbnails, at least the twelve of a full data set
+        slots = max(12, len(self.plots) + len(self.plots) % 2)
 
         pagelayout = QHBoxLayout()
         button_layout = QGridLayout()
@@ -67,189 +156,367 @@ class DataWindow(QMainWindow):
         buttons.setLayout(button_layout)
         buttons.setFixedWidth(350)
 
-        window_queue = deque(maxlen=12)
-
-        for i in range(12):
-            fig = MplCanvas()
-            fig_toolbar = NavigationToolbar(fig, self)
+        # pages are empty until first shown, see build_page
+        self.pages = []
+        for i in range(slots):
             window = QWidget()
-            window_layout = QVBoxLayout()
-            window.setLayout(window_layout)
-            window_layout.addWidget(fig_toolbar)
-            window_layout.addWidget(fig)
+            window.setLayout(QVBoxLayout())
             self.stacklayout.addWidget(window)
-            window_queue.append(fig)
+            self.pages.append(window)
+        self.built = set()
 
-        widget_slot_queue = deque(maxlen=12)
-
-        for i in range(12):
+        self.thumbnails = []
+        for i in range(slots):
             button = ClickableWidget(idx=i)
             button.clicked.connect(self.change_active_view)
             if i % 2 == 0:
                 button_layout.addWidget(button, int(i / 2), 0, 1, 1)
             else:
                 button_layout.addWidget(button, int(i / 2), 1, 1, 1)
-            widget_slot_queue.append(button)
+            self.thumbnails.append(button)
 
-        export = QPushButton("Export Data")
-        export.setStyleSheet("background-color: #007AFF")
-        export.clicked.connect(self.get_export_location)
-        button_layout.addWidget(export, 7, 0, 1, 2)
+        self.export = QPushButton("Export Data")
+        self.export.setStyleSheet("background-color: #007AFF")
+        self.export.clicked.connect(self.get_export_location)
+        button_layout.addWidget(self.export, slots // 2 + 1, 0, 1, 2)
 
         pagelayout.addWidget(stack)
         pagelayout.addWidget(buttons)
 
-        if self.aging_data:
-            self.aging_data.prep_data()
-            btn = widget_slot_queue.popleft()
-            self.aging_data.plot_IR_drop_cap_fade_vs_cycle(axis=btn.axes, axis_labels=1)
-            fig = window_queue.popleft()
-            self.aging_data.plot_IR_drop_cap_fade_vs_cycle(axis=fig.axes)
-
-            btn2 = widget_slot_queue.popleft()
-            self.aging_data.plot_IR_drop_cap_fade_vs_qirr(axis=btn2.axes, axis_labels=1)
-            fig2 = window_queue.popleft()
-            self.aging_data.plot_IR_drop_cap_fade_vs_qirr(axis=fig2.axes)
-
-            btn3 = widget_slot_queue.popleft()
-            self.aging_data.plot_first_and_last_cycle(axis=btn3.axes)
-            fig3 = window_queue.popleft()
-            self.aging_data.plot_first_and_last_cycle(axis=fig3.axes, legend=1)
-            self.aging_data.prep_export()
+        if instrumentation.ENABLED:
+            self.performance = QTableWidget()
+            self.stacklayout.addWidget(self.performance)
+            performance = QPushButton("Performance")
+            performance.clicked.connect(self.show_performance)
+            button_layout.addWidget(performance, slots // 2 + 2, 0, 1, 2)
 
-        if self.cvs_before and self.cvs_after:
-            for (keyb, keya) in zip(self.cvs_before, self.cvs_after):
-                btn = widget_slot_queue.popleft()
-                self.cvs_before[keyb].plot_cv_cap_current_density(
-                    axis=btn.axes, color="tab:red"
-                )
-                self.cvs_after[keya].plot_cv_cap_current_density(
-                    axis=btn.axes, color="k"
-                )
+        widget = QWidget()
+        widget.setLayout(pagelayout)
+        self.setCentralWidget(widget)
 
-                fig = window_queue.popleft()
-                self.cvs_before[keyb].plot_cv_cap_current_density(
-                    label="before aging", axis=fig.axes, color="tab:red"
+        # the window shows first, then the first page and the thumbnails are
+        # drawn, one at a time so the window stays responsive
+        self.pending_thumbnails = deque(range(len(self.thumbnails)))
+        QTimer.singleShot(0, lambda: self.change_active_view(0))
+        QTimer.singleShot(0, self.draw_next_thumbnail)
+
+    def plot_list(self):
+        """
+        Every available plot, in the order of the side panel, as its kind,
+        the values it shows (which key its cached thumbnail) and a pair of
+        functions drawing its thumbnail and its full page into a canvas.
+        """
+        plots = []
+        aging, cvs_before, cvs_after = self.aging_data, self.cvs_before, self.cvs_after
+        eis_before, eis_after = self.eis_before, self.eis_after
+
+        if aging:
+            first, last = aging.data_dict[aging.first], aging.data_dict[aging.last]
+            plots.append(
+                (
+                    "capacitance and IR drop vs cycle",
+                    [aging.aging_cycles, aging.discharge_cap, aging.IR_drop],
+                    lambda c: aging.plot_IR_drop_cap_fade_vs_cycle(
+                        axis=c.axes, axis_labels=1
+                    ),
+                    lambda c: aging.plot_IR_drop_cap_fade_vs_cycle(axis=c.axes),
                 )
-                self.cvs_after[keya].plot_cv_cap_current_density(
-                    label="after aging", axis=fig.axes, color="k"
+            )
+            plots.append(
+                (
+                    "capacitance and IR drop vs Qirr",
+                    [aging.total_qirr, aging.discharge_cap, aging.IR_drop],
+                    lambda c: aging.plot_IR_drop_cap_fade_vs_qirr(
+                        axis=c.axes, axis_labels=1
+                    ),
+                    lambda c: aging.plot_IR_drop_cap_fade_vs_qirr(axis=c.axes),
                 )
-
-        if self.cvs_before and not self.cvs_after:
-            for keyb in self.cvs_before:
-                btn = widget_slot_queue.popleft()
-                self.cvs_before[keyb].plot_cv_cap_current_density(
-                    axis=btn.axes, color="tab:red"
+            )
+            plots.append(
+                (
+                    "first and last cycle",
+                    [
+                        aging.charge_time_first,
+                        first["Charge_voltage"],
+                        aging.discharge_time_first,
+                        first["Discharge_voltage"],
+                        aging.charge_time_last,
+                        last["Charge_voltage"],
+                        aging.discharge_time_last,
+                        last["Discharge_voltage"],
+                    ],
+                    lambda c: aging.plot_first_and_last_cycle(axis=c.axes),
+                    lambda c: aging.plot_first_and_last_cycle(axis=c.axes, legend=1),
                 )
-
-                fig = window_queue.popleft()
-                self.cvs_before[keyb].plot_cv_cap_current_density(
-                    label="before aging", axis=fig.axes, color="tab:red"
+            )
+
+        def cv_plot(before, after):
+            def draw(canvas, full=False):
+                if before:
+                    before.plot_cv_cap_current_density(
+                        label="before aging" if full else None,
+                        axis=canvas.axes,
+                        color="tab:red",
+                    )
+                if after:
+                    after.plot_cv_cap_current_density(
+                        label="after aging" if full else None,
+                        axis=canvas.axes,
+                        color="k",
+                    )
+
+            values = [
+                value
+                for cv in [before, after]
+                for value in ([cv.rate, cv.potential, cv.capacitance] if cv else [None])
+            ]
+            return "CV capacitance", values, draw, lambda c: draw(c, full=True)
+
+        # the CVs before and after aging at the same scan rate share a plot
+        cvs_before, cvs_after = cvs_before or {}, cvs_after or {}
+        for rate in {**cvs_before, **cvs_after}:
+            plots.append(cv_plot(cvs_before.get(rate), cvs_after.get(rate)))
+
+        rates_before, rates_after = self.rates_before, self.rates_after
+
+        def rates_plot(kind, method, columns):
+            def draw(canvas, full=False):
+                if rates_before:
+                    getattr(rates_before, method)(
+                        axis=canvas.axes,
+                        color="tab:red",
+                        label="before aging" if full else None,
+                    )
+                if rates_after:
+                    getattr(rates_after, method)(
+                        axis=canvas.axes,
+                        color="k",
+                        label="after aging" if full else None,
+                    )
+
+            values = [
+                value
+                for rates in [rates_before, rates_after]
+                for value in (columns(rates) if rates else [None])
+            ]
+            return kind, values, draw, lambda c: draw(c, full=True)
+
+        if rates_before or rates_after:
+            plots.append(
+                rates_plot(
+                    "capacitance vs scan rate",
+                    "plot_capacitance_vs_rate",
+                    lambda rates: [rates.rates, rates.discharge_cap],
                 )
-
-        if self.cvs_after and not self.cvs_before:
-            for keya in self.cvs_after:
-                btn = widget_slot_queue.popleft()
-                self.cvs_after[keya].plot_cv_cap_current_density(
-                    axis=btn.axes, color="k"
-                )
-
-                fig = window_queue.popleft()
-                self.cvs_after[keya].plot_cv_cap_current_density(
-                    label="after aging", axis=fig.axes, color="k"
+            )
+            plots.append(
+                rates_plot(
+                    "b-value vs potential",
+                    "plot_b_values",
+                    lambda rates: [
+                        rates.dunn[branch][column]
+                        for branch in ["anodic", "cathodic"]
+                        for column in ["potential", "b"]
+                    ],
                 )
+            )
 
         eis_labels = ["OCV", "0.5 V", "1.0 V"]
         eis_colors = ["black", "tab:red", "tab:blue"]
-        if self.eis_before and self.eis_after:
-            for keyb, keya, label in zip(self.eis_before, self.eis_after, eis_labels):
-                btn = widget_slot_queue.popleft()
-                self.eis_before[keyb].plot_caps_vs_freq(axis=btn.axes)
-                self.eis_after[keya].plot_caps_vs_freq(axis=btn.axes, color="k")
-
-                fig = window_queue.popleft()
-                self.eis_before[keyb].plot_caps_vs_freq(
-                    label=f"{label} before aging", axis=fig.axes
-                )
-                self.eis_after[keya].plot_caps_vs_freq(
-                    label=f"{label} after aging", color="k", axis=fig.axes
-                )
-
-        if self.eis_before:
-            btn = widget_slot_queue.popleft()
-            fig = window_queue.popleft()
-            for key, label, color in zip(self.eis_before, eis_labels, eis_colors):
-                self.eis_before[key].nyquist_plots(
-                    figure=btn.fig,
-                    axis=btn.axes,
-                    marker="o",
-                    axis_labels=1,
-                    color=color,
-                )
-                self.eis_before[key].nyquist_plots(
-                    label=f"{label} before aging",
-                    figure=fig.fig,
-                    axis=fig.axes,
-                    marker="o",
-                    color=color,
-                )
-
-            btn = widget_slot_queue.popleft()
-            fig = window_queue.popleft()
 
-            for key, label, color in zip(self.eis_before, eis_labels, eis_colors):
-                self.eis_before[key].plot_img_cap_vs_real_Z(
-                    axis=btn.axes, marker="o", color=color
+        def caps_plot(before, after, label):
+            def draw(canvas, full=False):
+                before.plot_caps_vs_freq(
+                    label=f"{label} before aging" if full else "", axis=canvas.axes
                 )
-                self.eis_before[key].plot_img_cap_vs_real_Z(
-                    label=f"{label} before aging",
-                    axis=fig.axes,
-                    marker="o",
-                    color=color,
+                after.plot_caps_vs_freq(
+                    label=f"{label} after aging" if full else "",
+                    color="k",
+                    axis=canvas.axes,
                 )
 
-        if self.eis_after:
-            btn = widget_slot_queue.popleft()
-            fig = window_queue.popleft()
-            for key, label, color in zip(self.eis_after, eis_labels, eis_colors):
-                self.eis_after[key].nyquist_plots(
-                    figure=btn.fig,
-                    axis=btn.axes,
-                    marker="s",
-                    axis_labels=1,
-                    color=color,
-                )
-                self.eis_after[key].nyquist_plots(
-                    label=f"{label} after aging",
-                    figure=fig.fig,
-                    axis=fig.axes,
-                    marker="s",
-                    color=color,
-                )
-
-            btn = widget_slot_queue.popleft()
-            fig = window_queue.popleft()
-
-            for key, label, color in zip(self.eis_after, eis_labels, eis_colors):
-                self.eis_after[key].plot_img_cap_vs_real_Z(
-                    axis=btn.axes, marker="s", color=color
-                )
-                self.eis_after[key].plot_img_cap_vs_real_Z(
-                    label=f"{label} after aging", axis=fig.axes, marker="s", color=color
-                )
-
-        widget = QWidget()
-        widget.setLayout(pagelayout)
-        self.setCentralWidget(widget)
+            values = [
+                value
+                for eis in [before, after]
+                for value in [eis.df["freq/Hz"], eis.df["C'"], eis.df["C''"], eis.area]
+            ]
+            return (
+                "capacitance vs frequency",
+                values,
+                draw,
+                lambda c: draw(c, full=True),
+            )
+
+        if eis_before and eis_after:
+            for keyb, keya, label in zip(eis_before, eis_after, eis_labels):
+                plots.append(caps_plot(eis_before[keyb], eis_after[keya], label))
+
+        def nyquist_plot(eis_data, marker, stage):
+            def draw(canvas, full=False):
+                for key, label, color in zip(eis_data, eis_labels, eis_colors):
+                    if full:
+                        eis_data[key].nyquist_plots(
+                            label=f"{label} {stage} aging",
+                            figure=canvas.fig,
+                            axis=canvas.axes,
+                            marker=marker,
+                            color=color,
+                        )
+                    else:
+                        eis_data[key].nyquist_plots(
+                            figure=canvas.fig,
+                            axis=canvas.axes,
+                            marker=marker,
+                            axis_labels=1,
+                            color=color,
+                        )
+
+            values = [
+                eis_data[key].df[column]
+                for key in eis_data
+                for column in ["Re(Z)/Ohm", "-Im(Z)/Ohm"]
+            ] + [eis_data[key].area for key in eis_data]
+            return f"Nyquist {marker}", values, draw, lambda c: draw(c, full=True)
+
+        def img_cap_plot(eis_data, marker, stage):
+            def draw(canvas, full=False):
+                for key, label, color in zip(eis_data, eis_labels, eis_colors):
+                    eis_data[key].plot_img_cap_vs_real_Z(
+                        label=f"{label} {stage} aging" if full else None,
+                        axis=canvas.axes,
+                        marker=marker,
+                        color=color,
+                    )
+
+            values = [
+                eis_data[key].df[column]
+                for key in eis_data
+                for column in ["Re(Z)/Ohm", "C''"]
+            ] + [eis_data[key].area for key in eis_data]
+            return f"C'' vs Re(Z) {marker}", values, draw, lambda c: draw(c, full=True)
+
+        def kk_plot(eis_data, stage):
+            def draw(canvas, full=False):
+                for key, label, color in zip(eis_data, eis_labels, eis_colors):
+                    if eis_data[key].kk is not None:
+                        eis_data[key].plot_kk_residuals(
+                            label=f"{label} {stage} aging" if full else None,
+                            axis=canvas.axes,
+                            color=color,
+                        )
+
+            values = [
+                value
+                for key in eis_data
+                if eis_data[key].kk is not None
+                for value in [
+                    eis_data[key].kk.omega,
+                    eis_data[key].kk.residual_real,
+                    eis_data[key].kk.residual_imag,
+                    eis_data[key].kk.passed,
+                ]
+            ]
+            return f"Lin-KK {stage}", values, draw, lambda c: draw(c, full=True)
+
+        if eis_before:
+            plots.append(nyquist_plot(eis_before, "o", "before"))
+            plots.append(img_cap_plot(eis_before, "o", "before"))
+        if eis_after:
+            plots.append(nyquist_plot(eis_after, "s", "after"))
+            plots.append(img_cap_plot(eis_after, "s", "after"))
+        for eis_data, stage in [(eis_before, "before"), (eis_after, "after")]:
+            if eis_data and any(eis.kk is not None for eis in eis_data.values()):
+                plots.append(kk_plot(eis_data, stage))
+
+        return plots
+
+    def build_page(self, idx):
+        """
+        Creates the figure of a page and draws its plot, the first time the
+        page is shown.
+        """
+        self.built.add(idx)
+        fig = MplCanvas()
+        layout = self.pages[idx].layout()
+        layout.addWidget(NavigationToolbar(fig, self))
+        layout.addWidget(fig)
+        if idx < len(self.plots):
+            self.plots[idx][3](fig)
+        fig.draw_idle()
+
+    def draw_next_thumbnail(self):
+        if not self.pending_thumbnails:
+            return
+        idx = self.pending_thumbnails.popleft()
+        self.thumbnails[idx].setPixmap(self.render_thumbnail(idx))
+        QTimer.singleShot(0, self.draw_next_thumbnail)
+
+    def render_thumbnail(self, idx):
+        """
+        The thumbnail of a plot (an empty frame for unused slots), drawn
+        off-screen once at the screen's pixel density and then taken from
+        the thumbnail cache.
+        """
+        kind, values, draw = "empty", [], None
+        if idx < len(self.plots):
+            kind, values, draw = self.plots[idx][:3]
+        ratio = self.devicePixelRatioF()
+        key = thumbnail_cache.key(kind, values, round(THUMBNAIL_SIZE * ratio))
+        png = thumbnail_cache.load(key)
+        if png is None:
+            canvas = ThumbnailCanvas(ratio)
+            if draw:
+                draw(canvas)
+            png = canvas.png()
+            thumbnail_cache.store(key, png)
+        pixmap = QPixmap()
+        pixmap.loadFromData(png, "PNG")
+        pixmap.setDevicePixelRatio(ratio)
+        return pixmap
 
     def change_active_view(self, clicked):
+        if clicked not in self.built:
+            self.build_page(clicked)
         self.stacklayout.setCurrentIndex(clicked)
 
+    def show_performance(self):
+        """
+        Fills the performance page with the timing records made so far.
+        """
+        columns = [
+            ("Stage", "stage"),
+            ("Wall (s)", "wall_s"),
+            ("CPU (s)", "cpu_s"),
+            ("Rows", "rows"),
+            ("RSS (MB)", "rss_MB"),
+            ("Peak RSS (MB)", "peak_rss_MB"),
+            ("Traced peak (MB)", "traced_peak_MB"),
+        ]
+        # records are made as stages finish; list them in the order they began
+        records = sorted(instrumentation.records, key=lambda r: r["started"])
+        self.performance.setColumnCount(len(columns))
+        self.performance.setRowCount(len(records))
+        self.performance.setHorizontalHeaderLabels([label for label, _ in columns])
+        for row, record in enumerate(records):
+            for col, (_, key) in enumerate(columns):
+                value = record[key]
+                if key == "stage":
+                    text = "    " * record["depth"] + value
+                elif value is None:
+                    text = ""
+                elif isinstance(value, float):
+                    text = f"{value:.3f}" if key.endswith("_s") else f"{value:.1f}"
+                else:
+                    text = str(value)
+                self.performance.setItem(row, col, QTableWidgetItem(text))
+        self.performance.resizeColumnsToContents()
+        self.stacklayout.setCurrentWidget(self.performance)
+
     def get_export_location(self):
         file_name, filters = QFileDialog.getSaveFileName(self, filter="Excel (*.xlsx)")
         if not file_name:
             return
-        export_data(
+        worker = ExportWorker(
             file_name=file_name,
             aging_data=self.aging_data,
             cvs_before=self.cvs_before,
@@ -257,3 +524,35 @@ class DataWindow(QMainWindow):
             eis_before=self.eis_before,
             eis_after=self.eis_after,
         )
+        self.export.setEnabled(False)
+        self.export_progress = QProgressDialog(
+            "Exporting data...", "Cancel", 0, 1000, self
+        )
+        self.export_progress.setWindowTitle("SuperCap Aging")
+        self.export_progress.setWindowModality(Qt.WindowModal)
+        self.export_progress.setMinimumDuration(0)
+        self.export_progress.setAutoReset(False)
+        self.export_progress.setValue(0)
+        self.export_progress.canceled.connect(worker.cancel)
+        worker.signals.progress.connect(self.update_export_progress)
+        worker.signals.finished.connect(self.end_export)
+        worker.signals.cancelled.connect(self.end_export)
+        worker.signals.error.connect(self.export_error)
+        QThreadPool.globalInstance().start(worker)
+
+    def update_export_progress(self, fraction, detail):
+        if self.export_progress.wasCanceled():
+            return
+        self.export_progress.setValue(round(fraction * 1000))
+        if detail:
+            self.export_progress.setLabelText(f"{detail}...")
+
+    def end_export(self):
+        self.export_progress.close()
+        self.export.setEnabled(True)
+
+    def export_error(self, error):
+        self.end_export()
+        QMessageBox.warning(
+            self, "Export Error", f"The data could not be exported:\n\n{error}"
+        )
@@ -0,0 +1,146 @@
+"""
+Level-of-detail decimation for long line plots. Only about two points per
+pixel column of the axis are handed to matplotlib: a vectorized min-max pass
+keeps every bucket's extremes, then largest-triangle-three-buckets (LTTB)
+picks the points that best keep the shape of the curve. The full-resolution
+arrays are kept, and the points inside the x-limits are decimated again
+whenever the limits change or the canvas is resized, so zooming in shows
+every point. x need not be monotonic: a CV sweeps back and forth through
+the same potentials, and only the stretches of it inside the limits are
+drawn, with a break between them.
+"""
+
+import numpy as np
+
+# curves with fewer points are plotted as they are
+MIN_POINTS = 2000
+
+
+def minmax(y, buckets):
+    """
+    Indices of the first and last point and of the smallest and largest
+    value of y in each of buckets equal slices, in order.
+    """
+    n = len(y)
+    if n <= 2 * buckets + 2:
+        return np.arange(n)
+    size = -(-n // buckets)
+    # pad with the last value so every bucket has the same size
+    padded = np.pad(y, (0, size * buckets - n), mode="edge").reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    low = np.minimum(offsets + np.argmin(padded, axis=1), n - 1)
+    high = np.minimum(offsets + np.argmax(padded, axis=1), n - 1)
+    return np.unique(np.concatenate([[0, n - 1], low, high]))
+
+
+def lttb(x, y, points):
+    """
+    Indices of the points largest-triangle-three-buckets keeps: the first,
+    the last and, from each of points - 2 buckets in between, the point
+    making the largest triangle with the point kept before it and the mean
+    of the next bucket.
+    """
+    n = len(x)
+    if n <= points or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # mean of each bucket, and of the last point for the final bucket
+    counts = np.append(np.diff(edges), 1)
+    means_x = np.add.reduceat(x, edges) / counts
+    means_y = np.add.reduceat(y, edges) / counts
+
+    # buckets hold a few points after the min-max pass, where plain Python
+    # is much faster than a NumPy call per bucket
+    xs, ys, edges = x.tolist(), y.tolist(), edges.tolist()
+    means_x, means_y = means_x.tolist(), means_y.tolist()
+    kept = [0]
+    for bucket in range(points - 2):
+        ax, ay = xs[kept[-1]], ys[kept[-1]]
+        cx, cy = means_x[bucket + 1], means_y[bucket + 1]
+        best, best_area = None, -1.0
+        for idx in range(edges[bucket], edges[bucket + 1]):
+            area = abs((ax - cx) * (ys[idx] - ay) - (ax - xs[idx]) * (cy - ay))
+            if area > best_area:
+                best, best_area = idx, area
+        if best is not None:
+            kept.append(best)
+    kept.append(n - 1)
+    return np.array(kept, dtype=np.int64)
+
+
+def decimate(x, y, points):
+    """
+    Indices of at most points points of the curve (x, y) that draw like the
+    whole curve at that resolution.
+    """
+    if len(x) <= points:
+        return np.arange(len(x))
+    candidates = minmax(y, points)
+    return candidates[lttb(x[candidates], y[candidates], points)]
+
+
+def visible(x, low, high):
+    """
+    Indices of the points between the x-limits low and high, plus the point
+    either side of every run of them so the line runs to the edges, or None
+    if there are none.
+    """
+    inside = (x >= min(low, high)) & (x <= max(low, high))
+    if not inside.any():
+        return None
+    near = inside.copy()
+    near[1:] |= inside[:-1]
+    near[:-1] |= inside[1:]
+    return np.flatnonzero(near)
+
+
+class DecimatedLine:
+    """
+    Keeps a Line2D showing a decimated view of the full (x, y) arrays,
+    updated from the axis' limit and the canvas' resize callbacks.
+    """
+
+    def __init__(self, axis, x, y, *args, **kwargs) -> None:
+        self.axis = axis
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        (self.line,) = axis.plot(*self.view(), *args, **kwargs)
+        # matplotlib only keeps weak references to bound methods
+        axis.callbacks.connect("xlim_changed", lambda axis: self.update())
+        axis.figure.canvas.mpl_connect("resize_event", lambda event: self.update())
+
+    def budget(self):
+        # two points per pixel column
+        return max(2 * int(self.axis.bbox.width), 200)
+
+    def view(self, limits=None):
+        shown = None if limits is None else visible(self.x, *limits)
+        if shown is None:
+            shown = np.arange(len(self.x))
+        kept = shown[decimate(self.x[shown], self.y[shown], self.budget())]
+        # stretches of the curve outside the limits are left out, so keep the
+        # ends of every run of shown points and break the line between runs
+        starts = np.flatnonzero(np.diff(shown) > 1) + 1
+        if not len(starts):
+            return self.x[kept], self.y[kept]
+        ends = shown[np.concatenate([[0], starts - 1, starts, [len(shown) - 1]])]
+        kept = np.union1d(kept, ends)
+        run = np.searchsorted(shown[starts], kept, side="right")
+        breaks = np.flatnonzero(np.diff(run)) + 1
+        return (
+            np.insert(self.x[kept], breaks, np.nan),
+            np.insert(self.y[kept], breaks, np.nan),
+        )
+
+    def update(self):
+        self.line.set_data(*self.view(self.axis.get_xlim()))
+
+
+def plot(axis, x, y, *args, **kwargs):
+    """
+    axis.plot(x, y, *args, **kwargs) for curves of any length; long curves
+    are drawn decimated to the resolution of the axis.
+    """
+    if len(x) <= MIN_POINTS:
+        return axis.plot(x, y, *args, **kwargs)[0]
+    return DecimatedLine(axis, x, y, *args, **kwargs).line
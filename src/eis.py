@@ -1,27 +1,41 @@
+import numpy as np
 import pandas as pd
 
+import parse_cache
+import instrumentation
 
+
+@instrumentation.instrument
 class Eis:
     def __init__(self, area) -> None:
         self.area = area
+        # circuit name -> fitted parameters, see eis_fitting.fit_eis
+        self.fits = {}
+        # Lin-KK validation, see kramers_kronig.validate_eis
+        self.kk = None
 
     def read_data(self, file_name):
-        self.df = pd.read_table(file_name)
+        """
+        Reads the spectrum and keeps the angular frequencies and the
+        complex impedance as arrays.
+        """
+        self.df = parse_cache.cached_read(file_name, pd.read_table, "read_table")
+        self.omega = 2 * np.pi * self.df["freq/Hz"].to_numpy(dtype=float)
+        self.z = self.df["Re(Z)/Ohm"].to_numpy(dtype=float) - 1j * self.df[
+            "-Im(Z)/Ohm"
+        ].to_numpy(dtype=float)
 
     def calc_eis_cap(self):
-        # Convert Hz to rad/s
-        self.df["C''"] = self.df["Re(Z)/Ohm"] / (
-            self.df["freq/Hz"] * 6.28 * self.df["|Z|/Ohm"] ** 2
-        )
-        self.df["C'"] = self.df["-Im(Z)/Ohm"] / (
-            self.df["freq/Hz"] * 6.28 * self.df["|Z|/Ohm"] ** 2
-        )
+        # complex capacitance C = 1 / (j omega Z) = C' - j C''
+        capacitance = 1 / (1j * self.omega * self.z)
+        self.df["C''"] = -capacitance.imag
+        self.df["C'"] = capacitance.real
 
     def prep_export(self):
         self.eis_df = pd.DataFrame(
             {
                 "Freq (Hz)": self.df["freq/Hz"],
-                "Freq (rad/s)": self.df["freq/Hz"] * 6.28,
+                "Freq (rad/s)": self.omega,
                 "Re(Z)/Ohm": self.df["Re(Z)/Ohm"],
                 "-Im(Z)/Ohm": self.df["-Im(Z)/Ohm"],
                 "C'' (F)": self.df["C''"],
@@ -101,3 +115,28 @@ class Eis:
         axis.set_ylabel("C'' (F/cm$^2$)")
         if label:
             axis.legend()
+
+    def plot_kk_residuals(self, axis, color, label=None):
+        freq = self.kk.omega / (2 * np.pi)
+        verdict = "valid" if self.kk.passed else "not valid"
+        axis.plot(
+            freq,
+            self.kk.residual_real * 100,
+            marker="o",
+            color=color,
+            label=f"Re {label} ({verdict})" if label else None,
+        )
+        axis.plot(
+            freq,
+            self.kk.residual_imag * 100,
+            marker="s",
+            color=color,
+            markerfacecolor="white",
+            label=f"Im {label}" if label else None,
+        )
+        axis.axhline(0, color="grey", linewidth=0.5)
+        axis.set_xscale("log")
+        axis.set_xlabel("Freq. (Hz)")
+        axis.set_ylabel("Lin-KK residual (%)")
+        if label:
+            axis.legend()
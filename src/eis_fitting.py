@@ -0,0 +1,434 @@
+"""
+Equivalent-circuit fitting of impedance spectra. Every circuit gives its
+impedance and the analytic derivatives of it with respect to its fitted
+parameters, as complex arrays over many spectra at once, so one
+Levenberg-Marquardt run fits a whole set of spectra with a handful of NumPy
+calls per iteration. Positive quantities are fitted as their logarithms,
+which keeps them positive and the steps well scaled, and the residuals are
+weighted by 1/|Z|. Spectra of different lengths are padded with
+zero-weight points.
+
+Each spectrum is first fitted from a guess made from its own data. Fits
+stuck in a worse minimum than a neighbouring spectrum's (the spectra at the
+next bias, or the same bias before or after aging, see spectra_neighbours)
+are then fitted again starting from that neighbour's parameters.
+"""
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+MAX_ITERATIONS = 200
+WARM_START_PASSES = 2
+# relative decrease of the cost below which a fit has converged
+TOLERANCE = 1e-10
+# bound of the logarithms of fitted quantities; a component the data do not
+# need ends at exp(-30), effectively zero, instead of underflowing
+LOG_LIMIT = 30.0
+
+
+class Circuit:
+    """
+    An equivalent circuit. Subclasses set the names of their parameters,
+    which are fitted as logarithms (log_params) and bounds on the fitted
+    values, and implement model(omega, theta) returning the impedance and
+    its derivatives with respect to each fitted value, and guess(omega, z).
+    omega and z are (spectra, points) arrays; theta is (spectra, params).
+    """
+
+    name = ""
+    params = []
+    log_params = []
+    lower = []
+    upper = []
+
+    def values(self, theta):
+        """
+        Parameter values from fitted values.
+        """
+        values = np.array(theta, dtype=float)
+        values[..., self.log_params] = np.exp(values[..., self.log_params])
+        return values
+
+    def fitted(self, values):
+        """
+        Fitted values from parameter values.
+        """
+        theta = np.array(values, dtype=float)
+        theta[..., self.log_params] = np.log(theta[..., self.log_params])
+        return theta
+
+    def impedance(self, omega, values):
+        """
+        Impedance of the circuit for (spectra, params) parameter values.
+        """
+        return self.model(omega, self.fitted(values))[0]
+
+
+def low_frequency(omega, z, weights):
+    """
+    Real part at the highest frequency, real part at the lowest frequency,
+    and the capacitance at the lowest frequency of each spectrum.
+    """
+    valid = weights > 0
+    high = np.where(valid, omega, -np.inf).argmax(axis=1)
+    low = np.where(valid, omega, np.inf).argmin(axis=1)
+    rows = np.arange(len(z))
+    r_high, z_low = z[rows, high].real, z[rows, low]
+    capacitance = -1 / (omega[rows, low] * np.minimum(z_low.imag, -1e-12))
+    return np.maximum(r_high, 1e-6), z_low.real, capacitance
+
+
+class RCPE(Circuit):
+    """
+    Series resistance and constant phase element:
+    Z = R + 1 / (Q (j omega)^alpha).
+    """
+
+    name = "R-CPE"
+    params = ["R (Ohm)", "Q (F s^(alpha-1))", "alpha"]
+    log_params = [0, 1]
+    lower = [-LOG_LIMIT, -LOG_LIMIT, 0.0]
+    upper = [LOG_LIMIT, LOG_LIMIT, 1.0]
+
+    def model(self, omega, theta):
+        log_r, log_q, alpha = (theta[:, [k]] for k in range(3))
+        log_s = np.log(omega) + 0.5j * np.pi
+        cpe = np.exp(-log_q - alpha * log_s)
+        z = np.exp(log_r) + cpe
+        return z, np.stack([np.exp(log_r) + 0 * cpe, -cpe, -cpe * log_s], axis=-1)
+
+    def guess(self, omega, z, weights):
+        r_high, _, capacitance = low_frequency(omega, z, weights)
+        return self.fitted(np.column_stack([r_high, capacitance, np.full(len(z), 0.9)]))
+
+
+class RandlesWarburg(Circuit):
+    """
+    Randles cell with semi-infinite Warburg diffusion: a series resistance,
+    then the double-layer capacitance in parallel with the charge transfer
+    resistance and Warburg element in series,
+    Z = Rs + 1 / (j omega C + 1 / (Rct + Aw / (j omega)^1/2)).
+    """
+
+    name = "Randles-Warburg"
+    params = ["Rs (Ohm)", "Rct (Ohm)", "C (F)", "Aw (Ohm s^-1/2)"]
+    log_params = [0, 1, 2, 3]
+    lower = [-LOG_LIMIT] * 4
+    upper = [LOG_LIMIT] * 4
+
+    def model(self, omega, theta):
+        r_s, r_ct, c, a_w = (np.exp(theta[:, [k]]) for k in range(4))
+        s = 1j * omega
+        warburg = a_w / np.sqrt(s)
+        branch = r_ct + warburg
+        parallel = 1 / (s * c + 1 / branch)
+        z = r_s + parallel
+        # d(parallel)/d(branch) = parallel^2 / branch^2
+        through = (parallel / branch) ** 2
+        return z, np.stack(
+            [r_s + 0 * z, through * r_ct, -(parallel**2) * s * c, through * warburg],
+            axis=-1,
+        )
+
+    def guess(self, omega, z, weights):
+        r_high, r_low, capacitance = low_frequency(omega, z, weights)
+        rest = np.maximum(r_low - r_high, 1e-3 * r_high)
+        low = np.where(weights > 0, omega, np.inf).min(axis=1)
+        return self.fitted(
+            np.column_stack(
+                [r_high, rest / 2, capacitance, rest / 2 * np.sqrt(2 * low)]
+            )
+        )
+
+
+class TransmissionLine(Circuit):
+    """
+    de Levie transmission line of a porous electrode with a constant phase
+    interface: a series resistance and pores of ionic resistance Rion,
+    Z = Rs + Rion coth(u) / u with u^2 = Rion Q (j omega)^alpha.
+    """
+
+    name = "Transmission line"
+    params = ["Rs (Ohm)", "Rion (Ohm)", "Q (F s^(alpha-1))", "alpha"]
+    log_params = [0, 1, 2]
+    lower = [-LOG_LIMIT, -LOG_LIMIT, -LOG_LIMIT, 0.0]
+    upper = [LOG_LIMIT, LOG_LIMIT, LOG_LIMIT, 1.0]
+
+    def model(self, omega, theta):
+        log_rs, log_ri, log_q, alpha = (theta[:, [k]] for k in range(4))
+        log_s = np.log(omega) + 0.5j * np.pi
+        u = np.exp(0.5 * (log_ri + log_q + alpha * log_s))
+        # coth from exp(-2u), which stays finite for the large |u| of high
+        # frequencies as Re(u) > 0
+        decay = np.exp(-2 * u)
+        coth = (1 + decay) / (1 - decay)
+        f = coth / u
+        # d(coth(u) / u)/du
+        df = -(coth**2 - 1 + f) / u
+        r_s, r_ion = np.exp(log_rs), np.exp(log_ri)
+        z = r_s + r_ion * f
+        half = r_ion * df * u / 2
+        return z, np.stack([r_s + 0 * z, r_ion * f + half, half, half * log_s], axis=-1)
+
+    def guess(self, omega, z, weights):
+        r_high, r_low, capacitance = low_frequency(omega, z, weights)
+        # the real part tends to Rs + Rion / 3 at low frequency
+        r_ion = 3 * np.maximum(r_low - r_high, 1e-3 * r_high)
+        return self.fitted(
+            np.column_stack([r_high, r_ion, capacitance, np.full(len(z), 0.95)])
+        )
+
+
+CIRCUITS = [RCPE(), RandlesWarburg(), TransmissionLine()]
+
+
+class CircuitFit:
+    """
+    Fitted parameter values of one circuit for every spectrum of a set, with
+    the weighted chi-squared of each fit, the iterations it took and whether
+    it converged.
+    """
+
+    def __init__(self, circuit, values, cost, points, iterations, converged) -> None:
+        self.circuit = circuit
+        self.values = values
+        self.cost = cost
+        dof = np.maximum(2 * points - len(circuit.params), 1)
+        self.chi_squared = cost / dof
+        self.iterations = iterations
+        self.converged = converged
+
+
+def pad_spectra(omegas, impedances):
+    """
+    Spectra of any lengths as (spectra, points) arrays, padded with
+    zero-weight points, and their weights 1/|Z|. Points with a missing
+    frequency or impedance are left out like padding.
+    """
+    points = max(len(omega) for omega in omegas)
+    omega = np.ones((len(omegas), points))
+    z = np.ones((len(omegas), points), dtype=np.complex128)
+    weights = np.zeros((len(omegas), points))
+    for row, (w, impedance) in enumerate(zip(omegas, impedances)):
+        usable = np.isfinite(w) & (w > 0) & np.isfinite(impedance) & (impedance != 0)
+        count = usable.sum()
+        omega[row, :count] = w[usable]
+        z[row, :count] = impedance[usable]
+        weights[row, :count] = 1 / np.abs(impedance[usable])
+    return omega, z, weights
+
+
+def residuals(circuit, omega, z, weights, theta):
+    """
+    Weighted real and imaginary residuals, their Jacobian and the cost of
+    each spectrum; non-finite models get an infinite cost.
+    """
+    model, derivatives = circuit.model(omega, theta)
+    diff = weights * (model - z)
+    derivatives = weights[..., None] * derivatives
+    r = np.concatenate([diff.real, diff.imag], axis=1)
+    jac = np.concatenate([derivatives.real, derivatives.imag], axis=1)
+    cost = (r**2).sum(axis=1)
+    bad = ~np.isfinite(cost) | ~np.isfinite(jac).all(axis=(1, 2))
+    cost[bad] = np.inf
+    return r, jac, cost
+
+
+def levenberg_marquardt(circuit, omega, z, weights, theta, max_iterations):
+    """
+    Fits every spectrum at once; each keeps its own damping and stops on its
+    own. Returns the fitted values, costs, iterations and convergence.
+    """
+    theta = np.clip(theta, circuit.lower, circuit.upper)
+    n, p = theta.shape
+    r, jac, cost = residuals(circuit, omega, z, weights, theta)
+    damping = np.full(n, 1e-3)
+    iterations = np.zeros(n, dtype=int)
+    converged = np.zeros(n, dtype=bool)
+    active = np.isfinite(cost)
+    eye = np.eye(p)
+
+    for _ in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if not len(idx):
+            break
+        jt = jac[idx].transpose(0, 2, 1)
+        normal = jt @ jac[idx]
+        gradient = (jt @ r[idx][..., None])[..., 0]
+        scale = np.einsum("nii->ni", normal)[:, :, None] * eye
+        step = np.linalg.solve(
+            normal + damping[idx, None, None] * (scale + 1e-12 * eye),
+            -gradient[..., None],
+        )[..., 0]
+        trial = np.clip(theta[idx] + step, circuit.lower, circuit.upper)
+        r_new, jac_new, cost_new = residuals(
+            circuit, omega[idx], z[idx], weights[idx], trial
+        )
+        better = cost_new < cost[idx]
+        improvement = (cost[idx] - cost_new) / np.maximum(cost[idx], 1e-300)
+
+        accepted = idx[better]
+        theta[accepted] = trial[better]
+        r[accepted], jac[accepted] = r_new[better], jac_new[better]
+        cost[accepted] = cost_new[better]
+        damping[accepted] = np.maximum(damping[accepted] / 3, 1e-12)
+        damping[idx[~better]] *= 4
+        iterations[idx] += 1
+
+        done = (better & (improvement < TOLERANCE)) | (np.abs(step).max(axis=1) < 1e-12)
+        converged[idx[done]] = True
+        active[idx[done | (damping[idx] > 1e12)]] = False
+    return theta, cost, iterations, converged
+
+
+@instrumentation.instrument
+def fit_spectra(
+    circuit,
+    omegas,
+    impedances,
+    max_iterations=MAX_ITERATIONS,
+    passes=WARM_START_PASSES,
+    neighbours=None,
+):
+    """
+    Fits circuit to every spectrum (angular frequencies and complex
+    impedances) together, then refits spectra from the parameters of their
+    neighbours wherever those describe them better. neighbours holds the
+    indices of the neighbours of every spectrum, by default the spectra
+    before and after it in the list.
+    """
+    omega, z, weights = pad_spectra(omegas, impedances)
+    theta, cost, iterations, converged = levenberg_marquardt(
+        circuit,
+        omega,
+        z,
+        weights,
+        circuit.guess(omega, z, weights),
+        max_iterations,
+    )
+
+    n = len(theta)
+    if neighbours is None:
+        neighbours = [
+            [near for near in (row - 1, row + 1) if 0 <= near < n] for row in range(n)
+        ]
+    width = max((len(near) for near in neighbours), default=0)
+    # padded with the spectrum itself, which is never a better start
+    table = np.array(
+        [
+            list(near) + [row] * (width - len(near))
+            for row, near in enumerate(neighbours)
+        ],
+        dtype=np.intp,
+    ).reshape(n, width)
+    for _ in range(passes if width else 0):
+        # the fit of each neighbour as a start, where it beats the own fit
+        start, start_cost = theta.copy(), cost.copy()
+        for neighbour in table.T:
+            candidate = theta[neighbour]
+            candidate_cost = residuals(circuit, omega, z, weights, candidate)[2]
+            better = candidate_cost < start_cost * (1 - 1e-6)
+            start[better], start_cost[better] = (
+                candidate[better],
+                candidate_cost[better],
+            )
+        idx = np.flatnonzero(start_cost < cost)
+        if not len(idx):
+            break
+        refit = levenberg_marquardt(
+            circuit, omega[idx], z[idx], weights[idx], start[idx], max_iterations
+        )
+        better = refit[1] < cost[idx]
+        rows = idx[better]
+        theta[rows], cost[rows] = refit[0][better], refit[1][better]
+        iterations[idx] += refit[2]
+        converged[rows] = refit[3][better]
+
+    points = (weights > 0).sum(axis=1)
+    return CircuitFit(
+        circuit, circuit.values(theta), cost, points, iterations, converged
+    )
+
+
+def spectra_neighbours(eis_before, eis_after):
+    """
+    Every Eis of the before and after dicts (bias -> Eis, in order of bias)
+    in one list, and the neighbours of each for fit_spectra: the spectra at
+    the next lower and higher bias, and the one at the same bias on the
+    other side of aging.
+    """
+    before, after = eis_before or {}, eis_after or {}
+    eis_data = [*before.values(), *after.values()]
+    keys, first = [list(before), list(after)], [0, len(before)]
+    neighbours = []
+    for stage in [0, 1]:
+        for position, key in enumerate(keys[stage]):
+            row = first[stage] + position
+            near = [
+                row + shift
+                for shift in [-1, 1]
+                if 0 <= position + shift < len(keys[stage])
+            ]
+            other = keys[1 - stage]
+            if key in other:
+                near.append(first[1 - stage] + other.index(key))
+            neighbours.append(near)
+    return eis_data, neighbours
+
+
+@instrumentation.instrument
+def fit_eis(eis_data, circuits=None, neighbours=None):
+    """
+    Fits every circuit (all of CIRCUITS by default) to every Eis in the
+    list in one batch per circuit, and stores the results in each Eis' fits
+    as circuit name -> {parameter: value} including the chi-squared.
+    neighbours (see spectra_neighbours) says which fits may warm-start each
+    other, by default the Eis next to each other in the list.
+    """
+    kept = [row for row, eis in enumerate(eis_data) if eis is not None]
+    if not kept:
+        return
+    if neighbours is not None:
+        rows = {row: idx for idx, row in enumerate(kept)}
+        neighbours = [
+            [rows[near] for near in neighbours[row] if near in rows] for row in kept
+        ]
+    eis_data = [eis_data[row] for row in kept]
+    for circuit in circuits or CIRCUITS:
+        fit = fit_spectra(
+            circuit,
+            [eis.omega for eis in eis_data],
+            [eis.z for eis in eis_data],
+            neighbours=neighbours,
+        )
+        for row, eis in enumerate(eis_data):
+            eis.fits[circuit.name] = {
+                **dict(zip(circuit.params, fit.values[row])),
+                "chi-squared": fit.chi_squared[row],
+                "iterations": int(fit.iterations[row]),
+                "converged": bool(fit.converged[row]),
+            }
+
+
+def fits_table(eis_before, eis_after):
+    """
+    One row per spectrum and circuit with the fitted parameters, for the
+    spectra that have been fitted.
+    """
+    rows = []
+    for stage, eis_data in [("before", eis_before), ("after", eis_after)]:
+        for key, eis in (eis_data or {}).items():
+            for circuit in CIRCUITS:
+                fit = eis.fits.get(circuit.name)
+                if fit:
+                    rows.append(
+                        {
+                            "Aging": stage,
+                            "EIS": key,
+                            "Circuit": circuit.name,
+                            **fit,
+                        }
+                    )
+    return pd.DataFrame(rows)
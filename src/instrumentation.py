@@ -0,0 +1,205 @@
+"""
+Optional timing and memory records for every stage of a run. Profiling is
+switched on with environment variables read at import, before any other
+module of the application is loaded:
+
+    SUPERCAP_PROFILE=1              log to ~/.supercap_aging/performance.jsonl
+    SUPERCAP_PROFILE=path.jsonl     log to path.jsonl
+    SUPERCAP_PROFILE_TRACEMALLOC=1  also trace Python/NumPy allocations
+
+When it is off, instrument returns what it is given unchanged, so the
+instrumented code runs exactly as if it were not decorated.
+
+Each record holds the stage name, its start time and nesting depth, wall
+and CPU (thread) time, the process's resident and peak resident memory after
+the stage, the tracemalloc peak during the stage when tracing, and the
+number of data rows of the object the stage ran on. Records made in pipeline
+worker processes are sent back with the results and logged by the main
+process, one JSON object per line. records only holds those of the current
+run: the application calls reset as every run starts.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+import multiprocessing
+
+from types import FunctionType
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE = os.environ.get("SUPERCAP_PROFILE", "")
+ENABLED = PROFILE not in ("", "0")
+TRACEMALLOC = ENABLED and os.environ.get("SUPERCAP_PROFILE_TRACEMALLOC") == "1"
+LOG_FILE = (
+    os.path.join(os.path.expanduser("~"), ".supercap_aging", "performance.jsonl")
+    if PROFILE == "1"
+    else PROFILE
+)
+RUN_ID = datetime.now().isoformat(timespec="seconds")
+
+records = []
+# stages currently running in each thread, innermost last
+_local = threading.local()
+
+if TRACEMALLOC:
+    tracemalloc.start()
+
+
+def memory_usage():
+    """
+    Resident and peak resident memory of this process in MB (peak is None
+    where it cannot be read).
+    """
+    rss = peak = None
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        rss = info.rss / 1024**2
+        # only reported on Windows
+        peak = getattr(info, "peak_wset", None)
+        peak = None if peak is None else peak / 1024**2
+    if peak is None and resource is not None:
+        # kB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, peak
+
+
+def data_rows(obj):
+    df = getattr(obj, "df", None)
+    return None if df is None else len(df)
+
+
+def add(record):
+    records.append(record)
+    # worker processes hand their records back with their results instead
+    if LOG_FILE and multiprocessing.parent_process() is None:
+        os.makedirs(os.path.dirname(os.path.abspath(LOG_FILE)), exist_ok=True)
+        with open(LOG_FILE, "a") as handle:
+            handle.write(json.dumps(record) + "\n")
+
+
+def timed(name, func, rows=None):
+    """
+    Wraps func so every call adds a record named name. rows(args) gives the
+    row count of a call.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not hasattr(_local, "running"):
+            _local.running = []
+        _running = _local.running
+        if TRACEMALLOC:
+            # keep the enclosing stage's peak before restarting the count
+            if _running:
+                _running[-1]["peak"] = max(
+                    _running[-1]["peak"], tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+        frame = {
+            "peak": 0,
+            "start": tracemalloc.get_traced_memory()[0] if TRACEMALLOC else 0,
+        }
+        _running.append(frame)
+        started = time.time()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            _running.pop()
+            traced = None
+            if TRACEMALLOC:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                traced = (peak - frame["start"]) / 1024**2
+                if _running:
+                    _running[-1]["peak"] = max(_running[-1]["peak"], peak)
+            rss, peak_rss = memory_usage()
+            add(
+                {
+                    "run": RUN_ID,
+                    "pid": os.getpid(),
+                    "stage": name,
+                    "depth": len(_running),
+                    "started": started,
+                    "wall_s": wall,
+                    "cpu_s": cpu,
+                    "rss_MB": rss,
+                    "peak_rss_MB": peak_rss,
+                    "traced_peak_MB": traced,
+                    "rows": rows(args) if rows else None,
+                }
+            )
+        return result
+
+    return wrapper
+
+
+def instrument(target):
+    """
+    Class or function decorator. For a class, every method it defines
+    (except dunder methods) is timed as Class.method, with the row count of
+    self.df; a function is timed under its own name.
+    """
+    if not ENABLED:
+        return target
+    if isinstance(target, type):
+        for name, member in list(vars(target).items()):
+            if isinstance(member, FunctionType) and not name.startswith("__"):
+                setattr(
+                    target,
+                    name,
+                    timed(
+                        f"{target.__name__}.{name}",
+                        member,
+                        rows=lambda args: data_rows(args[0]) if args else None,
+                    ),
+                )
+        return target
+    return timed(target.__name__, target)
+
+
+def reset():
+    """
+    Forgets the records of earlier runs; the log file keeps them.
+    """
+    del records[:]
+
+
+def collect(func, *args):
+    """
+    Calls func(*args) in a worker process and returns its result along with
+    the records it made, for unpack to log in the main process.
+    """
+    if not ENABLED:
+        return func(*args)
+    # depths are relative to the stage that submitted the work (see unpack)
+    _local.running = []
+    start = len(records)
+    result = func(*args)
+    made = records[start:]
+    del records[start:]
+    return result, made
+
+
+def unpack(collected):
+    if not ENABLED:
+        return collected
+    result, made = collected
+    depth = len(getattr(_local, "running", []))
+    for record in made:
+        add({**record, "depth": record["depth"] + depth})
+    return result
@@ -0,0 +1,324 @@
+"""
+Linear Kramers-Kronig validation of impedance spectra (Lin-KK, Schönleber
+et al., Electrochim. Acta 131 (2014) 20). A series resistance, M RC elements
+with time constants spread log-evenly over the measured frequencies, and a
+series capacitance and inductance are fitted by linear least squares,
+weighted by 1/|Z|. The circuit satisfies the Kramers-Kronig relations, so a
+spectrum it cannot follow to within THRESHOLD of |Z| is not from a linear,
+causal, stable system. M is increased until mu, which falls as the fit
+starts to lean on negative resistances, drops below MU_CRITERION; M or the
+criterion can also be given.
+
+The design matrix only depends on the frequencies, so spectra measured on
+the same frequency grid share its factorization: every spectrum keeps its
+own weights, and all of them are solved together from one SVD per M. The
+result of a spectrum does not depend on the other spectra of the batch.
+
+Spectra can be validated from the command line as one batch:
+
+    python kramers_kronig.py spectra/*.txt --output kk.csv
+"""
+
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# largest residual, as a fraction of |Z|, of a valid spectrum
+THRESHOLD = 0.01
+# fits with mu below this lean on negative resistances, i.e. overfit
+MU_CRITERION = 0.85
+MIN_ELEMENTS = 3
+# points a spectrum needs, after dropping missing ones, to be validated
+MIN_POINTS = MIN_ELEMENTS + 3
+
+
+class KKResult:
+    """
+    The Lin-KK fit of one spectrum: the RC elements used, mu, the fitted
+    impedance, the real and imaginary residuals as fractions of |Z| and
+    whether they all stay within the threshold. omega only holds the points
+    that were fitted.
+    """
+
+    def __init__(self, omega, z, elements, mu, fit, threshold) -> None:
+        self.omega = omega
+        self.elements = elements
+        self.mu = mu
+        self.fit = fit
+        self.residual_real = (z.real - fit.real) / np.abs(z)
+        self.residual_imag = (z.imag - fit.imag) / np.abs(z)
+        self.max_residual = max(
+            np.abs(self.residual_real).max(), np.abs(self.residual_imag).max()
+        )
+        self.passed = bool(self.max_residual <= threshold)
+
+
+def design_matrix(omega, elements):
+    """
+    Real and imaginary parts, stacked, of the impedance of each element for
+    unit values: R0, the RC elements, 1/C and L.
+    """
+    tau = np.logspace(np.log10(1 / omega.max()), np.log10(1 / omega.min()), elements)
+    rc = 1 / (1 + 1j * omega[:, None] * tau)
+    columns = np.column_stack([np.ones_like(omega), rc, 1 / (1j * omega), 1j * omega])
+    return np.concatenate([columns.real, columns.imag])
+
+
+class Factorization:
+    """
+    SVD of a design matrix, solving weighted least squares problems for any
+    number of right-hand sides at once, each with its own weights. In the
+    orthonormal basis U of the SVD the normal equations of a weighted
+    problem are only as ill-conditioned as its weights, so all that is left
+    per right-hand side is a small, well-conditioned system. The columns are
+    scaled to unit length first, as the inductance column grows with
+    frequency and would otherwise swamp the others.
+    """
+
+    def __init__(self, matrix) -> None:
+        self.scale = np.linalg.norm(matrix, axis=0)
+        u, s, vt = np.linalg.svd(matrix / self.scale, full_matrices=False)
+        # drop the directions the nearly collinear columns leave undetermined
+        keep = s > s[0] * len(matrix) * np.finfo(float).eps
+        self.u = u[:, keep]
+        self.back = vt[keep].T / s[keep]
+
+    def solve(self, rhs, weights):
+        """
+        Solutions (rows) for the rows of rhs, weighted by the same rows of
+        weights.
+        """
+        weighted = weights[:, :, None] * self.u
+        transposed = np.swapaxes(weighted, 1, 2)
+        gram = transposed @ weighted
+        projected = (transposed @ (weights * rhs)[:, :, None])[:, :, 0]
+        coefficients = cholesky_solve(gram, projected)
+        return coefficients @ self.back.T / self.scale
+
+
+def cholesky_solve(gram, rhs):
+    """
+    Solutions of a stack of symmetric positive definite systems, by
+    substitution through their Cholesky factors for all of them at once.
+    """
+    lower = np.linalg.cholesky(gram)
+    size = rhs.shape[1]
+    forward = np.zeros_like(rhs)
+    for row in range(size):
+        done = np.einsum("nj,nj->n", lower[:, row, :row], forward[:, :row])
+        forward[:, row] = (rhs[:, row] - done) / lower[:, row, row]
+    solution = np.zeros_like(rhs)
+    for row in reversed(range(size)):
+        done = np.einsum("nj,nj->n", lower[:, row + 1 :, row], solution[:, row + 1 :])
+        solution[:, row] = (forward[:, row] - done) / lower[:, row, row]
+    return solution
+
+
+def validate_grid(
+    omega,
+    impedances,
+    threshold=THRESHOLD,
+    mu_criterion=MU_CRITERION,
+    elements=None,
+    max_elements=None,
+):
+    """
+    Lin-KK results of spectra (rows of impedances) all measured at omega,
+    with the given number of RC elements or else the first number at which
+    mu drops below mu_criterion.
+    """
+    if max_elements is None:
+        max_elements = max(MIN_ELEMENTS, len(omega) // 2)
+    counts = [elements] if elements else range(MIN_ELEMENTS, max_elements + 1)
+    z = np.asarray(impedances, dtype=np.complex128)
+    weights = np.tile(1 / np.abs(z), 2)
+    rhs = np.concatenate([z.real, z.imag], axis=1)
+
+    n = len(z)
+    chosen = np.zeros(n, dtype=int)
+    mu = np.full(n, np.nan)
+    fits = np.zeros(z.shape, dtype=np.complex128)
+    active = np.arange(n)
+    for count in counts:
+        matrix = design_matrix(omega, count)
+        solution = Factorization(matrix).solve(rhs[active], weights[active])
+        resistances = solution[:, 1 : count + 1]
+        positive = np.where(resistances >= 0, resistances, 0).sum(axis=1)
+        negative = np.where(resistances < 0, -resistances, 0).sum(axis=1)
+        mus = 1 - negative / np.maximum(positive, 1e-300)
+        stacked = solution @ matrix.T
+        chosen[active] = count
+        mu[active] = mus
+        fits[active] = stacked[:, : len(omega)] + 1j * stacked[:, len(omega) :]
+        # spectra keep the fit at which mu first drops below the criterion
+        active = active[mus >= mu_criterion]
+        if not len(active):
+            break
+
+    return [
+        KKResult(omega, z[row], chosen[row], mu[row], fits[row], threshold)
+        for row in range(n)
+    ]
+
+
+@instrumentation.instrument
+def validate_spectra(
+    omegas, impedances, threshold=THRESHOLD, mu_criterion=MU_CRITERION, elements=None
+):
+    """
+    Lin-KK results of every spectrum, in order. Points with a missing
+    frequency or impedance are left out, and a spectrum with fewer than
+    MIN_POINTS left gets None. Spectra measured on the same frequencies are
+    validated together.
+    """
+    spectra, grids = {}, {}
+    for idx, (omega, z) in enumerate(zip(omegas, impedances)):
+        omega = np.asarray(omega, dtype=float)
+        z = np.asarray(z, dtype=np.complex128)
+        usable = np.isfinite(omega) & (omega > 0) & np.isfinite(z) & (z != 0)
+        if usable.sum() < MIN_POINTS:
+            continue
+        spectra[idx] = omega[usable], z[usable]
+        grids.setdefault(omega[usable].tobytes(), []).append(idx)
+    results = [None] * len(omegas)
+    for indices in grids.values():
+        omega = spectra[indices[0]][0]
+        try:
+            grid_results = validate_grid(
+                omega,
+                [spectra[idx][1] for idx in indices],
+                threshold,
+                mu_criterion,
+                elements,
+            )
+        except np.linalg.LinAlgError:
+            # the spectra of this grid stay unvalidated
+            continue
+        for idx, result in zip(indices, grid_results):
+            results[idx] = result
+    return results
+
+
+def validate_eis(
+    eis_data, threshold=THRESHOLD, mu_criterion=MU_CRITERION, elements=None
+):
+    """
+    Validates every Eis in the list and stores its result, or None if it
+    could not be validated, as its kk.
+    """
+    eis_data = [eis for eis in eis_data if eis is not None]
+    if not eis_data:
+        return
+    results = validate_spectra(
+        [eis.omega for eis in eis_data],
+        [eis.z for eis in eis_data],
+        threshold,
+        mu_criterion,
+        elements,
+    )
+    for eis, result in zip(eis_data, results):
+        eis.kk = result
+
+
+def kk_table(eis_before, eis_after):
+    """
+    One row per validated spectrum with its Lin-KK fit and verdict.
+    """
+    rows = []
+    for stage, eis_data in [("before", eis_before), ("after", eis_after)]:
+        for key, eis in (eis_data or {}).items():
+            if eis.kk is not None:
+                rows.append(
+                    {
+                        "Aging": stage,
+                        "EIS": key,
+                        "RC elements": eis.kk.elements,
+                        "mu": eis.kk.mu,
+                        "Max residual (%)": eis.kk.max_residual * 100,
+                        "Valid": eis.kk.passed,
+                    }
+                )
+    return pd.DataFrame(rows)
+
+
+def residuals_table(eis_before, eis_after):
+    """
+    The residuals of every validated spectrum against frequency, side by
+    side.
+    """
+    columns = {}
+    for stage, eis_data in [("before", eis_before), ("after", eis_after)]:
+        for key, eis in (eis_data or {}).items():
+            if eis.kk is not None:
+                name = f"{key} {stage} aging"
+                columns[f"Freq {name} (Hz)"] = pd.Series(eis.kk.omega / (2 * np.pi))
+                columns[f"Re residual {name} (%)"] = pd.Series(
+                    eis.kk.residual_real * 100
+                )
+                columns[f"Im residual {name} (%)"] = pd.Series(
+                    eis.kk.residual_imag * 100
+                )
+    return pd.DataFrame(columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Lin-KK validation of EC-Lab impedance spectra."
+    )
+    parser.add_argument("files", nargs="+", help="EIS .txt files")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD * 100,
+        help=f"largest valid residual in %% of |Z| (default: {THRESHOLD * 100:g})",
+    )
+    parser.add_argument(
+        "--mu",
+        type=float,
+        default=MU_CRITERION,
+        help=f"mu at which RC elements stop being added (default: {MU_CRITERION:g})",
+    )
+    parser.add_argument(
+        "--elements", type=int, help="fixed number of RC elements (default: by mu)"
+    )
+    parser.add_argument("-o", "--output", help="CSV file the results are written to")
+    args = parser.parse_args(argv)
+
+    from eis import Eis
+
+    spectra = []
+    for file_name in args.files:
+        eis = Eis(area=1)
+        eis.read_data(file_name)
+        spectra.append(eis)
+    validate_eis(spectra, args.threshold / 100, args.mu, args.elements)
+
+    rows = []
+    for file_name, eis in zip(args.files, spectra):
+        if eis.kk is None:
+            # too few usable points to validate
+            rows.append({"File": file_name, "Valid": False})
+        else:
+            rows.append(
+                {
+                    "File": file_name,
+                    "RC elements": eis.kk.elements,
+                    "mu": eis.kk.mu,
+                    "Max residual (%)": eis.kk.max_residual * 100,
+                    "Valid": eis.kk.passed,
+                }
+            )
+    table = pd.DataFrame(
+        rows, columns=["File", "RC elements", "mu", "Max residual (%)", "Valid"]
+    )
+    if args.output:
+        table.to_csv(args.output, index=False)
+    print(table.to_string(index=False))
+    return 0 if table["Valid"].all() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+import numpy as np
+
+SegmentFit = namedtuple("SegmentFit", "slope intercept r_squared std_error")
+
+
+def fit_segments(x, y, offsets):
+    """
+    Fits a straight line y = slope * x + intercept to every segment
+    x[offsets[i] : offsets[i + 1]] at once, giving the same fit as
+    np.polyfit(deg=1) per segment. Everything comes from per-segment sums of
+    centered values, so large offsets in x (e.g. test time in seconds) do not
+    cost precision. Also returns R^2 and the residual standard error of every
+    fit; empty or single-point segments (and R^2 of flat ones) give nan.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    n_segments = len(counts)
+    segment_ids = np.repeat(np.arange(n_segments), counts)
+
+    def segment_sum(values):
+        return np.bincount(segment_ids, weights=values, minlength=n_segments)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = segment_sum(x) / counts
+        y_mean = segment_sum(y) / counts
+        dx = x - x_mean[segment_ids]
+        dy = y - y_mean[segment_ids]
+        sxx = segment_sum(dx * dx)
+        sxy = segment_sum(dx * dy)
+        syy = segment_sum(dy * dy)
+
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        residual = np.maximum(syy - slope * sxy, 0)
+        r_squared = 1 - residual / syy
+        std_error = np.sqrt(residual / (counts - 2))
+    std_error[counts <= 2] = np.nan
+    return SegmentFit(slope, intercept, r_squared, std_error)
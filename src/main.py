@@ -1,11 +1,12 @@
-import sys, os, traceback, textwrap, inspect
+import sys, os, textwrap, threading, traceback, multiprocessing
 
-from data_processing_funcs import process_data
-from data_window_ui import DataWindow
-from spinner_widget import QtWaitingSpinner
+import instrumentation
+
+from progress import Cancelled
 
 from PyQt5.QtCore import (
     Qt,
+    QTimer,
     QThreadPool,
     QRunnable,
     QObject,
@@ -23,10 +24,12 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QGridLayout,
     QFormLayout,
-    QStackedLayout,
     QWidget,
     QFrame,
     QLineEdit,
+    QCheckBox,
+    QDoubleSpinBox,
+    QProgressDialog,
 )
 
 if hasattr(Qt, "AA_EnableHighDpiScaling"):
@@ -63,6 +66,20 @@ class WorkerSignals(QObject):
     finished = pyqtSignal()
     error = pyqtSignal(str, str)
     result = pyqtSignal(object, object, object, object, object)
+    progress = pyqtSignal(float, str)
+    cancelled = pyqtSignal()
+
+
+class Preloader(QRunnable):
+    """
+    Imports the processing and plotting modules (pandas, scipy, matplotlib)
+    in the background while the user picks files, so they are not loaded
+    before the import window appears.
+    """
+
+    def run(self):
+        import data_processing_funcs
+        import data_window_ui
 
 
 class Worker(QRunnable):
@@ -70,8 +87,20 @@ class Worker(QRunnable):
         super(Worker, self).__init__()
         self.signals = WorkerSignals()
         self.w = dialog
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Asks the run to stop at its next chunk or cycle boundary.
+        """
+        self.cancel_event.set()
 
     def run(self):
+        # already imported by the Preloader unless the user was very quick
+        from data_processing_funcs import process_data, FileKeyError
+
+        # the performance page shows this run only
+        instrumentation.reset()
         try:
             aging_data, cvs_before, cvs_after, eis_before, eis_after = process_data(
                 mass_entry=self.w.mass_entry.text(),
@@ -87,6 +116,18 @@ class Worker(QRunnable):
                 eis_ocv_after_display=self.w.eis_ocv_after_display.text(),
                 eis_p_5V_after_display=self.w.eis_p_5V_after_display.text(),
                 eis_one_V_after_display=self.w.eis_one_V_after_display.text(),
+                extra_cvs_before=[
+                    (display.text(), rate.value())
+                    for rate, display in self.w.extra_cvs_before
+                ],
+                extra_cvs_after=[
+                    (display.text(), rate.value())
+                    for rate, display in self.w.extra_cvs_after
+                ],
+                incremental_aging=self.w.incremental_aging.isChecked(),
+                cv_all_cycles=self.w.cv_all_cycles.isChecked(),
+                on_progress=self.signals.progress.emit,
+                cancel=self.cancel_event,
             )
             if (
                 not aging_data
@@ -111,25 +152,18 @@ class Worker(QRunnable):
             """
             self.signals.error.emit(err_msg, "File parsing error")
 
-        except KeyError as exc:
-            filename, lineno, funcname, text = traceback.extract_tb(exc.__traceback__)[
-                2
-            ]
-
-            frames = inspect.trace()
-            argvalues = inspect.getargvalues(frames[2][0])
-
-            if "eis" in funcname:
+        except FileKeyError as exc:
+            if "eis" in exc.pipeline:
                 err = "EIS"
-            elif "cv" in funcname:
+            elif "cv" in exc.pipeline:
                 err = "cyclic voltammogram"
-            elif "aging" in funcname:
+            elif "aging" in exc.pipeline:
                 err = "aging"
 
             err_msg = f"""
             An error occurred when processing the {err} data using one of the following files:
 
-            "{next(iter(argvalues[3].values()))}"
+            "{exc.files}"
 
             The file was missing the following expected column: "{exc}"
 
@@ -138,9 +172,29 @@ class Worker(QRunnable):
 
             self.signals.error.emit(err_msg, "File Parsing Error")
 
+        except OSError as exc:
+            err_msg = f"""
+            A file could not be read or written:
+
+            "{exc}"
+
+            Please check that the files still exist and that you have access to them.
+            """
+            self.signals.error.emit(err_msg, "File Access Error")
+
         except EmptyFileIO:
             self.signals.error.emit("No files loaded", "Empty File Input")
 
+        except Cancelled:
+            self.signals.cancelled.emit()
+
+        except Exception:
+            # anything else still has to close the progress dialog
+            err_msg = "An unexpected error stopped the processing:\n\n"
+            self.signals.error.emit(
+                err_msg + traceback.format_exc(), "Processing Error"
+            )
+
         else:
             self.signals.result.emit(
                 aging_data, cvs_before, cvs_after, eis_before, eis_after
@@ -189,10 +243,13 @@ class FileWindow(QMainWindow):
             lambda: self.get_csv_files(self.aging_data_display)
         )
 
+        self.incremental_aging = QCheckBox("Only process data added since last run")
+
         aging_layout.addWidget(aging_data_label, 0, 0, 1, 1)
         aging_layout.addWidget(self.aging_data_display, 0, 1, 1, 1)
         aging_layout.addWidget(aging_files_input, 0, 2, 1, 1)
-        aging_data.setFixedHeight(50)
+        aging_layout.addWidget(self.incremental_aging, 1, 1, 1, 2)
+        aging_data.setFixedHeight(75)
         self.page_layout.addWidget(aging_data)
 
         div2 = QFrame()
@@ -201,7 +258,8 @@ class FileWindow(QMainWindow):
         self.page_layout.addWidget(div2)
 
         cvs = QWidget()
-        cvs.setFixedHeight(100)
+        # grows as CVs at more scan rates are added
+        cvs.setMinimumHeight(100)
         cvs_layout = QHBoxLayout()
         cvs.setLayout(cvs_layout)
 
@@ -225,7 +283,14 @@ class FileWindow(QMainWindow):
             lambda: self.get_txt_files(self.cvs_p_5_before_display)
         )
 
+        self.extra_cvs_before = []
+        cvs_add_before = QPushButton("Add scan rate")
+        cvs_add_before.clicked.connect(
+            lambda: self.add_cv_rate(cvs_before, self.extra_cvs_before)
+        )
+
         cvs_before.addWidget(cvs_label_before, 0, 0, 1, 1)
+        cvs_before.addWidget(cvs_add_before, 0, 1, 1, 2, Qt.AlignRight)
         cvs_before.addWidget(cvs_five_before, 1, 0, 1, 1)
         cvs_before.addWidget(self.cvs_five_before_display, 1, 1, 1, 1)
         cvs_before.addWidget(cvs_five_before_input, 1, 2, 1, 1)
@@ -253,7 +318,14 @@ class FileWindow(QMainWindow):
             lambda: self.get_txt_files(self.cvs_p_5_after_display)
         )
 
+        self.extra_cvs_after = []
+        cvs_add_after = QPushButton("Add scan rate")
+        cvs_add_after.clicked.connect(
+            lambda: self.add_cv_rate(cvs_after, self.extra_cvs_after)
+        )
+
         cvs_after.addWidget(cvs_label_after, 0, 0, 1, 1)
+        cvs_after.addWidget(cvs_add_after, 0, 1, 1, 2, Qt.AlignRight)
         cvs_after.addWidget(cvs_five_after, 1, 0, 1, 1)
         cvs_after.addWidget(self.cvs_five_after_display, 1, 1, 1, 1)
         cvs_after.addWidget(cvs_five_after_input, 1, 2, 1, 1)
@@ -265,6 +337,11 @@ class FileWindow(QMainWindow):
         cvs_layout.addLayout(cvs_after)
         self.page_layout.addWidget(cvs)
 
+        self.cv_all_cycles = QCheckBox(
+            "Calculate the capacitance of every CV cycle (reads the whole file)"
+        )
+        self.page_layout.addWidget(self.cv_all_cycles)
+
         div3 = QFrame()
         div3.setFrameShape(QFrame.HLine)
         div3.setLineWidth(3)
@@ -360,26 +437,16 @@ class FileWindow(QMainWindow):
         div4.setLineWidth(3)
         self.page_layout.addWidget(div4)
 
-        process = QPushButton("Process data")
-        process.setStyleSheet("background-color: #007AFF")
-        process.clicked.connect(self.show_data_window)
-        self.page_layout.addWidget(process)
+        self.process = QPushButton("Process data")
+        self.process.setStyleSheet("background-color: #007AFF")
+        self.process.clicked.connect(self.show_data_window)
+        self.page_layout.addWidget(self.process)
 
         main_page = QWidget()
         main_page.setLayout(self.page_layout)
-
-        stack = QWidget()
-        self.stack_layout = QStackedLayout()
-        self.stack_layout.setStackingMode(QStackedLayout.StackAll)
-        stack.setLayout(self.stack_layout)
-
-        self.stack_layout.addWidget(main_page)
-
-        self.spinner = QtWaitingSpinner(self, True, True, Qt.ApplicationModal)
-        self.stack_layout.addWidget(self.spinner)
-
-        self.setCentralWidget(stack)
+        self.setCentralWidget(main_page)
         self.threadpool = QThreadPool()
+        QTimer.singleShot(0, lambda: self.threadpool.start(Preloader()))
 
     def get_csv_files(self, widget):
         filters = "Comma Separated Values (*.csv)"
@@ -395,16 +462,55 @@ class FileWindow(QMainWindow):
         )
         widget.setText(filename)
 
+    def add_cv_rate(self, layout, rows):
+        """
+        Adds a row for a CV at another scan rate to layout, and its rate and
+        file widgets to rows.
+        """
+        rate = QDoubleSpinBox()
+        rate.setDecimals(3)
+        rate.setRange(0.001, 10000)
+        rate.setValue(1)
+        rate.setSuffix(" mV/s")
+        display = QLineEdit()
+        display.setReadOnly(True)
+        file_input = QPushButton("...")
+        file_input.clicked.connect(lambda: self.get_txt_files(display))
+
+        row = layout.rowCount()
+        layout.addWidget(rate, row, 0, 1, 1)
+        layout.addWidget(display, row, 1, 1, 1)
+        layout.addWidget(file_input, row, 2, 1, 1)
+        rows.append((rate, display))
+
     def show_data_window(self):
-        self.stack_layout.setCurrentIndex(1)
-        self.spinner.start()
         worker = Worker(dialog=self)
+        self.process.setEnabled(False)
+        self.progress = QProgressDialog("Processing data...", "Cancel", 0, 1000, self)
+        self.progress.setWindowTitle("SuperCap Aging")
+        self.progress.setWindowModality(Qt.WindowModal)
+        self.progress.setMinimumDuration(0)
+        self.progress.setAutoReset(False)
+        self.progress.setValue(0)
+        self.progress.canceled.connect(worker.cancel)
+        worker.signals.progress.connect(self.update_progress)
         worker.signals.result.connect(self.set_data)
         worker.signals.finished.connect(self.finish_processing)
         worker.signals.error.connect(self.process_error)
+        worker.signals.cancelled.connect(self.end_processing)
         self.threadpool.start(worker)
 
+    def update_progress(self, fraction, detail):
+        if self.progress.wasCanceled():
+            return
+        self.progress.setValue(round(fraction * 1000))
+        if detail:
+            self.progress.setLabelText(f"{detail}...")
+
     def set_data(self, aging_data, cvs_before, cvs_after, eis_before, eis_after):
+        from data_window_ui import DataWindow
+
+        self.progress.setLabelText("Plotting data...")
         self.data_window = DataWindow(
             aging_data=aging_data,
             cvs_before=cvs_before,
@@ -414,12 +520,16 @@ class FileWindow(QMainWindow):
         )
         self.data_window.showMaximized()
 
+    def end_processing(self):
+        self.progress.close()
+        self.process.setEnabled(True)
+
     def finish_processing(self):
+        self.end_processing()
         self.close()
-        self.spinner.stop()
 
     def process_error(self, error, title):
-        self.spinner.stop()
+        self.end_processing()
         exception_handler(
             error=error,
             window_title=title,
@@ -438,4 +548,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # lets the frozen build start process_data's worker processes
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+# the cache can be moved, resized or switched off with environment variables
+CACHE_DIR = os.environ.get(
+    "SUPERCAP_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".supercap_aging", "parse_cache"),
+)
+CACHE_SIZE_LIMIT = int(os.environ.get("SUPERCAP_CACHE_SIZE", 4 * 1024**3))
+CACHE_ENABLED = os.environ.get("SUPERCAP_CACHE", "1") != "0"
+
+CACHE_VERSION = 2
+SAMPLE_SIZE = 1024**2
+SAMPLE_COUNT = 8
+
+
+def file_key(file_name, variant=""):
+    """
+    Cache key for a file: its absolute path, size and modification time plus a
+    hash of sampled content (the first and last MiB and a few evenly spaced
+    blocks in between), so a 2 GB file is keyed without reading all of it.
+    The variant separates different parses of the same file.
+    """
+    stat = os.stat(file_name)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(
+        f"{CACHE_VERSION}|{os.path.abspath(file_name)}|{stat.st_size}|"
+        f"{stat.st_mtime_ns}|{variant}".encode()
+    )
+    with open(file_name, "rb") as handle:
+        if stat.st_size <= SAMPLE_SIZE * (SAMPLE_COUNT + 2):
+            digest.update(handle.read())
+        else:
+            last = stat.st_size - SAMPLE_SIZE
+            for offset in np.linspace(0, last, SAMPLE_COUNT + 2).astype(np.int64):
+                handle.seek(offset)
+                digest.update(handle.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def load(key):
+    """
+    Loads a cached DataFrame with every numeric column memory-mapped, or
+    returns None on a cache miss.
+    """
+    entry = os.path.join(CACHE_DIR, key)
+    try:
+        with open(os.path.join(entry, "meta.json")) as handle:
+            meta = json.load(handle)
+        columns = {}
+        for idx, (name, categories, categorical) in enumerate(meta["columns"]):
+            values = np.load(os.path.join(entry, f"{idx}.npy"), mmap_mode="r")
+            if categories is not None:
+                values = pd.Categorical.from_codes(values, categories)
+                if not categorical:
+                    values = np.asarray(values)
+            columns[name] = values
+    except (OSError, ValueError, KeyError):
+        return None
+    # marks the entry as recently used for the LRU eviction
+    os.utime(os.path.join(entry, "meta.json"))
+    return pd.DataFrame(columns, columns=list(columns), copy=False)
+
+
+def store(key, df):
+    """
+    Writes one .npy file per column. Text and categorical columns are stored as
+    integer codes plus their categories. Frames that cannot be stored this way
+    (non-default index, dates, mixed objects) are skipped.
+    """
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0:
+        return
+    if df.columns.has_duplicates or not all(isinstance(c, str) for c in df):
+        return
+    meta, arrays = [], []
+    for name in df:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes, categories = column.cat.codes.to_numpy(), column.cat.categories
+            categorical = True
+        elif column.dtype == object:
+            codes, categories = pd.factorize(column)
+            categorical = False
+        elif column.dtype.kind in "biuf":
+            meta.append((name, None, False))
+            arrays.append(column.to_numpy())
+            continue
+        else:
+            return
+        if not all(isinstance(cat, str) for cat in categories):
+            return
+        meta.append((name, list(categories), categorical))
+        arrays.append(codes)
+
+    entry = os.path.join(CACHE_DIR, key)
+    tmp = entry + f".tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for idx, values in enumerate(arrays):
+        np.save(os.path.join(tmp, f"{idx}.npy"), values)
+    with open(os.path.join(tmp, "meta.json"), "w") as handle:
+        json.dump({"columns": meta}, handle)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # another process stored the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict()
+
+
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+def evict(size_limit=None):
+    """
+    Removes the least recently used entries until the cache fits in size_limit
+    bytes (CACHE_SIZE_LIMIT by default).
+    """
+    if size_limit is None:
+        size_limit = CACHE_SIZE_LIMIT
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        entry = os.path.join(CACHE_DIR, name)
+        meta = os.path.join(entry, "meta.json")
+        if os.path.exists(meta):
+            entries.append((os.path.getmtime(meta), entry_size(entry), entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= size_limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def clear():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def cached_read(file_name, reader, variant=""):
+    """
+    Returns reader(file_name), parsing the file only if no cached copy of the
+    same file contents (and the same variant of parse) exists. Any problem
+    with the cache falls back to parsing the file.
+    """
+    if not CACHE_ENABLED:
+        return reader(file_name)
+    try:
+        key = file_key(file_name, variant)
+        df = load(key)
+    except OSError:
+        return reader(file_name)
+    if df is not None:
+        return df
+    df = reader(file_name)
+    try:
+        store(key, df)
+    except OSError:
+        pass
+    return df
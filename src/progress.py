@@ -0,0 +1,119 @@
+"""
+Progress reports and cancellation for long runs, without any Qt dependency
+so the calculations can report from worker processes too.
+
+The calculations call report(fraction) at stage, chunk and cycle boundaries;
+span(start, end) maps the fractions reported inside it onto a part of the
+enclosing range, so every level only describes its own work. report is also
+where a run is stopped: once cancellation has been requested it raises
+Cancelled. Nothing is reported or checked until install is called.
+"""
+
+import queue
+
+from contextlib import contextmanager
+
+
+class Cancelled(Exception):
+    pass
+
+
+_handler = None
+_cancel = None
+_pipeline = None
+_spans = [(0.0, 1.0)]
+
+
+def install(handler=None, cancel=None):
+    """
+    handler(pipeline, fraction, detail) receives every report; cancel is an
+    object whose is_set() says whether to stop (a threading or
+    multiprocessing Event).
+    """
+    global _handler, _cancel
+    _handler, _cancel = handler, cancel
+
+
+def uninstall():
+    install(None, None)
+
+
+def installed():
+    """
+    Whether anything listens for reports or can cancel the run.
+    """
+    return _handler is not None or _cancel is not None
+
+
+def start(pipeline):
+    """
+    Starts reporting the work of one pipeline of process_data.
+    """
+    global _pipeline
+    _pipeline = pipeline
+    _spans[1:] = []
+
+
+def check():
+    if _cancel is not None and _cancel.is_set():
+        raise Cancelled
+
+
+def report(fraction, detail=""):
+    check()
+    if _handler is not None:
+        low, high = _spans[-1]
+        _handler(_pipeline, low + (high - low) * min(max(fraction, 0), 1), detail)
+
+
+@contextmanager
+def span(start, end, detail=""):
+    low, high = _spans[-1]
+    report(start, detail)
+    _spans.append((low + (high - low) * start, low + (high - low) * end))
+    try:
+        yield
+    finally:
+        _spans.pop()
+    report(end, detail)
+
+
+def init_worker(reports, cancel):
+    """
+    ProcessPoolExecutor initializer: sends the worker's reports to the
+    reports queue (if any) and stops when cancel is set.
+    """
+    install(None if reports is None else lambda *report: reports.put(report), cancel)
+
+
+class Tracker:
+    """
+    Combines the fractions of several pipelines into one, weighting each
+    pipeline by the size of its files, and passes it on as
+    callback(fraction, detail).
+    """
+
+    def __init__(self, weights, callback) -> None:
+        total = sum(weights) or 1
+        self.weights = [weight / total for weight in weights]
+        self.done = [0.0] * len(weights)
+        self.callback = callback
+
+    def __call__(self, pipeline, fraction, detail=""):
+        self.done[pipeline] = fraction
+        self.callback(
+            sum(w * d for w, d in zip(self.weights, self.done)),
+            detail,
+        )
+
+    def drain(self, reports, timeout=None):
+        """
+        Passes on everything waiting in a queue of worker reports, waiting
+        at most timeout seconds for the first one.
+        """
+        try:
+            self(*reports.get(timeout=timeout))
+            while True:
+                self(*reports.get_nowait())
+        except queue.Empty:
+            pass
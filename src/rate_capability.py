@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# points of the potential grid shared by the CVs of every scan rate
+GRID_POINTS = 200
+
+BRANCHES = [("anodic", 1), ("cathodic", -1)]
+
+
+def rate_capability(cvs):
+    """
+    The rate capability of a set of CVs keyed by scan rate with every result
+    calculated, or None when there are fewer than two scan rates.
+    """
+    if not cvs or len(cvs) < 2:
+        return None
+    result = RateCapability(cvs)
+    result.calc_capacitance_vs_rate()
+    result.calc_dunn()
+    result.prep_export()
+    return result
+
+
+@instrumentation.instrument
+class RateCapability:
+    """
+    Capacitance against scan rate, and the Dunn analysis of the last cycles
+    of CVs at several scan rates: on a potential grid shared by every rate,
+    the current of each branch is split as i = k1 v + k2 v^1/2 into its
+    capacitive and diffusion-limited parts, and b is the slope of log|i|
+    against log v. Every grid point of every rate is fitted at once.
+    """
+
+    def __init__(self, cvs) -> None:
+        self.cvs = list(cvs.values())
+        self.mass = self.cvs[0].mass
+        self.rates = np.array([cv.rate for cv in self.cvs], dtype=float)
+
+    def calc_capacitance_vs_rate(self):
+        self.discharge_cap = np.array([cv.specific_discharge for cv in self.cvs])
+        self.charge_cap = np.array([cv.specific_charge for cv in self.cvs])
+        self.efficiency = self.discharge_cap / self.charge_cap * 100
+        # relative to the slowest scan, which stores the most charge
+        self.retention = self.discharge_cap / self.discharge_cap[self.rates.argmin()]
+        self.retention *= 100
+
+    def branch_currents(self, sign, grid_points=GRID_POINTS):
+        """
+        The potential grid where every CV has current of the given sign, and
+        the current of every CV interpolated onto it (rates x grid points).
+        """
+        curves = []
+        for cv in self.cvs:
+            current = cv.current.to_numpy(dtype=float)
+            potential = cv.potential.to_numpy(dtype=float)
+            branch = current * sign > 0
+            order = np.argsort(potential[branch], kind="stable")
+            curves.append((potential[branch][order], current[branch][order]))
+        if any(len(potential) < 2 for potential, _ in curves):
+            return np.zeros(0), np.zeros((len(self.cvs), 0))
+        low = max(potential[0] for potential, _ in curves)
+        high = min(potential[-1] for potential, _ in curves)
+        grid = np.linspace(low, high, grid_points if high > low else 0)
+        return grid, np.vstack([np.interp(grid, *curve) for curve in curves])
+
+    def calc_dunn(self, grid_points=GRID_POINTS):
+        sqrt_v = np.sqrt(self.rates)
+        log_v = np.log10(self.rates)
+        centred = log_v - log_v.mean()
+        # i / v^1/2 = k1 v^1/2 + k2 for all grid points in one solve
+        design = np.column_stack([sqrt_v, np.ones_like(sqrt_v)])
+
+        self.dunn = {}
+        for name, sign in BRANCHES:
+            grid, currents = self.branch_currents(sign, grid_points)
+            (k1, k2), *_ = np.linalg.lstsq(
+                design, currents / sqrt_v[:, None], rcond=None
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                log_i = np.log10(np.abs(currents))
+                b = (centred[:, None] * (log_i - log_i.mean(axis=0))).sum(axis=0) / (
+                    centred**2
+                ).sum()
+                capacitive = np.trapz(
+                    np.abs(k1) * self.rates[:, None], grid, axis=1
+                ) / np.trapz(np.abs(currents), grid, axis=1)
+            self.dunn[name] = {
+                "potential": grid,
+                "b": b,
+                "k1": k1,
+                "k2": k2,
+                "capacitive": np.minimum(capacitive, 1) * 100,
+            }
+
+    def prep_export(self):
+        self.rates_df = pd.DataFrame(
+            {
+                "Scan Rate (mV/s)": self.rates,
+                "Discharge Capacitance (F/g)": np.round(self.discharge_cap, 5),
+                "Charge Capacitance (F/g)": np.round(self.charge_cap, 5),
+                "Coulombic Efficiency (%)": np.round(self.efficiency, 5),
+                "Capacitance Retention (%)": np.round(self.retention, 5),
+                **{
+                    f"Capacitive Contribution {name} (%)": np.round(
+                        self.dunn[name]["capacitive"], 5
+                    )
+                    for name, _ in BRANCHES
+                },
+            }
+        )
+        columns = {}
+        for name, _ in BRANCHES:
+            dunn = self.dunn[name]
+            columns[f"Potential {name} (V)"] = pd.Series(dunn["potential"])
+            columns[f"b-value {name}"] = pd.Series(dunn["b"])
+            columns[f"k1 {name} (F/g)"] = pd.Series(dunn["k1"] / self.mass)
+            columns[f"k2 {name} (mA s^0.5/(mV^0.5 g))"] = pd.Series(
+                dunn["k2"] / self.mass
+            )
+        self.dunn_df = pd.DataFrame(columns)
+
+    def plot_capacitance_vs_rate(self, axis, color, label=None):
+        order = np.argsort(self.rates)
+        axis.plot(
+            self.rates[order],
+            self.discharge_cap[order],
+            "-o",
+            color=color,
+            label=label,
+        )
+        axis.set_xscale("log")
+        axis.set_xlabel("Scan Rate (mV/s)")
+        axis.set_ylabel("Discharge Capacitance (F/g)")
+        if label:
+            axis.legend()
+
+    def plot_b_values(self, axis, color, label=None):
+        for name, marker in [("anodic", "-"), ("cathodic", "--")]:
+            dunn = self.dunn[name]
+            axis.plot(
+                dunn["potential"],
+                dunn["b"],
+                marker,
+                color=color,
+                label=f"{name} {label}" if label else None,
+            )
+        axis.set_xlabel("Potential (V)")
+        axis.set_ylabel("b-value")
+        if label:
+            axis.legend()
@@ -0,0 +1,105 @@
+"""
+Rendered plot thumbnails, kept as PNG bytes in memory for the session and on
+disk between sessions, keyed by the kind of plot, its size and a hash of the
+data it shows. Reopening the same data set shows its thumbnails without
+drawing them again.
+"""
+
+import os
+import hashlib
+import numpy as np
+
+# the disk cache can be moved or switched off with environment variables
+THUMBNAIL_DIR = os.environ.get(
+    "SUPERCAP_THUMBNAIL_DIR",
+    os.path.join(os.path.expanduser("~"), ".supercap_aging", "thumbnails"),
+)
+PERSIST = os.environ.get("SUPERCAP_THUMBNAIL_CACHE", "1") != "0"
+THUMBNAIL_LIMIT = 1000
+
+# change when the thumbnails are drawn differently, so old files are not used
+THUMBNAIL_VERSION = 1
+
+_memory = {}
+
+
+def key(kind, values, size):
+    """
+    Hash of the kind of plot, its size in pixels and the values it plots
+    (arrays, Series, lists or scalars).
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{THUMBNAIL_VERSION}|{kind}|{size}".encode())
+    for value in values:
+        array = np.asarray(value)
+        digest.update(f"|{array.dtype.str}{array.shape}|".encode())
+        if array.dtype.kind in "biufc":
+            digest.update(np.ascontiguousarray(array).data)
+        else:
+            digest.update(repr(array.tolist()).encode())
+    return digest.hexdigest()
+
+
+def path(key):
+    return os.path.join(THUMBNAIL_DIR, key + ".png")
+
+
+def load(key):
+    """
+    PNG bytes of a stored thumbnail, or None.
+    """
+    png = _memory.get(key)
+    if png is not None or not PERSIST:
+        return png
+    try:
+        with open(path(key), "rb") as handle:
+            png = handle.read()
+        # marks the file as recently used for the eviction
+        os.utime(path(key))
+    except OSError:
+        return None
+    _memory[key] = png
+    return png
+
+
+def store(key, png):
+    _memory[key] = png
+    if not PERSIST:
+        return
+    tmp = path(key) + f".tmp{os.getpid()}"
+    try:
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        with open(tmp, "wb") as handle:
+            handle.write(png)
+        os.replace(tmp, path(key))
+        evict()
+    except OSError:
+        pass
+
+
+def evict(limit=None):
+    """
+    Removes the least recently used files until at most limit
+    (THUMBNAIL_LIMIT by default) are left.
+    """
+    if limit is None:
+        limit = THUMBNAIL_LIMIT
+    files = [
+        os.path.join(THUMBNAIL_DIR, name)
+        for name in os.listdir(THUMBNAIL_DIR)
+        if name.endswith(".png")
+    ]
+    if len(files) <= limit:
+        return
+    for name in sorted(files, key=os.path.getmtime)[: len(files) - limit]:
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def forget():
+    """
+    Empties the in-memory cache (the files on disk are kept).
+    """
+    _memory.clear()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules live flat in src, as the application runs them
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+# every test parses its own files
+os.environ["SUPERCAP_CACHE"] = "0"
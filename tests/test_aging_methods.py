@@ -0,0 +1,215 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import aging_methods
+
+from aging_methods import AgingData
+
+
+def aging_frame(cycles=14, seed=1):
+    """
+    Galvanostatic cycles with a rest after each, and a float at 1 V after
+    every 6th cycle. Voltages are noisy and timestamps are logged at whole
+    seconds, so some of them repeat.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    time = 0.0
+    for cycle in range(cycles):
+        current = 1000.0 + cycle
+        steps = [("CCC", 30, 1), ("CCD", 25, -1), ("Rest", 5, 0)]
+        if cycle % 6 == 0:
+            steps.append(("CVC", 40, 0))
+        for status, points, sign in steps:
+            for point in range(points):
+                time += rng.uniform(0.3, 0.9)
+                if status == "CVC":
+                    voltage, step_current = 1.0, 5.0 + 50.0 * np.exp(-point / 8)
+                else:
+                    voltage = 1.0 + sign * 0.02 * point + rng.normal(scale=1e-3)
+                    step_current = sign * current
+                rows.append([cycle, status, np.floor(time), voltage, step_current])
+    return pd.DataFrame(
+        rows,
+        columns=["Cycle", "StepStatus", "TestTime/Sec", "Voltage/V", "Current/uA"],
+    )
+
+
+def baseline_cap_IR_drop(df, mass, area):
+    """
+    The cycle-by-cycle loop calc_cap_IR_drop replaced.
+    """
+    selected = df[df["Cycle"] % 6 == 0].reset_index(drop=True)
+    times, counts = np.unique(selected["TestTime/Sec"], return_counts=True)
+    selected["Fixed_time"] = np.concatenate(
+        [
+            np.linspace(time, time + 1, count, endpoint=False)
+            for time, count in zip(times, counts)
+        ]
+    )
+    results = {}
+    for cycle in selected["Cycle"].unique():
+        rows = selected[selected["Cycle"] == cycle]
+        current_zero_val = rows["Current/uA"].iloc[0] / 1000000
+        charge = rows[rows["StepStatus"] == "CCC"]
+        discharge = rows[rows["StepStatus"] == "CCD"]
+        charge_m, charge_b = np.polyfit(charge["Fixed_time"], charge["Voltage/V"], 1)
+        dis_m, dis_b = np.polyfit(discharge["Fixed_time"], discharge["Voltage/V"], 1)
+        results[cycle] = {
+            "Charge_time": charge["Fixed_time"].to_numpy(),
+            "Discharge_time": discharge["Fixed_time"].to_numpy(),
+            "IR drop": area
+            * (charge["Voltage/V"].iloc[-1] - discharge["Voltage/V"].iloc[0])
+            / current_zero_val,
+            "Charge_slope/intercept": (charge_m, charge_b),
+            "Discharge_slope/intercept": (dis_m, dis_b),
+            "Charge_cap": 2 * (1 / charge_m) * current_zero_val,
+            "Discharge_cap": (2 * (-1 / dis_m) * current_zero_val) / mass,
+        }
+    return results
+
+
+def test_calc_cap_IR_drop_matches_baseline_loop():
+    df = aging_frame()
+    aging = AgingData(mass=0.002, area=1.1)
+    aging.df = df
+    aging.cycle_col, aging.status_col = "Cycle", "StepStatus"
+    aging.build_index()
+    aging.calc_cap_IR_drop()
+
+    expected = baseline_cap_IR_drop(df, aging.mass, aging.area)
+    assert list(aging.data_dict) == list(expected)
+    for cycle, values in expected.items():
+        result = aging.data_dict[cycle]
+        for key in ["Charge_time", "Discharge_time"]:
+            assert np.allclose(result[key].to_numpy(), values[key], rtol=0, atol=1e-9)
+        for key in [
+            "IR drop",
+            "Charge_slope/intercept",
+            "Discharge_slope/intercept",
+            "Charge_cap",
+            "Discharge_cap",
+        ]:
+            assert np.allclose(result[key], values[key], rtol=1e-9), (cycle, key)
+
+
+def write_aging_csv(path, df):
+    """
+    df as a Landt export, with a record column the calculations never use.
+    """
+    df.insert(0, "Record", np.arange(len(df)))
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def calculated(aging):
+    """
+    The results of the calculations, as update_data also leaves them.
+    """
+    return {
+        "cycles": list(aging.data_dict),
+        "IR drop": [data["IR drop"] for data in aging.data_dict.values()],
+        "Discharge_cap": [data["Discharge_cap"] for data in aging.data_dict.values()],
+        "total_qirr": aging.total_qirr,
+        "leakage_cycles": aging.leakage_cycles,
+        "leakage_current": aging.leakage_current,
+    }
+
+
+def results(aging):
+    aging.calc_cap_IR_drop()
+    aging.calc_Qirr()
+    aging.get_leakage_current()
+    return calculated(aging)
+
+
+def assert_same_results(result, expected):
+    for key, values in expected.items():
+        assert np.allclose(result[key], values, rtol=1e-9), key
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_streamed_read_matches_whole_read(tmp_path, compact):
+    file_name = write_aging_csv(tmp_path / "aging.csv", aging_frame())
+    whole = AgingData(mass=0.002, area=1.1, compact=compact)
+    whole.read_data(file_name)
+    expected = results(whole)
+
+    # chunks of 97 rows end in the middle of branches and floats
+    streamed = AgingData(mass=0.002, area=1.1, compact=compact)
+    streamed.read_data(file_name, chunksize=97)
+    assert_same_results(results(streamed), expected)
+
+    # the charge integrated with the carry across chunks is the integral
+    # over the whole file at every kept row
+    kept = (whole.df["Cycle"] % 6 == 0) | (whole.df["StepStatus"] == "CVC")
+    assert np.allclose(
+        streamed.df["(Q-Qo)/mA.h"], whole.df.loc[kept, "(Q-Qo)/mA.h"], rtol=1e-12
+    )
+
+
+def line_end(data, df, cycle, status, point):
+    """
+    Byte offset just past the point-th row of the given step of a cycle.
+    """
+    row = np.flatnonzero((df["Cycle"] == cycle) & (df["StepStatus"] == status))[point]
+    offset = -1
+    for _ in range(row + 2):
+        offset = data.index(b"\n", offset + 1)
+    return offset + 1
+
+
+def test_incremental_updates_match_full_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(aging_methods, "STATE_DIR", str(tmp_path / "state"))
+    folder = tmp_path / "data"
+    folder.mkdir()
+    full = write_aging_csv(folder / "full.csv", aging_frame(cycles=20))
+    whole = AgingData(mass=0.002, area=1.1)
+    whole.read_data(full)
+    expected = results(whole)
+
+    with open(full, "rb") as handle:
+        data = handle.read()
+    df = pd.read_csv(full)
+    cuts = [
+        # a processed cycle still charging, left pending for the next run
+        line_end(data, df, 6, "CCC", 10),
+        # half a row still being written, during a processed discharge
+        line_end(data, df, 12, "CCD", 5) + 7,
+        # during a float
+        line_end(data, df, 12, "CVC", 20),
+        len(data),
+    ]
+    growing = folder / "growing.csv"
+    for cut in cuts:
+        growing.write_bytes(data[:cut])
+        aging = AgingData(mass=0.002, area=1.1)
+        aging.update_data(str(growing), chunksize=50)
+
+    assert_same_results(calculated(aging), expected)
+    # the state is kept in STATE_DIR, not next to the data
+    assert sorted(os.listdir(folder)) == ["full.csv", "growing.csv"]
+    assert len(os.listdir(tmp_path / "state")) == 1
+
+
+def test_incremental_update_ignores_state_of_other_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(aging_methods, "STATE_DIR", str(tmp_path / "state"))
+    file_name = write_aging_csv(tmp_path / "aging.csv", aging_frame(seed=1))
+    AgingData(mass=0.002, area=1.1).update_data(file_name)
+
+    # a rewritten file no longer ends with the rows the state was saved at
+    write_aging_csv(tmp_path / "aging.csv", aging_frame(seed=2))
+    whole = AgingData(mass=0.002, area=1.1)
+    whole.read_data(file_name)
+    aging = AgingData(mass=0.002, area=1.1)
+    aging.update_data(file_name)
+    assert_same_results(calculated(aging), results(whole))
+
+    # and a state saved for another mass is not used either
+    whole = AgingData(mass=0.003, area=1.1)
+    whole.read_data(file_name)
+    aging = AgingData(mass=0.003, area=1.1)
+    aging.update_data(file_name)
+    assert_same_results(calculated(aging), results(whole))
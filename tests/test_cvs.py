@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cvs import CVs, last_cycle_offset, read_last_cycle
+
+
+def write_cv_txt(path, cycles, points=50, blank_lines=0):
+    """
+    An EC-Lab CV export of triangular sweeps, with blank_lines empty lines
+    at the end as some exports have.
+    """
+    potential = np.tile(
+        np.r_[np.linspace(0, 1, points), np.linspace(1, 0, points)], cycles
+    )
+    current = np.gradient(potential) * 1e3
+    df = pd.DataFrame(
+        {
+            "mode": 2,
+            "Ewe/V": potential,
+            "<I>/mA": current,
+            "cycle number": np.repeat(np.arange(1, cycles + 1), 2 * points).astype(
+                float
+            ),
+        }
+    )
+    with open(path, "w", newline="") as handle:
+        df.to_csv(handle, sep="\t", index=False, lineterminator="\n")
+        handle.write("\n" * blank_lines)
+    return str(path)
+
+
+def last_cycle_start(file_name):
+    """
+    Byte offset of the first line of the last cycle, from every line.
+    """
+    with open(file_name, "rb") as handle:
+        lines = handle.read().split(b"\n")
+    cycles = [float(line.split(b"\t")[3]) for line in lines[1:] if line.strip()]
+    first = 1 + cycles.index(cycles[-1])
+    return sum(len(line) + 1 for line in lines[:first])
+
+
+@pytest.mark.parametrize("cycles", [1, 3])
+@pytest.mark.parametrize("blank_lines", [0, 3])
+@pytest.mark.parametrize("block_size", [5, 64, 700, 1024**2])
+def test_last_cycle_offset(tmp_path, cycles, blank_lines, block_size):
+    # blocks of 5 bytes never hold a whole line
+    file_name = write_cv_txt(tmp_path / "cv.txt", cycles, blank_lines=blank_lines)
+    with open(file_name, "rb") as handle:
+        data_start = len(handle.readline())
+        offset = last_cycle_offset(handle, data_start, 3, block_size)
+    assert offset == last_cycle_start(file_name)
+
+
+@pytest.mark.parametrize("cycles", [1, 3])
+@pytest.mark.parametrize("blank_lines", [0, 3])
+def test_read_last_cycle_matches_full_parse(tmp_path, cycles, blank_lines):
+    file_name = write_cv_txt(tmp_path / "cv.txt", cycles, blank_lines=blank_lines)
+    full = pd.read_table(file_name)
+    expected = full[full["cycle number"] == full["cycle number"].iloc[-1]]
+    pd.testing.assert_frame_equal(
+        read_last_cycle(file_name), expected.reset_index(drop=True)
+    )
+
+
+def cv_frame():
+    """
+    Three triangular sweeps of a capacitor with some resistance, a
+    different capacitance every cycle and a few points at zero current.
+    """
+    rng = np.random.default_rng(2)
+    frames = []
+    for cycle, capacitance in enumerate([1.0, 0.9, 0.85], start=1):
+        potential = np.concatenate([np.linspace(0, 1, 80), np.linspace(1, 0, 80)])
+        # the current relaxes to C * rate after every reversal
+        relaxed = capacitance * (1 - np.exp(-np.linspace(0, 8, 80)))
+        current = np.concatenate([relaxed, -relaxed])
+        current += rng.normal(scale=1e-3, size=len(current))
+        current[[0, 80]] = 0
+        frames.append(
+            pd.DataFrame({"cycle number": cycle, "Ewe/V": potential, "<I>/mA": current})
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_calc_cycle_capacitance_matches_calc_capacitance():
+    df = cv_frame()
+    cv = CVs(rate=5, mass=0.002, all_cycles=True)
+    cv.df = df
+    cv.calc_cycle_capacitance()
+
+    assert list(cv.cycles) == [1, 2, 3]
+    for idx, cycle in enumerate(cv.cycles):
+        rows = df[df["cycle number"] == cycle]
+        single = CVs(rate=5, mass=0.002)
+        single.potential, single.current = rows["Ewe/V"], rows["<I>/mA"]
+        single.calc_capacitance()
+        assert np.isclose(cv.cycle_charge[idx], single.charge_capacitance)
+        assert np.isclose(cv.cycle_discharge[idx], single.discharge_capacitance)
+        assert np.isclose(
+            cv.cycle_efficiency[idx],
+            single.discharge_capacitance / single.charge_capacitance * 100,
+        )
+    assert np.allclose(
+        cv.cycle_retention, cv.cycle_discharge / cv.cycle_discharge[0] * 100
+    )
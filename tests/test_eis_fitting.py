@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from eis_fitting import CIRCUITS, spectra_neighbours
+
+
+@pytest.mark.parametrize("circuit", CIRCUITS, ids=lambda circuit: circuit.name)
+def test_model_derivatives_match_finite_differences(circuit):
+    omega = np.tile(2 * np.pi * np.logspace(-2, 5, 40), (2, 1))
+    theta = np.array(
+        [
+            circuit.fitted(values)
+            for values in {
+                "R-CPE": [[0.5, 2e-3, 0.9], [3.0, 0.1, 0.7]],
+                "Randles-Warburg": [[0.5, 2.0, 1e-3, 0.3], [2.0, 20.0, 0.05, 4.0]],
+                "Transmission line": [[0.5, 2.0, 0.01, 0.95], [1.5, 0.3, 1.0, 0.8]],
+            }[circuit.name]
+        ]
+    )
+    z, derivatives = circuit.model(omega, theta)
+    assert derivatives.shape == z.shape + (theta.shape[1],)
+
+    step = 1e-6
+    for param in range(theta.shape[1]):
+        shift = np.zeros_like(theta)
+        shift[:, param] = step
+        upper, _ = circuit.model(omega, theta + shift)
+        lower, _ = circuit.model(omega, theta - shift)
+        numeric = (upper - lower) / (2 * step)
+        error = np.abs(derivatives[..., param] - numeric) / np.abs(z)
+        assert error.max() < 1e-6, circuit.params[param]
+
+
+def test_spectra_neighbours():
+    before = {"OCV": "OCV before", "0.5 V": "0.5 V before", "1.0 V": "1.0 V before"}
+    after = {"OCV": "OCV after", "1.0 V": "1.0 V after"}
+    eis_data, neighbours = spectra_neighbours(before, after)
+    assert eis_data == [*before.values(), *after.values()]
+    named = {
+        eis: sorted(eis_data[near] for near in near_rows)
+        for eis, near_rows in zip(eis_data, neighbours)
+    }
+    assert named == {
+        "OCV before": ["0.5 V before", "OCV after"],
+        "0.5 V before": ["1.0 V before", "OCV before"],
+        "1.0 V before": ["0.5 V before", "1.0 V after"],
+        "OCV after": ["1.0 V after", "OCV before"],
+        "1.0 V after": ["1.0 V before", "OCV after"],
+    }
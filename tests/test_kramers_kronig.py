@@ -0,0 +1,70 @@
+import numpy as np
+
+from kramers_kronig import Factorization, design_matrix, validate_spectra
+
+
+def spectra(omega, count, seed=3):
+    """
+    Impedances of series resistances, RC elements and capacitances of
+    random size, with a little noise.
+    """
+    rng = np.random.default_rng(seed)
+    r0, r1, tau, c = rng.uniform(0.5, 2.0, (4, count, 1))
+    z = r0 + r1 / (1 + 1j * omega * tau * 1e-3) + 1 / (1j * omega * c)
+    noise = rng.normal(scale=1e-3, size=z.shape) * (1 + 1j)
+    return z * (1 + noise)
+
+
+def lstsq_fit(omega, z, elements):
+    """
+    The Lin-KK fit of one spectrum by a direct weighted least squares solve.
+    """
+    matrix = design_matrix(omega, elements)
+    weights = np.tile(1 / np.abs(z), 2)
+    rhs = np.concatenate([z.real, z.imag])
+    # columns scaled to unit length; unscaled, the inductance column alone
+    # costs lstsq several digits
+    weighted = matrix * weights[:, None]
+    scale = np.linalg.norm(weighted, axis=0)
+    solution = np.linalg.lstsq(weighted / scale, rhs * weights, rcond=None)[0]
+    stacked = matrix @ (solution / scale)
+    return stacked[: len(omega)] + 1j * stacked[len(omega) :]
+
+
+def test_factorization_matches_lstsq():
+    omega = 2 * np.pi * np.logspace(-2, 5, 40)
+    z = spectra(omega, 6)
+    for elements in [3, 6, 10]:
+        matrix = design_matrix(omega, elements)
+        weights = np.tile(1 / np.abs(z), 2)
+        rhs = np.concatenate([z.real, z.imag], axis=1)
+        # every spectrum keeps its own weights in the shared factorization
+        stacked = Factorization(matrix).solve(rhs, weights) @ matrix.T
+        fits = stacked[:, : len(omega)] + 1j * stacked[:, len(omega) :]
+        for row in range(len(z)):
+            expected = lstsq_fit(omega, z[row], elements)
+            assert np.allclose(fits[row], expected, rtol=0, atol=1e-9 * np.abs(z[row]))
+
+
+def test_results_do_not_depend_on_the_batch():
+    omega = 2 * np.pi * np.logspace(-2, 5, 40)
+    z = list(spectra(omega, 5))
+    omegas = [omega] * 5
+    # another grid, a missing point, and too few points to validate
+    omegas.append(omega[::2])
+    z.append(spectra(omega[::2], 1, seed=4)[0])
+    z[2] = z[2].copy()
+    z[2][7] = np.nan
+    omegas.append(omega[:4])
+    z.append(z[0][:4])
+
+    batch = validate_spectra(omegas, z)
+    assert batch[-1] is None
+    assert len(batch[2].omega) == len(omega) - 1
+    for row, result in enumerate(batch[:-1]):
+        single = validate_spectra([omegas[row]], [z[row]])[0]
+        assert single.elements == result.elements
+        assert np.allclose(single.fit, result.fit, rtol=1e-12)
+        assert single.passed == result.passed
+        expected = lstsq_fit(result.omega, z[row][np.isfinite(z[row])], result.elements)
+        assert np.allclose(result.fit, expected, rtol=0, atol=1e-9 * np.abs(result.fit))
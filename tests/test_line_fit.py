@@ -0,0 +1,43 @@
+import numpy as np
+
+from line_fit import fit_segments
+
+
+def test_fit_segments_matches_polyfit():
+    rng = np.random.default_rng(0)
+    counts = [2, 5, 40, 3, 400]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    # test times in seconds are large, fits must not lose precision to them
+    x = 1e6 + np.cumsum(rng.uniform(0.5, 1.5, offsets[-1]))
+    y = rng.normal(size=offsets[-1]) + 1e-3 * x
+
+    fit = fit_segments(x, y, offsets)
+    for segment, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        xs, ys = x[start:end], y[start:end]
+        slope, intercept = np.polyfit(xs, ys, deg=1)
+        assert np.isclose(fit.slope[segment], slope, rtol=1e-6)
+        # polyfit's intercept at x = 0 is itself rounded, compare the lines
+        line = fit.slope[segment] * xs + fit.intercept[segment]
+        assert np.allclose(line, slope * xs + intercept, atol=1e-6)
+
+        residual = ys - np.polyval([slope, intercept], xs)
+        r_squared = 1 - (residual**2).sum() / ((ys - ys.mean()) ** 2).sum()
+        assert np.isclose(fit.r_squared[segment], r_squared, rtol=1e-6, atol=1e-9)
+        if end - start > 2:
+            std_error = np.sqrt((residual**2).sum() / (end - start - 2))
+            assert np.isclose(fit.std_error[segment], std_error, rtol=1e-6)
+        else:
+            assert np.isnan(fit.std_error[segment])
+
+
+def test_fit_segments_degenerate_segments():
+    x = np.arange(7, dtype=float)
+    y = np.array([1.0, 3.0, 3.0, 3.0, 5.0, 7.0, 9.0])
+    # empty, single point, flat, and an exact line
+    fit = fit_segments(x, y, [0, 0, 1, 4, 7])
+    assert np.isnan(fit.slope[0]) and np.isnan(fit.r_squared[0])
+    assert np.isnan(fit.slope[1]) and np.isnan(fit.std_error[1])
+    assert fit.slope[2] == 0 and np.isnan(fit.r_squared[2])
+    assert fit.std_error[2] == 0
+    assert np.isclose(fit.slope[3], 2) and np.isclose(fit.r_squared[3], 1)
+    assert np.isclose(fit.std_error[3], 0)